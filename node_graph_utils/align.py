@@ -4,7 +4,7 @@ from collections import defaultdict
 import nuke
 
 from .dag import (sort_nodes_by_position, sort_nodes_by_distance,
-                  get_nodes_bounds, NodeWrapper, node_center)
+                  get_nodes_bounds, NodeWrapper, node_center, backdrop_contents_for)
 
 
 def smart_align(direction, selection=None):
@@ -24,8 +24,9 @@ def smart_align(direction, selection=None):
 
     # Store margins for the backdrop nodes:
     backdrops = [nw for nw in selection if nw.is_backdrop]
+    contents = backdrop_contents_for(backdrops)
     for backdrop in backdrops:
-        backdrop.store_margins()
+        backdrop.store_margins(contents)
 
     # --------------------------------------
     # MULTIPLE NODES
@@ -140,8 +141,9 @@ def distribute_nodes(nodes, axis=0, tolerance=6):
         return
 
     # Store backdrops margins
+    contents = backdrop_contents_for(backdrops)
     for bd in backdrops:
-        bd.store_margins()
+        bd.store_margins(contents)
 
     positions = sorted(rows.items())
     last_row = positions[-1][0]
@@ -5,7 +5,7 @@ import nuke
 from Qt import QtWidgets
 
 from .colors import random_colour, rgba_float_to_dec
-from .dag import NodeWrapper
+from .dag import NodeWrapper, backdrop_contents_for
 
 
 # Backdrops
@@ -172,5 +172,9 @@ def snap_backdrops_to_contents():
 
     backdrops = sorted(backdrops, key=lambda bd: bd.node['z_order'].value(), reverse=True)
 
-    for backdrop in backdrops:
-        backdrop.place_around_nodes(backdrop.node.getNodes(), 50)
+    # Contents are read before moving any backdrop, outer backdrops fit around the inner ones once they are resized
+    contents = backdrop_contents_for(backdrops)
+    backdrop_nodes = [contents.contents(backdrop.node) if contents else backdrop.node.getNodes()
+                      for backdrop in backdrops]
+    for backdrop, nodes in zip(backdrops, backdrop_nodes):
+        backdrop.place_around_nodes(nodes, 50)
@@ -1,11 +1,14 @@
+from collections import OrderedDict
 from contextlib import contextmanager
 import nuke
 
 import math
 from Qt import QtCore
 
-from .dag import NodeWrapper, get_node_bounds, get_nodes_bounds, last_clicked_position, get_label_size
+from .dag import NodeWrapper, get_node_bounds, get_nodes_bounds, last_clicked_position, get_label_size, node_id
 from .backdrops import auto_backdrop
+from .virtual import VirtualNode, is_virtual, materialize_nodes, nodes as virtual_nodes
+from .spatial import non_colliding_shift
 
 
 class NodeBranch(object):
@@ -19,23 +22,42 @@ class NodeBranch(object):
         branch = cls()
         branch.root = root
         branch.leaf = leaf
-        branch._nodes = nodes
+        branch._add_nodes(nodes)
+        branch._invalidate_bounds()
         wrapper = NodeWrapper(leaf)
         branch.cursor = wrapper.center().toPoint()
         branch.move_cursor(rows=1)
         return branch
 
-    def __init__(self, start=None):
-
+    def __init__(self, start=None, virtual=False):
+        """
+        Parameters
+        ----------
+        start: nuke.Node or NodeWrapper or QtCore.QPoint or tuple, optional
+            Node or position to start the branch from. Defaults to the last clicked position in the DAG.
+        virtual: bool
+            If True, nodes created by the branch are virtual nodes, which only get created in nuke
+            when calling `materialize`. Nodes added to a virtual branch should be virtual too (see `create_node`).
+        """
+        self.virtual = virtual
         self.root = None
         self.leaf = None
-        self._nodes = []
+        # Insertion ordered set of the nodes, keyed by node id
+        self._nodes = OrderedDict()
+        self.trunk_branch = None
+        self.sub_branches = []
+        self._flattened_stack = None  # Cache, see `flattened_stack`
+        # Running bounding rect of this branch's own nodes, None when the branch is empty.
+        self._bounds = None
+        self._bounds_valid = True
+        # Other branches sharing nodes with this one (through `append`), their bounds change when this one moves.
+        self._linked_branches = set()
 
         if not start:
             start = last_clicked_position()
 
         # We can start a branch either from a position or a node
-        if isinstance(start, nuke.Node):
+        if isinstance(start, (nuke.Node, VirtualNode)):
             start = NodeWrapper(start)
 
         if isinstance(start, NodeWrapper):
@@ -43,13 +65,11 @@ class NodeBranch(object):
             self.move_cursor(rows=1)
             self.root = start.node
             self.leaf = start.node
-            self._nodes.append(start.node)
+            self._add_nodes([start.node])
+            self._grow_bounds(start.bounds)
         else:
             self.cursor = DagGrid.nearest_grid_point(self._to_q_point(start))
 
-        self.trunk_branch = None
-        self.sub_branches = []
-
     def __nonzero__(self):
         return bool(self.nodes())
 
@@ -71,6 +91,13 @@ class NodeBranch(object):
         else:
             raise TypeError("Invalid point provided for branch. Expected tuple or QPoint.")
 
+    def _add_nodes(self, nodes):
+        """ Add nodes to this branch, nodes already in the branch are ignored """
+        for node in nodes:
+            key = node_id(node)
+            if key not in self._nodes:
+                self._nodes[key] = node
+
     def _add_sub_branch(self, sub_branch):
         """"""
         # If sub_branch is the trunk of this, reverse the order.
@@ -78,31 +105,140 @@ class NodeBranch(object):
         if sub_branch is self.trunk_branch:
             self.trunk_branch = None
         if self in sub_branch.sub_branches:
-            sub_branch.sub_branches_branche.remove(self)
+            sub_branch.sub_branches.remove(self)
+            sub_branch._invalidate_stack()
 
         # Make self the sub_branch's trunk, and add the sub_branch to sub_branches
         sub_branch.trunk_branch = self
         if sub_branch not in self.sub_branches:
             self.sub_branches.append(sub_branch)
+        self._invalidate_stack()
+
+    def _invalidate_stack(self):
+        """ Clear the cached flattened stack of this branch and of the branches it's a sub-branch of """
+        branch = self
+        visited = set()
+        while branch is not None and branch not in visited:
+            visited.add(branch)
+            branch._flattened_stack = None
+            branch = branch.trunk_branch
 
     # TODO: root attribute to get top root or local root?
     # TODO: Would it be useful to have an option to crawl nodes upstream of the root to add to the branch?
 
+    def _own_bounds(self):
+        """ Bounds of this branch's own nodes, recalculated only if they were invalidated """
+        if not self._bounds_valid:
+            nodes = list(self._nodes.values())
+            self._bounds = get_nodes_bounds(nodes) if nodes else None
+            self._bounds_valid = True
+        return self._bounds
+
+    def _grow_bounds(self, rect):
+        """ Extend the running bounds with the rectangle of a node added to the branch """
+        if not self._bounds_valid:
+            return  # Will be recalculated with the new node anyway
+        if self._bounds is None:
+            self._bounds = QtCore.QRectF(rect)
+        else:
+            self._bounds |= rect
+
+    def _invalidate_bounds(self):
+        self._bounds_valid = False
+
     def bounds(self, include_sub_branches=True):
-        return get_nodes_bounds(self.nodes(include_sub_branches=include_sub_branches))
+        """
+        Bounding rectangle of the branch nodes. Bounds are tracked as nodes get added and moved,
+        so this doesn't query Nuke unless nodes were changed outside of the branch methods.
+
+        Args:
+            include_sub_branches (bool): Whether to include the bounds of sub branches
+
+        Returns:
+            QtCore.QRectF
+        """
+        branches = self.flattened_stack() if include_sub_branches else [self]
+        bounds = None
+        for branch in branches:
+            branch_bounds = branch._own_bounds()
+            if branch_bounds is None:
+                continue
+            if bounds is None:
+                bounds = QtCore.QRectF(branch_bounds)  # Make a new rect, so we don't modify the cached one
+            else:
+                bounds |= branch_bounds
+        if bounds is None:
+            raise ValueError("No nodes in branch to get bounds for")
+        return bounds
+
+    def flattened_stack(self):
+        """
+        Get this branch and all its sub-branches, recursively.
+        The result is cached until the sub-branches change.
 
-    def flattened_stack(self, stack=None):
-        if stack is None:
+        Returns:
+            list[NodeBranch]
+        """
+        if self._flattened_stack is None:
             stack = []
+            visited = set()
+            self._flatten_into(stack, visited)
+            self._flattened_stack = stack
+        return list(self._flattened_stack)
+
+    def _flatten_into(self, stack, visited):
         stack.append(self)
+        visited.add(self)
         for sub_branch in self.sub_branches:
-            if sub_branch not in stack:
-                sub_branch.flattened_stack(stack)
-        return stack
+            if sub_branch not in visited:
+                sub_branch._flatten_into(stack, visited)
+
+    def create_node(self, node_class, **knobs):
+        """
+        Create a node matching the branch mode, without adding it to the branch
+
+        Parameters
+        ----------
+        node_class: str
+        knobs:
+            Knob values, like when calling `nuke.nodes.Grade(white=2)`
+
+        Returns
+        -------
+        nuke.Node or VirtualNode
+        """
+        factory = virtual_nodes if self.virtual else nuke.nodes
+        return getattr(factory, node_class)(**knobs)
+
+    def materialize(self):
+        """
+        Create the virtual nodes of this branch, its sub-branches and appended branches in a single paste.
+
+        Returns
+        -------
+        list[nuke.Node]
+            Created nodes
+        """
+        return materialize([self])
+
+    def _replace_nodes(self, created):
+        """ Swap virtual nodes for the nuke nodes which were created from them """
+        def real(node):
+            return created.get(node, node) if is_virtual(node) else node
+
+        nodes = OrderedDict()
+        for node in self._nodes.values():
+            node = real(node)
+            nodes[node_id(node)] = node
+        self._nodes = nodes
+        self.root = real(self.root)
+        self.leaf = real(self.leaf)
+        self.virtual = False
+        self._invalidate_bounds()  # Real nodes may not have exactly the same size as the virtual ones
 
     def add_node(self, node):
         """"""
-        self._nodes.append(node)
+        self._add_nodes([node])
         wrapper = NodeWrapper(node)
 
         # In case the given node is backdrop, we add it in the flow and move the cursor below the backdrop.
@@ -115,6 +251,7 @@ class NodeBranch(object):
         else:
             wrapper.moveCenter(self.cursor + QtCore.QPoint(0, wrapper.height() // 2))
             self.move_cursor(rows=DagGrid.convert_position_to_cells(QtCore.QPoint(*wrapper.size().toTuple())).y() + 1)
+        self._grow_bounds(wrapper.bounds)
 
         if self.root is None:
             self.root = node
@@ -145,7 +282,8 @@ class NodeBranch(object):
             step = 1 if other_branch.cursor.x() >= self.cursor.x() else -1
 
             branches_to_place = other_branch.flattened_stack()
-            fixed_branches = [branch for branch in self.flattened_stack() if branch not in branches_to_place]
+            placing = set(branches_to_place)
+            fixed_branches = [branch for branch in self.flattened_stack() if branch not in placing]
             columns_offset = calculate_non_colliding_column_offset(branches_to_place, fixed_branches,
                                                                    DagGrid.width(), step)
             other_branch.translate_by((columns_offset * DagGrid.width(), 0))
@@ -155,7 +293,7 @@ class NodeBranch(object):
         self.cursor.setY(cursor_y)
         other_branch.cursor.setY(cursor_y)
         # Add Dot in other branch
-        dot = nuke.nodes.Dot()
+        dot = self.create_node('Dot')
         other_branch.add_node(dot)
         self.add_node(merge_node)
         merge_node.setInput(merge_input, dot)
@@ -164,11 +302,13 @@ class NodeBranch(object):
     def append(self, other_branch):
         """"""
         other_branch.move_root_to(self.cursor)
-        for node in other_branch.nodes():
-            if node not in self._nodes:
-                self._nodes.append(node)
+        self._add_nodes(other_branch.nodes())
+        for branch in other_branch.flattened_stack():
+            branch._linked_branches.add(self)
+            self._linked_branches.add(branch)
 
         if other_branch:
+            self._grow_bounds(other_branch.bounds())
             if other_branch.root.Class() not in ['StickyNote', 'Backdrop', 'Read']:
                 # Weirdly enough, Nuke won't complain is trying to set input on these input-less nodes,
                 # but will result in an odd script state.
@@ -185,12 +325,12 @@ class NodeBranch(object):
 
         # If our leaf is a Dot, we use it directly as our fork node
         if not self.leaf or not self.leaf.Class() == "Dot":
-            self.add_node(nuke.nodes.Dot())
+            self.add_node(self.create_node('Dot'))
 
         start = get_node_bounds(self.leaf).center()
 
-        new_branch = NodeBranch()
-        new_branch.add_node(nuke.nodes.Dot())
+        new_branch = NodeBranch(start, virtual=self.virtual)
+        new_branch.add_node(new_branch.create_node('Dot'))
         new_branch.root.setInput(0, self.leaf)
         new_branch.move_root_to(start + QtCore.QPoint(DagGrid.width() * columns, 0))
         return new_branch
@@ -219,35 +359,47 @@ class NodeBranch(object):
         if snap_to_grid:
             offset = DagGrid.nearest_grid_point(offset)  # TODO: Snap each node instead?
         for node in self.nodes(include_sub_branches=include_sub_branches):
-            NodeWrapper(node).translate(offset)
+            node.setXYpos(node.xpos() + offset.x(), node.ypos() + offset.y())
         # Move cursor too
         self.cursor += offset
 
+        # Every node of the moved branches moved, so their bounds can simply follow.
+        # Linked branches only had some of their nodes moved, their bounds need recalculating.
+        moved_branches = self.flattened_stack() if include_sub_branches else [self]
+        moved = set(moved_branches)
+        for branch in moved_branches:
+            if branch._bounds_valid and branch._bounds is not None:
+                branch._bounds.translate(offset)
+            for linked_branch in branch._linked_branches:
+                if linked_branch not in moved:
+                    linked_branch._invalidate_bounds()
+
     def move_cursor(self, rows=0, columns=0):
         """"""
         self.cursor += QtCore.QPoint(DagGrid.width() * columns, DagGrid.height() * rows)
 
     def nodes(self, include_sub_branches=True):
         """"""
-        if include_sub_branches:
-            nodes = []
-            stack = self.flattened_stack()
-            for branch in stack:
-                for node in branch.nodes(include_sub_branches=False):
-                    if node not in nodes:
-                        nodes.append(node)
-        else:
-            nodes = self._nodes
+        if not include_sub_branches:
+            return list(self._nodes.values())
 
-        return nodes
+        nodes = OrderedDict()
+        for branch in self.flattened_stack():
+            for key, node in branch._nodes.items():
+                if key not in nodes:
+                    nodes[key] = node
+        return list(nodes.values())
 
     def add_backdrop(self, label=None, include_sub_branches=True, **kwargs):  # TODO: Allow color attribute
         """"""
+        if kwargs.get('backdrop_node') is None:
+            kwargs['backdrop_node'] = self.create_node('BackdropNode')
         backdrop = auto_backdrop(self.nodes(include_sub_branches=include_sub_branches), text=label, **kwargs)
-        self._nodes.append(backdrop)
+        self._add_nodes([backdrop])
 
         # Offset the cursor to have it now under the backdrop
         wrapper = NodeWrapper(backdrop)
+        self._grow_bounds(wrapper.bounds)
         offset = wrapper.bottom() - self.cursor.y()
         self.move_cursor(rows=DagGrid.convert_position_to_cells(QtCore.QPoint(0, offset)).y() + 1)
 
@@ -257,8 +409,8 @@ class NodeBranch(object):
     def backdrop_context(self, label=None, font_size=40, hue=None, saturation=None, brightness=None,
                          center_label=False, bold=False):
         """ Only supports adding nodes """
-        nodes_at_enter = set(self._nodes)
-        backdrop = nuke.nodes.BackdropNode()
+        nodes_at_enter = set(self._nodes)  # Node ids
+        backdrop = self.create_node('BackdropNode')
         wrapper = NodeWrapper(backdrop)
         backdrop['note_font_size'].setValue(font_size)
         if label:
@@ -272,9 +424,8 @@ class NodeBranch(object):
         yield backdrop
 
         # Wrap around added nodes
-        nodes_at_exit = set(self._nodes)
-        added_nodes = nodes_at_exit - nodes_at_enter
-        auto_backdrop(list(added_nodes), text=label, font_size=font_size, hue=hue, saturation=saturation,
+        added_nodes = [node for key, node in self._nodes.items() if key not in nodes_at_enter]
+        auto_backdrop(added_nodes, text=label, font_size=font_size, hue=hue, saturation=saturation,
                       brightness=brightness, center_label=center_label, bold=bold, backdrop_node=backdrop)
 
         # Put cursor under the backdrop
@@ -282,7 +433,8 @@ class NodeBranch(object):
         offset = wrapper.bottom() - self.cursor.y()
         self.move_cursor(rows=DagGrid.convert_position_to_cells(QtCore.QPoint(0, offset)).y() + 1)
 
-        self._nodes.append(backdrop)
+        self._add_nodes([backdrop])
+        self._grow_bounds(wrapper.bounds)
 
 
 # TODO: Need to find a system to make grid snapping not create too many odd gaps both with the regular layout and the
@@ -422,6 +574,17 @@ class BranchLayoutBase(object):
         """ Organize all the items in this layout """
         raise NotImplementedError()
 
+    def materialize(self):
+        """
+        Create the virtual nodes of all the branches in this layout and of the backdrop, in a single paste.
+
+        Returns
+        -------
+        list[nuke.Node]
+            Created nodes
+        """
+        return materialize([self])
+
 
 class BranchLayout(BranchLayoutBase):
     """
@@ -594,10 +757,24 @@ class GridBranchLayout(BranchLayoutBase):
     | 3 | 6 |   |
     +---+---+---+
 
+    The `packing` attribute defines how cells are sized:
+    - `UNIFORM_CELLS` (default): All cells have the size of the largest item, so a few large items make a sparse grid.
+    - `FIT_CELLS`: Same rows and columns, but each row is as tall as its tallest item,
+    and each column as wide as its widest item.
+    - `SHELF_PACKING`: Items are sorted by height and packed in rows (shelves), each as tall as its first item.
+    Rows are about as long as a row of `columns` average items. Item order is not preserved.
+    With `transpose`, shelves are columns instead, and items are sorted by width.
+    In all modes, items are aligned within their cell using the `alignment` attribute.
+
     The `spacing` attribute can be set to define how much space should be inserted between items.
     Note that only multiples of the user's grid size will be used, with a minimum of one grid size of spacing, so this
     number should be considered more like a hint than an actual value.
     """
+
+    UNIFORM_CELLS = 0
+    FIT_CELLS = 1
+    SHELF_PACKING = 2
+
     def __init__(self, items=None):
         """
         Parameters
@@ -609,6 +786,7 @@ class GridBranchLayout(BranchLayoutBase):
         self.columns = 5
         self.transpose = False
         self.alignment = QtCore.Qt.AlignCenter
+        self.packing = self.UNIFORM_CELLS
 
     def _get_correct_anchor(self, bounds):
         """ Get the correct anchor point based on alignment"""
@@ -659,6 +837,10 @@ class GridBranchLayout(BranchLayoutBase):
         if not non_null_items:
             return
 
+        if self.packing != self.UNIFORM_CELLS:
+            self._layout_in_cells(non_null_items, all_bounds)
+            return
+
         spacer_x = QtCore.QPoint(max(self.spacing, DagGrid.width()) + max_w, 0)
         spacer_y = QtCore.QPoint(0, max(self.spacing, DagGrid.height()) + max_h)
         # The first item is used as our anchor (first item doesn't move,
@@ -686,6 +868,113 @@ class GridBranchLayout(BranchLayoutBase):
         if self._backdrop:
             self._backdrop.place_around_bounds(self.bounds(exclude_backdrop=True))
 
+    def _layout_in_cells(self, items, all_bounds):
+        """ Place items in cells of different sizes, see `packing` """
+        spacing_x = max(self.spacing, DagGrid.width())
+        spacing_y = max(self.spacing, DagGrid.height())
+        sizes = [(bounds.width(), bounds.height()) for bounds in all_bounds]
+        if self.packing == self.SHELF_PACKING:
+            cells = self._shelf_cells(sizes, spacing_x, spacing_y)
+        else:
+            cells = self._fit_cells(sizes, spacing_x, spacing_y)
+
+        # Cells are calculated from 0, 0. Offset them all so the first item doesn't move
+        shift = QtCore.QPointF(self._get_correct_anchor(all_bounds[0])) - QtCore.QPointF(
+            self._get_correct_anchor(cells[0]))
+        for item, bounds, cell in zip(items, all_bounds, cells):
+            cell.translate(shift)
+            item.translate_by(QtCore.QPointF(self._get_correct_anchor(cell)) -
+                              QtCore.QPointF(self._get_correct_anchor(bounds)))
+
+        if self._backdrop:
+            self._backdrop.place_around_bounds(self.bounds(exclude_backdrop=True))
+
+    def _fit_cells(self, sizes, spacing_x, spacing_y):
+        """
+        Calculate cells in rows and columns, each row being as tall as its tallest item,
+        and each column as wide as its widest item
+
+        Parameters
+        ----------
+        sizes: list[tuple[float, float]]
+            Width and height of each item
+        spacing_x: int
+        spacing_y: int
+
+        Returns
+        -------
+        list[QtCore.QRectF]
+            Cell of each item
+        """
+        indices = []
+        widths = {}
+        heights = {}
+        for i, (width, height) in enumerate(sizes):
+            major, minor = divmod(i, self.columns)
+            column, row = (major, minor) if self.transpose else (minor, major)
+            indices.append((column, row))
+            widths[column] = max(widths.get(column, 0), width)
+            heights[row] = max(heights.get(row, 0), height)
+
+        lefts = [0]
+        for column in range(1, len(widths)):
+            lefts.append(lefts[-1] + widths[column - 1] + spacing_x)
+        tops = [0]
+        for row in range(1, len(heights)):
+            tops.append(tops[-1] + heights[row - 1] + spacing_y)
+
+        return [QtCore.QRectF(lefts[column], tops[row], widths[column], heights[row]) for column, row in indices]
+
+    def _shelf_cells(self, sizes, spacing_x, spacing_y):
+        """
+        Pack items on shelves (Next Fit Decreasing Height).
+        Items are sorted by decreasing height, and added to the current shelf until it gets full.
+
+        Parameters
+        ----------
+        sizes: list[tuple[float, float]]
+            Width and height of each item
+        spacing_x: int
+        spacing_y: int
+
+        Returns
+        -------
+        list[QtCore.QRectF]
+            Cell of each item
+        """
+        # Work with the length of the items along the shelf, and their thickness across shelves,
+        # so the same code makes vertical shelves when transposed.
+        if self.transpose:
+            dimensions = [(height, width) for width, height in sizes]
+            gap_along, gap_across = spacing_y, spacing_x
+        else:
+            dimensions = sizes
+            gap_along, gap_across = spacing_x, spacing_y
+
+        # Aim for as many shelves as there would be rows in a regular grid
+        shelves = int(math.ceil(len(dimensions) / float(self.columns)))
+        total_length = sum(length for length, _thickness in dimensions) + gap_along * (len(dimensions) - shelves)
+        max_length = max(max(length for length, _thickness in dimensions), total_length / shelves)
+
+        cells = [None] * len(dimensions)
+        along = across = 0
+        shelf_thickness = None
+        for i in sorted(range(len(dimensions)), key=lambda index: dimensions[index][1], reverse=True):
+            length, thickness = dimensions[i]
+            if shelf_thickness is None:
+                shelf_thickness = thickness
+            elif along + length > max_length:
+                # Shelf is full, start a new one
+                across += shelf_thickness + gap_across
+                along = 0
+                shelf_thickness = thickness
+            if self.transpose:
+                cells[i] = QtCore.QRectF(across, along, shelf_thickness, length)
+            else:
+                cells[i] = QtCore.QRectF(along, across, length, shelf_thickness)
+            along += length + gap_along
+        return cells
+
 
 class DagGrid(object):
     _size = None
@@ -754,26 +1043,82 @@ class DagGrid(object):
         return QtCore.QPoint(x, y)
 
 
+def materialize(items):
+    """
+    Create the nuke nodes for virtual branches and layouts, with a single paste for all of them.
+
+    The branches, their sub-branches, the branches appended to them and the layout backdrops are updated to use
+    the created nodes, so they can still be used afterwards.
+
+    Parameters
+    ----------
+    items: list[NodeBranch or BranchLayoutBase]
+
+    Returns
+    -------
+    list[nuke.Node]
+        Created nodes
+    """
+    branches = []
+    backdrops = []
+    visited = set()
+    to_visit = list(items)
+    while to_visit:
+        item = to_visit.pop()
+        if item in visited:
+            continue
+        visited.add(item)
+        if isinstance(item, BranchLayoutBase):
+            to_visit.extend(item._items)
+            if item._backdrop:
+                backdrops.append(item._backdrop)
+        else:
+            branches.append(item)
+            to_visit.extend(item.flattened_stack())
+            to_visit.extend(item._linked_branches)
+
+    nodes = OrderedDict()
+    for node in [n for branch in branches for n in branch._nodes.values()] + [bd.node for bd in backdrops]:
+        if is_virtual(node):
+            nodes[id(node)] = node
+    created = materialize_nodes(list(nodes.values()))
+
+    for branch in branches:
+        branch._replace_nodes(created)
+    for backdrop in backdrops:
+        if is_virtual(backdrop.node):
+            backdrop.node = created[backdrop.node]
+    return list(created.values())
+
+
 def calculate_non_colliding_column_offset(branches_to_move, branches_to_collide, column_width, direction):
+    """
+    Find the smallest number of columns to shift some branches by, so they don't collide with other branches.
+
+    Rather than shifting one column at a time and testing again, the forbidden ranges of shifts are worked out
+    directly from the x extents of the branches, see `spatial.non_colliding_shift`.
+
+    Parameters
+    ----------
+    branches_to_move: list[NodeBranch]
+    branches_to_collide: list[NodeBranch]
+        Branches that stay in place. Branches also in `branches_to_move` are ignored.
+    column_width: int
+    direction: int
+        1 to shift to the right, -1 to shift to the left
+
+    Returns
+    -------
+    int
+        Number of columns to shift by, signed with the direction
+    """
+    moving = set(branches_to_move)
     movable_rects = [branch.bounds(include_sub_branches=False) for branch in branches_to_move]
     fixed_rects = [branch.bounds(include_sub_branches=False) for branch in branches_to_collide
-                   if branch not in branches_to_move]
-    columns = 0
-    collides = True
-    while collides:
-        collides = False
-        for i in movable_rects:
-            if collides:
-                break  # No need to continue if we collide already
-            for j in fixed_rects:
-                if i.intersects(j):
-                    collides = True
-                    break
-        if collides:
-            columns += 1
-            for rect in movable_rects:
-                rect.translate(column_width*direction, 0)
-    return columns * direction
+                   if branch not in moving]
+    return non_colliding_shift([(rect.left(), rect.top(), rect.right(), rect.bottom()) for rect in movable_rects],
+                               [(rect.left(), rect.top(), rect.right(), rect.bottom()) for rect in fixed_rects],
+                               column_width, direction)
 
 
 # def line_up_branches(branches, spacing=25):
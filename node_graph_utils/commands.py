@@ -0,0 +1,179 @@
+"""
+Nuke commands and menus
+"""
+import os
+from functools import partial
+
+import nuke
+from Qt import QtWidgets
+
+from . import align
+from . import backdrops
+from . import branch
+from . import colors
+from . import crossings
+from . import dag
+from . import labeler
+from . import layout_engine
+from . import lint_panel
+from . import membership
+from . import scale_widget
+from . import search
+from . import snapshot
+# Experimental
+from . import snippy
+from . import snappy
+
+# TODO: Refactor for delayed imports
+
+# Re-exported by the package __init__ when running in nuke
+__all__ = ['align_selection', 'scale_tree', 'mirror_nodes', 'relabel', 'find_and_summon', 'layout_lint',
+           'reduce_crossings', 'snap_to_grid', 'interval', 'auto_layout', 'install_menus', 'install_auto_dot_color']
+
+
+# Mini functions definitions, can be called via menus or API
+def align_selection(direction):
+    nodes = nuke.selectedNodes()
+    align.smart_align(direction, nodes)
+
+
+def scale_tree():
+    """ Scale tree with a bounding widget. """
+    global scale_tree_widget
+    this_dag = dag.get_current_dag()
+    scale_tree_widget = scale_widget.ScaleWidget(this_dag)
+    scale_tree_widget.show()
+
+
+def mirror_nodes():
+    """ Mirror nodes in X """
+    align.mirror_nodes(nuke.selectedNodes())
+
+
+def relabel():
+    """ Change the node(s) label"""
+    global relabel_popup
+    relabel_popup = labeler.Labeller()
+    relabel_popup.run()
+
+
+def find_and_summon():
+    """ Find nodes by name, class, label or colour, and summon them """
+    global search_popup
+    search_popup = search.SearchPopup()
+    search_popup.run()
+
+
+def layout_lint():
+    """ List the layout problems of the current DAG """
+    global layout_lint_panel
+    layout_lint_panel = lint_panel.LintPanel(parent=QtWidgets.QApplication.activeWindow())
+    layout_lint_panel.run()
+
+
+def reduce_crossings():
+    """ Swap the selected nodes, or all the nodes of the current group, to uncross their connections """
+    nodes = nuke.allNodes()
+    node_ids = [dag.node_id(node) for node in nuke.selectedNodes()] or None
+    graph = snapshot.GraphSnapshot.from_nodes(nodes)
+    rects = crossings.reduce_crossings(graph, node_ids)
+    if crossings.count_crossings(graph, rects) < crossings.count_crossings(graph):
+        dag.commit_positions(nodes, rects, undo_name='Reduce Crossings')
+
+
+def snap_to_grid():
+    """ Snap the selected nodes, or all the nodes of the current group, to the grid, then fit their backdrops """
+    all_nodes = nuke.allNodes()
+    nodes = dag.with_backdrop_contents(nuke.selectedNodes()) or all_nodes
+    node_ids = [dag.node_id(node) for node in nodes]
+    graph = snapshot.GraphSnapshot.from_nodes(all_nodes)
+    rects = layout_engine.snap_to_grid(graph, node_ids, grid_size=dag.get_grid_size())
+
+    # Contents are read before snapping, backdrops around the snapped nodes are fitted to their new positions
+    backdrop_membership = membership.BackdropMembership.from_snapshot(graph)
+    backdrop_ids = set(key for key in node_ids if graph[key].is_backdrop)
+    for key in node_ids:
+        backdrop_ids.update(backdrop_membership.backdrops_around(key))
+    contents = dict((key, list(backdrop_membership.contents(key))) for key in backdrop_ids)
+    rects.update(layout_engine.fit_backdrops(graph, contents, rects))
+    dag.commit_positions(all_nodes, rects, undo_name='Snap to Grid')
+
+
+def interval(axis=dag.AXIS_X):
+    align.distribute_nodes(nuke.selectedNodes(), axis, 6 if axis == dag.AXIS_X else 2)
+
+
+def auto_layout():
+    """ Lay out the selected nodes, or all the nodes of the current group, following their connections """
+    nodes = nuke.selectedNodes() or nuke.allNodes()
+    node_ids = [dag.node_id(node) for node in nodes]
+    # Backdrops around the nodes get fitted to their new positions, even if they're not selected
+    selected = set(node_ids)
+    backdrop_nodes = [node for node in nuke.allNodes('BackdropNode') if dag.node_id(node) not in selected]
+    graph = snapshot.GraphSnapshot.from_nodes(nodes + backdrop_nodes)
+    rects = layout_engine.layered_layout_partitioned(graph, node_ids, column_width=branch.DagGrid.width(),
+                                                     row_height=branch.DagGrid.height())
+    dag.commit_positions(nodes + backdrop_nodes, rects, undo_name='Auto Layout')
+
+
+def install_menus(icons_root=None, install_experimental_menus=False):
+    """ Create menu entry for all the alignment nodes """
+    def _get_icon(name):
+        if not icons_root:
+            return '/'
+        path = os.path.join(icons_root, name) + '.png'
+        return path.replace('\\', '/')
+
+    organize_menu = nuke.menu('Nuke').addMenu('Organize Nodes', icon=_get_icon('align_center_x'))
+
+    organize_menu.addCommand('Align Nodes - Left', partial(align_selection, dag.LEFT), 'meta+4', shortcutContext=2,
+                             icon=_get_icon('align_left'))
+    organize_menu.addCommand('Align Nodes - Right', partial(align_selection, dag.RIGHT), 'meta+6', shortcutContext=2,
+                             icon=_get_icon('align_right'))
+    organize_menu.addCommand('Align Nodes - Center X', partial(align_selection, dag.CENTER_X), 'meta+5',
+                             shortcutContext=2, icon=_get_icon('align_center_x'))
+    organize_menu.addCommand('Align Nodes - Top', partial(align_selection, dag.UP), 'meta+8', shortcutContext=2,
+                             icon=_get_icon('align_top'))
+    organize_menu.addCommand('Align Nodes - Bottom', partial(align_selection, dag.DOWN), 'meta+2', shortcutContext=2,
+                             icon=_get_icon('align_bottom'))
+    organize_menu.addCommand('Align Nodes - Center Y', partial(align_selection, dag.CENTER_Y), 'meta+ctrl+5',
+                             shortcutContext=2, icon=_get_icon('align_center_y'))
+    organize_menu.addSeparator()
+
+    organize_menu.addCommand('Scale Nodes', scale_tree, 'ctrl++', shortcutContext=2, icon=_get_icon('scale_nodes'))
+    organize_menu.addCommand('Distribute Nodes Horizontally', partial(interval, dag.AXIS_X), 'meta+0',
+                             shortcutContext=2, icon=_get_icon('space_x'))
+    organize_menu.addCommand('Distribute Nodes Vertically', partial(interval, dag.AXIS_Y), 'meta+ctrl+0',
+                             shortcutContext=2, icon=_get_icon('space_y'))
+    organize_menu.addCommand('Mirror Nodes', mirror_nodes, 'meta+/', shortcutContext=2, icon=_get_icon('mirror_x'))
+    organize_menu.addCommand('Summon Nodes', dag.summon_nodes, 'ctrl+f', shortcutContext=2, icon=_get_icon('summon'))
+    organize_menu.addCommand('Find and Summon Nodes', find_and_summon, 'meta+f', shortcutContext=2,
+                             icon=_get_icon('summon'))
+    organize_menu.addCommand('Auto Layout', auto_layout)
+    organize_menu.addCommand('Snap to Grid', snap_to_grid)
+    organize_menu.addCommand('Reduce Crossings', reduce_crossings)
+    organize_menu.addCommand('Layout Lint', layout_lint)
+
+    organize_menu.addSeparator()
+
+    organize_menu.addCommand('Re-Label Nodes', relabel, 'shift+n', shortcutContext=2, icon=_get_icon('label_node'))
+
+    organize_menu.addSeparator()
+
+    backdrop_menu = organize_menu.addMenu('Backdrops', icon="Backdrop.png")
+    backdrop_menu.addCommand('AutoBackdrop', backdrops.auto_backdrop_dialog, 'alt+b', shortcutContext=2, icon='Backdrop.png')
+    backdrop_menu.addCommand('Sort backdrops', backdrops.auto_layer_backdrops, icon=_get_icon('sort_backdrop'))
+    backdrop_menu.addCommand('Snap Backdrops to contents', backdrops.snap_backdrops_to_contents,
+                             icon=_get_icon('snap_backdrop'))
+
+    if install_experimental_menus:
+        experimental_menu = organize_menu.addMenu('Experimental')
+        experimental_menu.addCommand('Draw Connections', snappy.snap, 'u', shortcutContext=2)
+        experimental_menu.addCommand('Snip Connections', snippy.snip, 'y', shortcutContext=2)
+        experimental_menu.addCommand('De-Intersect Nodes', dag.de_intersect)
+
+
+def install_auto_dot_color():
+    """ Install the callback to color dots based on their connections """
+    nuke.addKnobChanged(colors.auto_dot_color_callback, nodeClass='Dot')
+    nuke.addKnobChanged(colors.tile_color_changed_callback)
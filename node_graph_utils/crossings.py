@@ -0,0 +1,232 @@
+"""
+Count the crossings of the connections of a graph, and reduce them.
+
+Connections are the straight lines from the center of nodes to the center of their inputs, like `snippy` draws them.
+Two connections cross when they intersect away from their ends: connections sharing a node don't cross.
+
+Candidate pairs are found with a sweep line over the bounding boxes of the connections (see
+`spatial.overlapping_pairs`), then tested exactly. In node graphs, where connections are short and mostly vertical,
+few boxes overlap without the connections crossing, so counting is about O((E + K) log E) for E connections and
+K crossings.
+
+This module does not depend on nuke or Qt.
+"""
+from collections import defaultdict
+
+from .membership import BackdropMembership
+from .spatial import SpatialGrid, overlapping_pairs
+
+
+def _center(rect):
+    return (rect[0] + rect[2]) / 2.0, (rect[1] + rect[3]) / 2.0
+
+
+def _bounds(segment):
+    x1, y1, x2, y2 = segment
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+def _orientation(x1, y1, x2, y2, x, y):
+    """ Positive if the point is on one side of the line, negative on the other, 0 on the line """
+    return (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
+
+
+def segments_cross(segment, other):
+    """
+    Whether two segments cross. Segments touching, ending on each other, or overlapping on the same line don't cross.
+
+    Args:
+        segment (tuple[float, float, float, float]): x1, y1, x2, y2
+        other (tuple[float, float, float, float]): x1, y1, x2, y2
+
+    Returns:
+        bool
+    """
+    x1, y1, x2, y2 = segment
+    x3, y3, x4, y4 = other
+    side_1 = _orientation(x1, y1, x2, y2, x3, y3)
+    side_2 = _orientation(x1, y1, x2, y2, x4, y4)
+    if not (side_1 < 0 < side_2 or side_2 < 0 < side_1):
+        return False
+    side_3 = _orientation(x3, y3, x4, y4, x1, y1)
+    side_4 = _orientation(x3, y3, x4, y4, x2, y2)
+    return side_3 < 0 < side_4 or side_4 < 0 < side_3
+
+
+def connection_segments(snapshot, rects=None):
+    """
+    Connections between the nodes of a graph. Backdrops have no connections.
+
+    Args:
+        snapshot (GraphSnapshot): The graph
+        rects (dict[str, tuple[int, int, int, int]]): Current rectangle of the nodes which moved since the snapshot
+
+    Returns:
+        dict[tuple[str, int], tuple[float, float, float, float]]: Segment from the center of the node to the center
+            of its input, by (node id, input index)
+    """
+    rects = rects or {}
+    segments = {}
+    for node in snapshot:
+        if node.is_backdrop:
+            continue
+        x, y = _center(rects.get(node.id, node.rect))
+        for index, input_id in enumerate(node.inputs):
+            if input_id in snapshot:
+                input_x, input_y = _center(rects.get(input_id, snapshot[input_id].rect))
+                segments[(node.id, index)] = (x, y, input_x, input_y)
+    return segments
+
+
+def crossing_pairs(segments):
+    """
+    Find the crossing segments
+
+    Args:
+        segments (dict[object, tuple[float, float, float, float]]): Segments by sortable key
+
+    Returns:
+        list[tuple]: Keys of the crossing segments
+    """
+    boxes = dict((key, _bounds(segment)) for key, segment in segments.items())
+    return [(key, other) for key, other in overlapping_pairs(boxes, touching=True)
+            if segments_cross(segments[key], segments[other])]
+
+
+def count_crossings(snapshot, rects=None):
+    """
+    Count the connections crossing each other, a measure of how tangled a graph is
+
+    Args:
+        snapshot (GraphSnapshot): The graph
+        rects (dict[str, tuple[int, int, int, int]]): Current rectangle of the nodes which moved since the snapshot
+
+    Returns:
+        int
+    """
+    return len(crossing_pairs(connection_segments(snapshot, rects)))
+
+
+def _rows(snapshot, node_ids, tolerance):
+    """ Group nodes whose centers are less than `tolerance` apart vertically, like `align.distribute_nodes` """
+    rows = []
+    current_row = None
+    for node_id in sorted(node_ids, key=lambda key: snapshot[key].center[1]):
+        y = snapshot[node_id].center[1]
+        if current_row is None or y - current_row > tolerance:
+            rows.append([])
+            current_row = y
+        rows[-1].append(node_id)
+    return [sorted(row, key=lambda key: snapshot[key].x) for row in rows if len(row) > 1]
+
+
+def reduce_crossings(snapshot, node_ids=None, max_passes=4, row_tolerance=6):
+    """
+    Swap neighbouring nodes of each row when it uncrosses connections.
+
+    A swap is kept only if fewer connections of the two nodes cross after it, so the total number of crossings only
+    goes down. The swapped nodes keep their vertical position and the gap between them. Nodes are only swapped with
+    the node right next to them in the row, whether it may move or not, and only if they don't land on another node.
+    Nodes are only swapped with nodes in the same backdrops, so backdrop contents don't change.
+
+    Args:
+        snapshot (GraphSnapshot): Graph to untangle
+        node_ids (list[str]): Nodes which may move, all the nodes of the snapshot if None
+        max_passes (int): Maximum number of passes over the rows, stops earlier once no swap helps. After the first
+            pass, only the nodes near connections which moved are tried again.
+        row_tolerance (int): Nodes whose centers are less than this apart vertically are in the same row
+
+    Returns:
+        dict[str, tuple[int, int, int, int]]: New (left, top, right, bottom) rectangle of each moved node
+    """
+    if node_ids is None:
+        node_ids = list(snapshot.nodes)
+    rects = dict((node.id, node.rect) for node in snapshot)
+    segments = connection_segments(snapshot)
+    incident = defaultdict(list)  # Connections of each node, as node or as input
+    # Connections are longer than nodes, bigger cells keep the number of cells a connection covers low
+    grid = SpatialGrid(cell_size=512)
+    for key, segment in segments.items():
+        incident[key[0]].append(key)
+        incident[snapshot[key[0]].inputs[key[1]]].append(key)
+        grid.insert(key, _bounds(segment))
+    membership = BackdropMembership.from_snapshot(snapshot)
+    node_grid = SpatialGrid()
+    for node in snapshot:
+        if not node.is_backdrop:
+            node_grid.insert(node.id, node.rect)
+
+    def local_crossings(keys, moved_rects=None):
+        """ Crossings of some connections, with the nodes optionally moved to other rectangles """
+        current = dict((key, segments[key]) for key in keys)
+        if moved_rects:
+            for key in keys:
+                node_rect = moved_rects.get(key[0], rects[key[0]])
+                input_id = snapshot[key[0]].inputs[key[1]]
+                input_rect = moved_rects.get(input_id, rects[input_id])
+                current[key] = _center(node_rect) + _center(input_rect)
+        count = 0
+        for key, segment in current.items():
+            for other in grid.query_rect(_bounds(segment)):
+                if other not in current and segments_cross(segment, segments[other]):
+                    count += 1
+        ordered = sorted(current)
+        for index, key in enumerate(ordered):
+            for other in ordered[index + 1:]:
+                if segments_cross(current[key], current[other]):
+                    count += 1
+        return count
+
+    def lands_on_other_nodes(moved_rects):
+        for rect in moved_rects.values():
+            for other in node_grid.query_rect(rect):
+                other_rect = rects[other]
+                if other not in moved_rects and other_rect[0] < rect[2] and rect[0] < other_rect[2] and \
+                        other_rect[1] < rect[3] and rect[1] < other_rect[3]:
+                    return True
+        return False
+
+    def move(node_id, rect):
+        rects[node_id] = rect
+        node_grid.insert(node_id, rect)
+        for key in incident[node_id]:
+            # Nodes with connections near the old or the new connection may now uncross with a swap
+            for other in grid.query_rect(_bounds(segments[key])):
+                changed.update((other[0], snapshot[other[0]].inputs[other[1]]))
+            segments[key] = _center(rects[key[0]]) + _center(rects[snapshot[key[0]].inputs[key[1]]])
+            grid.insert(key, _bounds(segments[key]))
+            for other in grid.query_rect(_bounds(segments[key])):
+                changed.update((other[0], snapshot[other[0]].inputs[other[1]]))
+
+    movable = set(node_id for node_id in node_ids if incident[node_id] and not snapshot[node_id].is_backdrop)
+    # Rows hold all the nodes, so only nodes with nothing between them are swapped
+    rows = _rows(snapshot, [node.id for node in snapshot if not node.is_backdrop], row_tolerance)
+    changed = set(movable)  # Nodes whose swaps may have a different outcome than in the previous pass
+    for _pass in range(max_passes):
+        if not changed:
+            break
+        candidates, changed = changed, set()
+        for row in rows:
+            for index in range(len(row) - 1):
+                node_id, other_id = row[index], row[index + 1]
+                if node_id not in movable or other_id not in movable:
+                    continue
+                if node_id not in candidates and other_id not in candidates:
+                    continue
+                if set(membership.backdrops_around(node_id)) != set(membership.backdrops_around(other_id)):
+                    continue
+                keys = set(incident[node_id] + incident[other_id])
+                before = local_crossings(keys)
+                if not before:
+                    continue
+                left, top, right, bottom = rects[node_id]
+                other_left, other_top, other_right, other_bottom = rects[other_id]
+                # The other node takes the place of the node, and the node goes after it, keeping the gap
+                new_left = left + (other_right - other_left) + (other_left - right)
+                moved_rects = {other_id: (left, other_top, left + other_right - other_left, other_bottom),
+                               node_id: (new_left, top, new_left + right - left, bottom)}
+                if not lands_on_other_nodes(moved_rects) and local_crossings(keys, moved_rects) < before:
+                    for key, rect in moved_rects.items():
+                        move(key, rect)
+                    row[index], row[index + 1] = other_id, node_id
+    return dict((node_id, rect) for node_id, rect in rects.items() if rect != snapshot[node_id].rect)
@@ -3,7 +3,9 @@ Generic dag utilities
 """
 
 # Qt
+import os
 import re
+import tempfile
 from collections import namedtuple
 
 from Qt import QtCore, QtWidgets, QtGui
@@ -11,6 +13,10 @@ from Qt import QtCore, QtWidgets, QtGui
 # nuke
 import nuke
 
+from . import layout_engine, nk_parser
+from .membership import BackdropMembership
+from .snapshot import DEFAULT_GRID_SIZE, GraphSnapshot, default_node_size
+
 DAG_TITLE = "Node Graph"
 DAG_OBJECT_NAME = "DAG"
 
@@ -119,12 +125,6 @@ def get_node_bounds(node):
     Args:
         node (nuke.Node): The node for which to get bounds
     """
-    fallbacks = {
-        'Dot': (12, 12),
-        'Camera': (60, 60),
-        'Axis': (60, 60)
-    }
-
     def temp_node_size(_class):  # TODO: This could be LRU cached
         temp_node = getattr(nuke.nodes, _class)()  # Make temp node with same class as corrupted node
         try:
@@ -157,7 +157,7 @@ def get_node_bounds(node):
         width, height = temp_node_size(node.Class())
         # If that still doesn't work (non-GUI session for example), use hard coded values
         if width == 0:
-            width, height = fallbacks.get(node.Class(), (80, 18))
+            width, height = default_node_size(node.Class())
 
     return QtCore.QRectF(node.xpos(), node.ypos(), width, height)
 
@@ -218,6 +218,20 @@ def calculate_bounds_adjustment(bounds, target_bounds):
 
 
 # Utils - Querying
+def node_id(node):
+    """
+    Key identifying a node, to be used in sets and dicts.
+    Nuke may return a different python object every time the same node is queried, so identity can't be used.
+
+    Args:
+        node (nuke.Node): Node to identify
+
+    Returns:
+        str: The node's full name
+    """
+    return node.fullName()
+
+
 def node_center(node):
     """
     A simple function to find a node's center point.
@@ -233,18 +247,41 @@ def last_clicked_position():
     """
     returns the x and y coordinates of the last position clicked by the user
 
+    Clicks are recorded by the viewport of the active DAG (see `viewport.DagViewport`), which is created on the first
+    call. Until the DAG gets clicked, the position is found by creating a temporary Dot, which nuke places where the
+    user last clicked, and remembered.
+
     Returns:
-        QtCore.QPoint(): Last clicked position in node graph
+        QtCore.QPointF(): Last clicked position in node graph
     """
-    selection = clear_selection()
+    from .viewport import get_viewport  # viewport depends on this module
 
-    temp = nuke.createNode("Dot", inpanel=False)
-    temp.setSelected(False)  # Important! Apparently node may not get fully deleted if selected, making a ghost
-    try:
-        return get_node_bounds(temp).center()
-    finally:
-        nuke.delete(temp)
-        select(selection)
+    viewport = None
+    active_dag = get_current_dag()
+    if active_dag is not None:
+        viewport = get_viewport(active_dag)
+        # Only use the DAG of the current context, which is where nuke would create nodes.
+        if viewport.dag_node.fullName() != nuke.thisGroup().fullName():
+            viewport = None
+        elif viewport.last_click is not None:
+            return QtCore.QPointF(viewport.last_click)
+
+    position = _last_clicked_position_from_dot()
+    if viewport is not None:
+        viewport.last_click = position
+    return QtCore.QPointF(position)
+
+
+def _last_clicked_position_from_dot():
+    """ Find the last clicked position by creating a temporary Dot, which nuke places there """
+    with SelectionSnapshot():
+        clear_selection()
+        temp = nuke.createNode("Dot", inpanel=False)
+        temp.setSelected(False)  # Important! Apparently node may not get fully deleted if selected, making a ghost
+        try:
+            return get_node_bounds(temp).center()
+        finally:
+            nuke.delete(temp)
 
 
 def cursor_dag_position():
@@ -276,6 +313,20 @@ def cursor_dag_position():
         return QtCore.QPoint(*nuke.center()) + scaled_cursor
 
 
+def get_grid_size():
+    """
+    Size of the DAG grid, from the preferences
+
+    Returns:
+        tuple[int, int]: GridWidth and GridHeight
+    """
+    if not nuke.GUI:
+        # When not in GUI, nuke throws warnings when accessing preferences.
+        return DEFAULT_GRID_SIZE
+    preferences = nuke.toNode('preferences')
+    return max(int(preferences['GridWidth'].value()), 1), max(int(preferences['GridHeight'].value()), 1)
+
+
 def get_label_size(node, wrap=True):
     """ Calculate the size of a label for a nuke Node
 
@@ -336,65 +387,202 @@ def sort_nodes_by_distance(nodes, axis, target):
 
 
 # Selection
+# From this many nodes, (de)selecting nodes with a single TCL call is faster than one python call per node
+SELECTION_BATCH_MIN_NODES = 20
+
+
+def _set_selected(nodes, selected):
+    """ Select or deselect nodes, with a single TCL call when there are many """
+    nodes = list(nodes)
+    if len(nodes) >= SELECTION_BATCH_MIN_NODES:
+        value = 'true' if selected else 'false'
+        try:
+            nuke.tcl('\n'.join('knob root.{}.selected {}'.format(node.fullName(), value) for node in nodes))
+            return
+        except RuntimeError:
+            pass  # A node can't be found by its name, go through them one by one
+    for node in nodes:
+        node.setSelected(selected)
+
+
 def clear_selection():
     """ Deselect all nodes, and return previous selection """
     selection = nuke.selectedNodes()
-
-    for selected_nodes in selection:
-        selected_nodes.setSelected(False)
-
+    _set_selected(selection, False)
     return selection
 
 
 def select(nodes):
     """ Select the provided nodes """
-    for node in nodes:
-        node.setSelected(True)
+    _set_selected(nodes, True)
+
+
+class SelectionSnapshot(object):
+    """
+    The selected nodes at a point in time, to select them again later.
+
+    Also a context manager, to change the selection temporarily. The selection is restored when leaving the context,
+    even on errors:
+
+        with SelectionSnapshot():
+            clear_selection()
+            node.setSelected(True)
+            nuke.nodeCopy(path)
+    """
+
+    def __init__(self, nodes=None):
+        """
+        Args:
+            nodes (list[nuke.Node]): Nodes to restore the selection to, the current selection if None
+        """
+        self.nodes = nuke.selectedNodes() if nodes is None else list(nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.restore()
+
+    def restore(self):
+        """ Select the nodes of the snapshot, and only them """
+        clear_selection()
+        select(self.nodes)
 
 
 # Node Creation
+# Knob defaults of each node class, as (knob name, default) pairs, see `class_knob_defaults`
+_knob_defaults_cache = {}
+
+
+def clear_knob_defaults_cache():
+    """
+    Forget the knob defaults read by `class_knob_defaults`, to read them again.
+
+    Called when a script is loaded, as loading scripts may run callbacks or plugins setting defaults. Call it after
+    setting defaults for knobs which had none, once nodes were created.
+    """
+    _knob_defaults_cache.clear()
+
+
+def class_knob_defaults(node):
+    """
+    Knob defaults set by the user for the class of a node.
+
+    Listing the defaults queries every knob of the class, so the knobs which have a default are only listed once per
+    class. Their defaults are read again on each call, which is cheap as few knobs have defaults, so defaults changed
+    or removed later on are used. Defaults set later on for knobs which had none are only used once the cache is
+    cleared, see `clear_knob_defaults_cache`.
+
+    Args:
+        node (nuke.Node): Node of the class, used to list the knobs of the class
+
+    Returns:
+        list[tuple[str, str]]: (knob name, default) pairs
+    """
+    node_class = node.Class()
+    knob_names = _knob_defaults_cache.get(node_class)
+    if knob_names is None:
+        if not _knob_defaults_cache:
+            # Registering again after a clear is harmless, nuke ignores callbacks already registered
+            nuke.addOnScriptLoad(clear_knob_defaults_cache)
+        knob_names = [knob.name() for knob in node.allKnobs()
+                      if nuke.knobDefault('{}.{}'.format(node_class, knob.name())) is not None]
+        _knob_defaults_cache[node_class] = knob_names
+    defaults = []
+    for knob_name in knob_names:
+        default = nuke.knobDefault('{}.{}'.format(node_class, knob_name))
+        if default is not None:
+            defaults.append((knob_name, default))
+    return defaults
+
+
 def create_node_with_defaults(node_class_name):
     """ Create a node with the default values from the user, but do not select it, place it, or connect it """
     node_class = getattr(nuke.nodes, node_class_name)
     node = node_class()
     node.resetKnobsToDefault()
     # Apparently resetKnobsToDefaults does not load the knobDefaults. Handle them separately.
-    for knob in node.allKnobs():
-        default = nuke.knobDefault('{}.{}'.format(node.Class(), knob.name()))
-        if default is None:
-            continue
-        # Default values are always returned as strings, which the Python API will throw back at us, use TCL
-        command = 'knob {} {{{}}}'.format(knob.fullyQualifiedName(), default)
-        nuke.tcl(command)
+    defaults = class_knob_defaults(node)
+    if defaults:
+        # Default values are always returned as strings, which the Python API will throw back at us, use TCL.
+        # All the knobs are set with a single TCL call.
+        node_name = node.fullName()
+        nuke.tcl('\n'.join('knob root.{}.{} {{{}}}'.format(node_name, knob_name, default)
+                           for knob_name, default in defaults))
     return node
 
 
 def duplicate_node(node, keep_inputs=False, x_offset=100, y_offset=0):
     """ Cleanly duplicates a node, without modifying selection, nor losing your clipboard."""
-    clipboard = QtWidgets.QApplication.clipboard()
-    original_clipboard = clipboard.mimeData()
-    # Need to duplicate the mimedata, as Qt will garbage collect it
-    original_mime = QtCore.QMimeData()
-    for mime_format in original_clipboard.formats():
-        original_mime.setData(mime_format, original_clipboard.data(mime_format))
-    if original_clipboard.hasImage():
-        original_mime.setImageData(original_clipboard.imageData())
-    original_selection = clear_selection()
+    return duplicate_nodes([node], (x_offset, y_offset), keep_inputs)[0]
+
 
+def duplicate_nodes(nodes, offset=(100, 0), keep_inputs=False):
+    """
+    Duplicate nodes in one go, without modifying selection, nor touching the clipboard.
+
+    The nodes are copied to a temporary file and pasted from it, a single copy and paste for all the nodes.
+    Connections between the duplicated nodes are kept between the copies.
+
+    Args:
+        nodes (list[nuke.Node]): Nodes to duplicate
+        offset (tuple[int, int]): Position of the copies relative to the originals
+        keep_inputs (bool): Connect the copies to the inputs of the originals which are not duplicated
+
+    Returns:
+        list[nuke.Node]: Copy of each node, in the same order
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return []
+    file_descriptor, path = tempfile.mkstemp(suffix='.nk')
+    os.close(file_descriptor)
     try:
-        node.setSelected(True)
-        nuke.nodeCopy("%clipboard%")
-        node.setSelected(False)
-        nuke.nodePaste("%clipboard%")
-        new_node = nuke.selectedNode()
-        new_node.setXYpos(node.xpos() + x_offset, node.ypos() + y_offset)
-        if keep_inputs:
-            for i in range(node.inputs()):
-                new_node.setInput(i, node.input(i))
-        return new_node
+        with SelectionSnapshot():
+            clear_selection()
+            select(nodes)
+            nuke.nodeCopy(path)
+            clear_selection()
+
+            # Nuke renames pasted nodes whose name is taken, which is the case for all of them. Give them unique names
+            # in the file first, to recognize which copy is which.
+            temporary_names = {}
+            used_names = set()
+            changes = {}
+            for script_node in nk_parser.iter_nodes(path, ('name',)):
+                if script_node.group:
+                    continue  # Content of a copied group
+                temporary_name = '{}_duplicate'.format(script_node.name)
+                suffix = 1
+                while nuke.toNode(temporary_name) is not None or temporary_name in used_names:
+                    temporary_name = '{}_duplicate{}'.format(script_node.name, suffix)
+                    suffix += 1
+                temporary_names[script_node.name] = temporary_name
+                used_names.add(temporary_name)
+                changes[script_node] = {'name': temporary_name}
+            nk_parser.set_knobs(path, changes)
+            nuke.nodePaste(path)
+
+            pasted = dict((node.name(), node) for node in nuke.selectedNodes())
+            copies = dict((node.name(), pasted[temporary_names[node.name()]]) for node in nodes)
+            for node in nodes:
+                copy = copies[node.name()]
+                copy.setName(node.name(), uniquify=True)
+                copy.setXYpos(node.xpos() + offset[0], node.ypos() + offset[1])
+            for node in nodes:
+                copy = copies[node.name()]
+                for i in range(node.inputs()):
+                    input_node = node.input(i)
+                    if input_node is not None and input_node.name() in copies:
+                        copy.setInput(i, copies[input_node.name()])
+                    elif keep_inputs:
+                        copy.setInput(i, input_node)
+            return [copies[node.name()] for node in nodes]
     finally:
-        select(original_selection)
-        clipboard.setMimeData(original_mime)
+        os.remove(path)
 
 
 # Other
@@ -466,10 +654,14 @@ class NodeWrapper(object):
         current_center[axis] = value
         self.moveCenter(QtCore.QPoint(*current_center))
 
-    def store_margins(self):
+    def store_margins(self, contents=None):
+        """
+        Args:
+            contents (BackdropContents): Backdrop contents of the current group, to not call getNodes
+        """
         if not self.is_backdrop:
             raise NotImplementedError("Tried to calculate margins on a non-backdrop node")
-        nodes = self.node.getNodes()
+        nodes = contents.contents(self.node) if contents else self.node.getNodes()
         nodes_bounds = get_nodes_bounds(nodes)
         margins = calculate_bounds_adjustment(nodes_bounds, self)
         self._nodes_and_margins = {'nodes': nodes, 'margins': margins}
@@ -511,58 +703,221 @@ class NodeWrapper(object):
         self.setCoords(*new_bounds.getCoords())
 
 
+class InputGraph(object):
+    """
+    In memory copy of the nodes connections, read lazily from Nuke as nodes get visited.
+    Allows planning connection changes, and checking them for cycles, before applying them to the actual nodes.
+    """
+
+    def __init__(self):
+        self._inputs = {}
+
+    def inputs(self, node):
+        """ Return the list of inputs of a node (None for disconnected inputs) """
+        key = node_id(node)
+        if key not in self._inputs:
+            self._inputs[key] = [node.input(i) for i in range(node.inputs())]
+        return self._inputs[key]
+
+    def input(self, node, index=0):
+        inputs = self.inputs(node)
+        return inputs[index] if index < len(inputs) else None
+
+    def set_input(self, node, index, input_node):
+        """ Change an input in the graph, this does not modify the actual node """
+        inputs = self.inputs(node)
+        while len(inputs) <= index:
+            inputs.append(None)
+        inputs[index] = input_node
+
+    def is_connected(self, node, index, input_node):
+        """ Whether the node's input is already plugged into `input_node` (or disconnected if `input_node` is None) """
+        current = self.input(node, index)
+        if current is None or input_node is None:
+            return current is None and input_node is None
+        return node_id(current) == node_id(input_node)
+
+    def is_upstream(self, node, other):
+        """ Return True if `node` is `other` itself or one of its recursive inputs """
+        target = node_id(node)
+        visited = set()
+        stack = [other]
+        while stack:
+            current = stack.pop()
+            key = node_id(current)
+            if key == target:
+                return True
+            if key in visited:
+                continue
+            visited.add(key)
+            stack.extend(n for n in self.inputs(current) if n is not None)
+        return False
+
+
+def commit_positions(nodes, rects, undo_name='Move Nodes'):
+    """
+    Move many nodes at once, in a single undo. Only nodes which actually move are touched.
+
+    Args:
+        nodes (list[nuke.Node]): Nodes which may be moved
+        rects (dict[str, tuple[int, int, int, int]]): New (left, top, right, bottom) rectangle, keyed by node id.
+            Only the position is used for regular nodes, backdrops are also resized.
+        undo_name (str): Name of the undo step
+    """
+    nodes_by_id = dict((node_id(node), node) for node in nodes)
+    undo = nuke.Undo()
+    undo.begin(undo_name)
+    try:
+        for key, (left, top, right, bottom) in rects.items():
+            node = nodes_by_id.get(key)
+            if node is None:
+                continue
+            x, y = int(round(left)), int(round(top))
+            if node.xpos() != x or node.ypos() != y:
+                node.setXYpos(x, y)
+            if node.Class() == 'BackdropNode':
+                width, height = int(round(right - left)), int(round(bottom - top))
+                if node['bdwidth'].value() != width:
+                    node['bdwidth'].setValue(width)
+                if node['bdheight'].value() != height:
+                    node['bdheight'].setValue(height)
+    finally:
+        undo.end()
+
+
+# Backdrops
+# From this many backdrops, reading all the nodes once into a BackdropContents is faster than calling getNodes on each
+BACKDROP_CONTENTS_MIN_BACKDROPS = 3
+
+
+class BackdropContents(object):
+    """
+    Which backdrops contain which nodes, read from nuke once, see `membership.BackdropMembership`.
+
+    `getNodes` checks every node of the group each time it is called, this answers for any number of backdrops after
+    reading the nodes once. Nodes moved after creating it are not taken into account.
+    """
+
+    def __init__(self, nodes=None):
+        """
+        Args:
+            nodes (list[nuke.Node]): Nodes and backdrops to index, all the nodes of the current group if None
+        """
+        if nodes is None:
+            nodes = nuke.allNodes()
+        self.nodes = dict((node_id(node), node) for node in nodes)
+        backdrops = [node for node in self.nodes.values() if node.Class() == 'BackdropNode']
+        graph = GraphSnapshot.from_nodes(backdrops, knobs=('z_order',))
+        for node in GraphSnapshot.from_nodes([node for node in self.nodes.values() if node.Class() != 'BackdropNode'],
+                                             knobs=()):
+            graph.add(node)
+        self.membership = BackdropMembership.from_snapshot(graph)
+
+    def _nodes(self, keys):
+        return [self.nodes[key] for key in keys]
+
+    def contents(self, backdrop):
+        """ Nodes in a backdrop, like `backdrop.getNodes()` """
+        return self._nodes(sorted(self.membership.contents(node_id(backdrop))))
+
+    def backdrops_around(self, node):
+        """ Backdrops containing a node, the innermost (front most) one first """
+        return self._nodes(self.membership.backdrops_around(node_id(node)))
+
+    def backdrops_at(self, point):
+        """ Backdrops under a point (QPointF), the front most one first """
+        return self._nodes(self.membership.backdrops_at(point.x(), point.y()))
+
+    def backdrops_intersecting(self, bounds):
+        """ Backdrops overlapping a rectangle (QRectF), the front most one first """
+        return self._nodes(self.membership.backdrops_intersecting(bounds.getCoords()))
+
+
+def backdrop_contents_for(backdrops):
+    """
+    Returns:
+        BackdropContents or None: Contents of the current group if there are enough backdrops for it to be faster
+            than calling getNodes on each of them, else None
+    """
+    if len(backdrops) >= BACKDROP_CONTENTS_MIN_BACKDROPS:
+        return BackdropContents()
+    return None
+
+
+def with_backdrop_contents(nodes, contents=None):
+    """
+    Add the nodes inside the backdrops of a list of nodes to the list
+
+    Args:
+        nodes (list[nuke.Node]):
+        contents (BackdropContents): Backdrop contents of the current group, built here if there are many backdrops
+
+    Returns:
+        list[nuke.Node]: The nodes, followed by the contents of their backdrops which were not in the list
+    """
+    nodes = list(nodes)
+    ids = set(node_id(node) for node in nodes)
+    backdrops = [node for node in nodes if node.Class() == 'BackdropNode']
+    if contents is None:
+        contents = backdrop_contents_for(backdrops)
+    for backdrop in backdrops:
+        for node in contents.contents(backdrop) if contents else backdrop.getNodes():
+            key = node_id(node)
+            if key not in ids:
+                ids.add(key)
+                nodes.append(node)
+    return nodes
+
+
 def summon_nodes(nodes=None):
-    """ Summon nodes to the cursor position, or to the center of the DAG if the cursor is not over the DAG. """
+    """
+    Summon nodes to the cursor position, or to the center of the DAG if the cursor is not over the DAG.
+    Nodes inside summoned backdrops come along. All the nodes are moved in a single undo.
+    """
     if nodes is None:
         nodes = nuke.selectedNodes()
     if not nodes:
         return
-    cursor_pos = cursor_dag_position()
-    bounds = get_nodes_bounds(nodes)
-    center = bounds.center().toPoint()
-    offset = cursor_pos - center
-    for node in nodes:
-        node = NodeWrapper(node)
-        node.translate(offset)
+    summoned_ids = [node_id(node) for node in nodes]
+    nodes = with_backdrop_contents(nodes)
+    graph = GraphSnapshot.from_nodes(nodes, knobs=())
+
+    left, top, right, bottom = graph[summoned_ids[0]].rect
+    for key in summoned_ids[1:]:
+        node_left, node_top, node_right, node_bottom = graph[key].rect
+        left, top = min(left, node_left), min(top, node_top)
+        right, bottom = max(right, node_right), max(bottom, node_bottom)
+    center = QtCore.QRectF(left, top, right - left, bottom - top).center().toPoint()
+    offset = cursor_dag_position() - center
+    offset_x, offset_y = int(round(offset.x())), int(round(offset.y()))
+    if not offset_x and not offset_y:
+        return
+
+    rects = {}
+    for node in graph:
+        node_left, node_top, node_right, node_bottom = node.rect
+        rects[node.id] = (node_left + offset_x, node_top + offset_y, node_right + offset_x, node_bottom + offset_y)
+    commit_positions(nodes, rects, undo_name='Summon Nodes')
 
 
 def de_intersect():
     """ Experimental: Get nodes to push each other if intersecting. """
-    progress = nuke.ProgressTask('De-Intersecting Nodes')
-    undo = nuke.Undo()
-    undo.begin('De-Intersecting Nodes')
-
     candidates = nuke.selectedNodes()
     if not candidates:
         candidates = nuke.allNodes()
+    nodes = [n for n in candidates if n.Class() != 'BackdropNode']
+
+    progress = nuke.ProgressTask('De-Intersecting Nodes')
+
+    def report(done, total):
+        progress.setMessage('resolving intersections, part {}/{}'.format(done, total))
+        progress.setProgress(int(float(done) / total * 100))
+        return progress.isCancelled()
 
     try:
-        speed_squared = 15*15
-        nodes = [NodeWrapper(n) for n in candidates if n.Class() != 'BackdropNode']
-        intersecting = True
-        margins = QtCore.QMargins()
-        margins += 7
-        loop = 0
-        max_loops = 500
-        while intersecting and loop < max_loops:
-            if progress.isCancelled():
-                break
-            loop += 1
-            progress.setMessage('resolving intersections pass {}/{}(max)'.format(loop, max_loops))
-            progress.setProgress(int(float(loop) / max_loops * 100))
-            intersecting = False
-            for node in nodes:
-                for other_node in nodes:
-                    if other_node is node:
-                        continue
-                    if node.marginsAdded(margins).intersects(other_node.bounds):
-                        intersecting = True
-                        offset = QtGui.QVector2D(node.center() - other_node.center())
-                        if offset.isNull():
-                            offset.setY(1)
-                        offset = offset * (float(speed_squared) / offset.lengthSquared())
-                        node.translate(offset.toPoint())
-                        break  # go to the next node to avoid pingpong
+        progress.setMessage('resolving intersections')
+        # When cancelled, the parts resolved so far are still moved, like the passes done so far used to be
+        rects = layout_engine.de_intersect_partitioned(GraphSnapshot.from_nodes(nodes), progress=report)
+        commit_positions(nodes, rects, undo_name='De-Intersecting Nodes')
     finally:
         progress.setProgress(100)
-        undo.end()
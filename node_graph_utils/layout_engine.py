@@ -0,0 +1,638 @@
+"""
+Layout algorithms for node graphs.
+
+They work on a GraphSnapshot and return new rectangles for the nodes, without touching nuke, so they can run on large
+graphs in pure python, in worker processes (see `partition`), and their result can be committed in a single batch
+(see `dag.commit_positions`).
+
+`layered_layout` is a layered (Sugiyama style) layout, going through the classic steps:
+- Longest path layering: each node goes one row below its lowest input.
+- Long connections are split with dummy nodes on every row they cross.
+- Crossing reduction: nodes are re-ordered within their row by the barycenter of their neighbours, sweeping down and up.
+- Coordinate assignment: nodes are placed under their input 0 when possible, on a grid of columns and rows. Dummy
+  nodes take a column too, so long connections keep a free lane.
+
+Backdrops are laid out as blocks: their contents are laid out on their own, inner backdrops first, then each backdrop
+is fitted around its contents with its original margins and placed in the backdrop around it like a big node.
+
+`de_intersect` pushes overlapping nodes away from each other.
+
+`snap_to_grid` moves the center of nodes to the closest free point of the DAG grid.
+
+`fit_backdrops` places backdrops around their contents, leaving room for their label.
+
+The `_partitioned` variants split the graph in independent parts first, and process them in parallel.
+"""
+from collections import defaultdict
+import math
+import re
+
+try:
+    import numpy
+except ImportError:  # The rounding falls back to pure python
+    numpy = None
+
+from .partition import UnionFind, map_partitions, partition, sub_snapshot
+from .snapshot import DEFAULT_GRID_SIZE, GraphSnapshot
+from .spatial import SpatialGrid, overlapping_pairs
+
+
+def _layers(node_ids, inputs):
+    """
+    Longest path layering
+
+    Args:
+        node_ids (list[str]): Nodes to layer
+        inputs (dict[str, list[str]]): Inputs of each node, restricted to the nodes to layer
+
+    Returns:
+        dict[str, int]: Layer of each node, 0 being the top row
+    """
+    outputs = defaultdict(list)
+    pending = {}
+    for node_id in node_ids:
+        pending[node_id] = len(inputs[node_id])
+        for input_id in inputs[node_id]:
+            outputs[input_id].append(node_id)
+
+    order = []  # Topological order, once cycles are broken
+    ready = [node_id for node_id in node_ids if not pending[node_id]]
+    unlayered = iter(node_ids)
+    while True:
+        while ready:
+            node_id = ready.pop()
+            order.append(node_id)
+            for output_id in outputs[node_id]:
+                pending[output_id] -= 1
+                if not pending[output_id]:
+                    ready.append(output_id)
+        # Nuke graphs have no cycles, but backdrops laid out as blocks can feed a node which feeds them back.
+        # Break cycles at the first node left, under the inputs already ordered.
+        stuck = next((node_id for node_id in unlayered if pending[node_id] > 0), None)
+        if stuck is None:
+            break
+        pending[stuck] = -1  # Never ready again
+        ready.append(stuck)
+
+    # Layers are only propagated once the order is known, along the edges going forward in it: the inputs left out
+    # when breaking a cycle come later, and must not raise a node whose outputs were already layered.
+    positions = dict((node_id, index) for index, node_id in enumerate(order))
+    layers = dict.fromkeys(node_ids, 0)
+    for node_id in order:
+        for output_id in outputs[node_id]:
+            if positions[output_id] > positions[node_id]:
+                layers[output_id] = max(layers[output_id], layers[node_id] + 1)
+    return layers
+
+
+def _sort_by_barycenter(row, neighbours, positions):
+    """
+    Sort a row by the mean position of each node's neighbours in the adjacent row, in place.
+    Nodes without neighbours keep their position.
+    """
+    barycenters = {}
+    for index, node_id in enumerate(row):
+        linked = [positions[n] for n in neighbours[node_id] if n in positions]
+        barycenters[node_id] = sum(linked) / float(len(linked)) if linked else float(index)
+    row.sort(key=barycenters.get)
+    for index, node_id in enumerate(row):
+        positions[node_id] = index
+
+
+def _cluster_tree(snapshot, node_ids):
+    """
+    Nest the backdrops whose nodes are all being laid out. Other backdrops are left alone, as are backdrops sharing
+    nodes with another backdrop without one being inside the other.
+
+    Returns:
+        tuple[dict[str, str], list[str]]: The innermost laid out backdrop around each node and laid out backdrop,
+            and the ids of the laid out backdrops, inner ones first
+    """
+    selected = set(node_ids)
+    parents = {}
+    fitted = []
+    fitted_ids = set()
+    for backdrop in sorted(snapshot.backdrops(), key=lambda bd: (bd.width * bd.height, bd.id)):
+        contents = snapshot.backdrop_contents(backdrop)
+        nodes = [node.id for node in contents if not node.is_backdrop]
+        if not nodes or any(node_id not in selected for node_id in nodes):
+            continue
+        keys = [node.id for node in contents if node.id in selected or node.id in fitted_ids]
+        inside = set(keys)
+        if any(key in parents and parents[key] not in inside for key in keys):
+            continue
+        for key in keys:
+            parents.setdefault(key, backdrop.id)
+        fitted.append(backdrop.id)
+        fitted_ids.add(backdrop.id)
+    return parents, fitted
+
+
+def _layered_positions(items, edges, sizes, blocks, column_width, row_height, sweeps):
+    """
+    Place items in rows following their connections, on a grid starting at 0, 0
+
+    Args:
+        items (list[str]): Items to place, nodes or backdrops laid out as blocks, in their current left to right order
+        edges (list[tuple[str, str, bool]]): Connections between items, as input item, item, and whether it is the
+            input 0 of the item
+        sizes (dict[str, tuple[int, int]]): Number of columns and rows each item takes
+        blocks (set[str]): Items which are backdrops, a column is left free next to them
+        column_width (int): see `layered_layout`
+        row_height (int): see `layered_layout`
+        sweeps (int): see `layered_layout`
+
+    Returns:
+        dict[str, tuple[int, int]]: Left and top of the grid cells taken by each item
+    """
+    inputs = dict((item, []) for item in items)
+    main_inputs = {}
+    for input_item, item, main in edges:
+        if input_item not in inputs[item]:
+            inputs[item].append(input_item)
+        if main:
+            main_inputs[item] = input_item
+    layers = _layers(items, inputs)
+    rows = defaultdict(list)
+    for item in items:
+        rows[layers[item]].append(item)
+
+    # Split long connections with dummy nodes, which take a column on every row they cross
+    up = defaultdict(list)
+    down = defaultdict(list)
+    main_up = {}  # Item or dummy right above each item, on the way to its input 0
+    for item in items:
+        for input_item in inputs[item]:
+            previous = input_item
+            for layer in range(layers[input_item] + 1, layers[item]):
+                dummy = ('dummy', input_item, item, layer)
+                rows[layer].append(dummy)
+                up[dummy].append(previous)
+                down[previous].append(dummy)
+                previous = dummy
+            up[item].append(previous)
+            down[previous].append(item)
+            if main_inputs.get(item) == input_item:
+                main_up[item] = previous
+    row_indices = sorted(rows)
+
+    # Crossing reduction
+    positions = {}
+    for layer in row_indices:
+        for index, item in enumerate(rows[layer]):
+            positions[item] = index
+    for _sweep in range(sweeps):
+        for layer in row_indices[1:]:
+            _sort_by_barycenter(rows[layer], up, positions)
+        for layer in reversed(row_indices[:-1]):
+            _sort_by_barycenter(rows[layer], down, positions)
+
+    # Coordinates, items are aligned to the top of their row
+    centers_x = {}
+    placed = {}
+    top = 0
+    for layer in row_indices:
+        row = rows[layer]
+        row_rows = max([sizes[item][1] for item in row if item in sizes] or [1])
+        next_free = 0  # Left edge of the first free column
+        previous_block = None
+        for item in row:
+            block = item in blocks
+            if previous_block is not None and (block or previous_block):
+                next_free += column_width  # Leave room between backdrops and what's next to them
+            previous_block = block
+
+            # Stay under input 0 to keep the main stream straight, else under the inputs' average.
+            # Dummies stay under the item or dummy above them, so a long connection keeps a lane.
+            linked = [centers_x[i] for i in up[item] if i in centers_x]
+            if main_up.get(item) in centers_x:
+                desired = centers_x[main_up[item]]
+            elif linked:
+                desired = sum(linked) / len(linked)
+            else:
+                desired = next_free
+            width = (sizes[item][0] if item in sizes else 1) * column_width
+            left = max(next_free, column_width * int(round((desired - width / 2.0) / column_width)))
+            next_free = left + width
+            centers_x[item] = left + width / 2.0
+            if item in sizes:
+                placed[item] = (left, top)
+        top += (row_rows + 1) * row_height
+    return placed
+
+
+def layered_layout(snapshot, node_ids=None, column_width=150, row_height=48, sweeps=4):
+    """
+    Lay out a graph in rows, following its connections
+
+    Backdrops whose nodes are all laid out are laid out as blocks: their contents are laid out first, then the
+    backdrop, fitted around them with its original margins, is placed like a big node. Backdrops never overlap each
+    other, nor gain nodes they didn't contain.
+
+    Args:
+        snapshot (GraphSnapshot): Graph to lay out
+        node_ids (list[str]): Nodes to lay out, all the nodes of the snapshot if None. Backdrops containing some of
+            these nodes are fitted around them, other backdrops are ignored.
+        column_width (int): Width of a grid column, nodes are centered on columns
+        row_height (int): Height of a grid row, each layer takes as many rows as its tallest node needs
+        sweeps (int): Number of down and up crossing reduction sweeps
+
+    Returns:
+        dict[str, tuple[int, int, int, int]]: New (left, top, right, bottom) rectangle of each node and backdrop
+    """
+    if node_ids is None:
+        node_ids = list(snapshot.nodes)
+    node_ids = [node_id for node_id in node_ids if not snapshot[node_id].is_backdrop]
+    if not node_ids:
+        return {}
+    selected = set(node_ids)
+    parents, fitted = _cluster_tree(snapshot, node_ids)
+    blocks = set(fitted)
+    members = defaultdict(list)  # Nodes and backdrops directly in each backdrop, None for the ones in no backdrop
+    for key in sorted(node_ids + fitted, key=lambda key: snapshot[key].center):
+        members[parents.get(key)].append(key)
+
+    def ancestors(key):
+        """ The node, then the backdrops around it, innermost first, then None """
+        chain = [key]
+        while chain[-1] is not None:
+            chain.append(parents.get(chain[-1]))
+        return chain
+
+    # Connections are laid out in the innermost backdrop around both their ends,
+    # between the members of that backdrop the ends are in
+    edges = defaultdict(list)
+    for node_id in node_ids:
+        chain = ancestors(node_id)
+        for index, input_id in enumerate(snapshot[node_id].inputs):
+            if input_id not in selected or input_id == node_id:
+                continue
+            input_chain = ancestors(input_id)
+            level = next(level for level, key in enumerate(chain) if key in input_chain)
+            input_item = input_chain[input_chain.index(chain[level]) - 1]
+            if input_item != chain[level - 1]:
+                edges[chain[level]].append((input_item, chain[level - 1], index == 0 and level == 1))
+
+    def columns_rows(width, height):
+        return (max(1, int(math.ceil(width / float(column_width)))),
+                max(1, int(math.ceil(height / float(row_height)))))
+
+    sizes = dict((node_id, columns_rows(snapshot[node_id].width, snapshot[node_id].height)) for node_id in node_ids)
+    positions = {}  # Grid cells of the members of each backdrop, from 0, 0
+    local_rects = {}  # Rectangle of each backdrop, in the coordinates of its own contents
+    footprints = {}  # Grid cells taken by each backdrop, in the coordinates of its own contents
+
+    def item_rect(item, left, top):
+        """ Rectangle of a node or backdrop placed in the grid cells starting at left, top """
+        if item in blocks:
+            rect, footprint = local_rects[item], footprints[item]
+            offset_x, offset_y = left - footprint[0], top - footprint[1]
+            return rect[0] + offset_x, rect[1] + offset_y, rect[2] + offset_x, rect[3] + offset_y
+        node = snapshot[item]
+        columns, rows = sizes[item]
+        x = left + int(round((columns * column_width - node.width) / 2.0))
+        y = top + int(round((rows * row_height - node.height) / 2.0))
+        return x, y, x + node.width, y + node.height
+
+    # Inner backdrops first, each is then a block in the backdrop around it
+    for cluster in fitted + [None]:
+        positions[cluster] = _layered_positions(members[cluster], edges[cluster], sizes, blocks,
+                                                column_width, row_height, sweeps)
+        if cluster is None:
+            break
+        backdrop = snapshot[cluster]
+        old_bounds = _union([snapshot[key].rect for key in members[cluster]])
+        new_bounds = _union([item_rect(key, left, top) for key, (left, top) in positions[cluster].items()])
+        rect = local_rects[cluster] = (new_bounds[0] - (old_bounds[0] - backdrop.rect[0]),
+                                       new_bounds[1] - (old_bounds[1] - backdrop.rect[1]),
+                                       new_bounds[2] + (backdrop.rect[2] - old_bounds[2]),
+                                       new_bounds[3] + (backdrop.rect[3] - old_bounds[3]))
+        footprint = footprints[cluster] = (
+            column_width * int(math.floor(rect[0] / float(column_width))),
+            row_height * int(math.floor(rect[1] / float(row_height))),
+            column_width * int(math.ceil(rect[2] / float(column_width))),
+            row_height * int(math.ceil(rect[3] / float(row_height))))
+        sizes[cluster] = (int(round((footprint[2] - footprint[0]) / float(column_width))),
+                          int(round((footprint[3] - footprint[1]) / float(row_height))))
+
+    # Layout starts at the top left of the nodes it moves
+    origin_x = column_width * int(math.floor(min(snapshot[n].x for n in node_ids) / float(column_width)))
+    origin_y = row_height * int(math.floor(min(snapshot[n].y for n in node_ids) / float(row_height)))
+    rects = {}
+    placing = [(None, origin_x, origin_y)]
+    while placing:
+        cluster, offset_x, offset_y = placing.pop()
+        for item, (left, top) in positions[cluster].items():
+            left, top = left + offset_x, top + offset_y
+            rects[item] = item_rect(item, left, top)
+            if item in blocks:
+                placing.append((item, left - footprints[item][0], top - footprints[item][1]))
+    return rects
+
+
+def _union(rects):
+    return (min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects))
+
+
+def _layered_layout_rows(rows, node_ids, column_width, row_height, sweeps):
+    """ Worker entry point for `layered_layout_partitioned` """
+    return layered_layout(GraphSnapshot.from_rows(rows), node_ids, column_width, row_height, sweeps)
+
+
+def layered_layout_partitioned(snapshot, node_ids=None, column_width=150, row_height=48, sweeps=4):
+    """
+    Lay out each connected part of a graph separately, in parallel for large graphs.
+
+    Each part is laid out from the top left of its own nodes, so parts keep their place in the script. Parts which
+    would then overlap a part placed before them, in left to right order, are moved right by whole columns.
+
+    See `layered_layout` for the arguments and result.
+    """
+    if node_ids is None:
+        node_ids = list(snapshot.nodes)
+    parts = partition(snapshot, node_ids, connected=True)
+    if not parts:
+        return {}
+    tasks = [(sub_snapshot(snapshot, part).to_rows(), part, column_width, row_height, sweeps) for part in parts]
+    results = map_partitions(_layered_layout_rows, tasks, node_count=len(node_ids))
+
+    def grid_origin(part):
+        """ Top left grid point the layout of a part starts from """
+        return (column_width * int(math.floor(min(snapshot[n].x for n in part) / float(column_width))),
+                row_height * int(math.floor(min(snapshot[n].y for n in part) / float(row_height))))
+
+    origins = [grid_origin(part) for part in parts]
+    placed = SpatialGrid(cell_size=1024)  # Bounds of the parts already placed
+    rects = {}
+    for index in sorted(range(len(parts)), key=lambda i: origins[i]):
+        part_rects = results[index]
+        if not part_rects:
+            continue
+        left, top, right, bottom = _union(part_rects.values())
+        offset_x = 0
+        while True:
+            # Leave a free column and row around each part
+            area = (left + offset_x - column_width, top - row_height, right + offset_x + column_width,
+                    bottom + row_height)
+            blocking = [placed.rect(key) for key in placed.query_rect(area) if _overlap(area, placed.rect(key))]
+            if not blocking:
+                break
+            # Offset by whole columns, to keep the nodes on the grid
+            offset_x = column_width * int(math.ceil(
+                (max(rect[2] for rect in blocking) + column_width - left) / float(column_width)))
+        placed.insert(index, (left + offset_x, top, right + offset_x, bottom))
+        for node_id, (node_left, node_top, node_right, node_bottom) in part_rects.items():
+            rects[node_id] = (node_left + offset_x, node_top, node_right + offset_x, node_bottom)
+    return rects
+
+
+def _round(value):
+    """ Round halves up, like Qt does when converting to integer points """
+    return int(math.floor(value + 0.5))
+
+
+def de_intersect(rects, margin=7, speed=15, max_loops=500):
+    """
+    Push intersecting rectangles away from each other, a little at a time, until none intersect.
+
+    Args:
+        rects (list[tuple[int, int, int, int]]): (left, top, right, bottom) rectangles
+        margin (int): Minimum distance to leave between rectangles
+        speed (int): The closer two rectangles are, the further they get pushed. Pushes are speed² / distance long.
+        max_loops (int): Give up after this many passes
+
+    Returns:
+        list[tuple[int, int, int, int]]: The moved rectangles, in the same order
+    """
+    rects = [tuple(rect) for rect in rects]
+    grid = SpatialGrid()
+    for index, rect in enumerate(rects):
+        grid.insert(index, rect)
+    speed_squared = float(speed * speed)
+
+    for _loop in range(max_loops):
+        intersecting = False
+        for index in range(len(rects)):
+            left, top, right, bottom = rects[index]
+            area = (left - margin, top - margin, right + margin, bottom + margin)
+            for other_index in sorted(grid.query_rect(area)):
+                other = rects[other_index]
+                if other_index == index or not (area[0] < other[2] and other[0] < area[2] and
+                                                area[1] < other[3] and other[1] < area[3]):
+                    continue
+                intersecting = True
+                dx = (left + right - other[0] - other[2]) / 2.0
+                dy = (top + bottom - other[1] - other[3]) / 2.0
+                if not dx and not dy:
+                    dy = 1
+                factor = speed_squared / (dx * dx + dy * dy)
+                offset_x, offset_y = _round(dx * factor), _round(dy * factor)
+                rects[index] = (left + offset_x, top + offset_y, right + offset_x, bottom + offset_y)
+                grid.insert(index, rects[index])
+                break  # go to the next rectangle to avoid pingpong
+        if not intersecting:
+            break
+    return rects
+
+
+def de_intersect_partitioned(snapshot, node_ids=None, margin=7, speed=15, max_loops=500, part_margin=50,
+                             progress=None):
+    """
+    De-intersect the nodes of a graph, processing groups of nodes far from each other separately,
+    in parallel for large graphs. Backdrops are not moved.
+
+    A push can carry a node next to a node of another part, so parts which end up too close to each other are merged
+    and de-intersected again, until no part gets too close to another.
+
+    Args:
+        snapshot (GraphSnapshot): Graph to de-intersect
+        node_ids (list[str]): Nodes to move, all the nodes of the snapshot if None
+        margin (int): see `de_intersect`
+        speed (int): see `de_intersect`
+        max_loops (int): see `de_intersect`
+        part_margin (int): Nodes closer than this are processed together
+        progress (callable or None): Called with the number of parts done and the number of parts, see
+            `partition.map_partitions`. If it returns True, the remaining parts are left as they are.
+
+    Returns:
+        dict[str, tuple[int, int, int, int]]: New (left, top, right, bottom) rectangle of each node which was
+            de-intersected
+    """
+    if node_ids is None:
+        node_ids = list(snapshot.nodes)
+    parts = partition(snapshot, node_ids, connected=False, spatial_margin=part_margin)
+    rects = {}
+    pending = parts
+    while pending:
+        tasks = [([rects.get(node_id, snapshot[node_id].rect) for node_id in part], margin, speed, max_loops)
+                 for part in pending]
+        results = map_partitions(de_intersect, tasks, node_count=sum(len(part) for part in pending),
+                                 progress=progress)
+        for part, part_rects in zip(pending, results):
+            rects.update(zip(part, part_rects))
+        if len(results) < len(pending):
+            break  # Cancelled
+
+        # Rectangles grown by half the margin on each side overlap when they are closer than the margin
+        half_margin = margin / 2.0
+        grown = dict((node_id, (left - half_margin, top - half_margin, right + half_margin, bottom + half_margin))
+                     for node_id, (left, top, right, bottom) in rects.items())
+        part_indices = dict((node_id, index) for index, part in enumerate(parts) for node_id in part)
+        sets = UnionFind(range(len(parts)))
+        for node_id, other_id in overlapping_pairs(grown):
+            sets.union(part_indices[node_id], part_indices[other_id])
+        groups = sets.groups()
+        parts = [[node_id for index in group for node_id in parts[index]] for group in groups]
+        pending = [part for group, part in zip(groups, parts) if len(group) > 1]
+    return rects
+
+
+def _snapped_lefts_tops(rects, grid_size):
+    """ Top left corner of each rectangle once its center is rounded to the grid """
+    grid_width, grid_height = grid_size
+    if numpy is not None and rects:
+        lefts, tops, rights, bottoms = numpy.array(rects, dtype=float).T
+        widths, heights = rights - lefts, bottoms - tops
+        centers_x = numpy.floor((lefts + widths / 2) / grid_width + 0.5) * grid_width
+        centers_y = numpy.floor((tops + heights / 2) / grid_height + 0.5) * grid_height
+        lefts = numpy.floor(centers_x - widths / 2 + 0.5).astype(int)
+        tops = numpy.floor(centers_y - heights / 2 + 0.5).astype(int)
+        return list(zip(lefts.tolist(), tops.tolist()))
+    corners = []
+    for left, top, right, bottom in rects:
+        width, height = right - left, bottom - top
+        center_x = grid_width * math.floor((left + width / 2.0) / grid_width + 0.5)
+        center_y = grid_height * math.floor((top + height / 2.0) / grid_height + 0.5)
+        corners.append((_round(center_x - width / 2.0), _round(center_y - height / 2.0)))
+    return corners
+
+
+def _overlap(rect, other):
+    """ Whether two rectangles overlap, touching is fine """
+    return rect[0] < other[2] and other[0] < rect[2] and rect[1] < other[3] and other[1] < rect[3]
+
+
+def snap_to_grid(snapshot, node_ids=None, grid_size=DEFAULT_GRID_SIZE, search_radius=2):
+    """
+    Move the center of nodes to the closest point of the grid.
+
+    Nodes which rounding would make overlap another node they didn't overlap are moved to the closest free grid point
+    instead, up to `search_radius` grid steps away. Nodes are placed top to bottom, left to right, so the first ones
+    keep their closest grid point. Backdrops are not moved, see `fit_backdrops`.
+
+    Args:
+        snapshot (GraphSnapshot): Graph the nodes are in
+        node_ids (list[str]): Nodes to snap, all the nodes of the snapshot if None
+        grid_size (tuple[int, int]): GridWidth and GridHeight from the preferences
+        search_radius (int): How many grid steps away from their closest grid point nodes can go to avoid others
+
+    Returns:
+        dict[str, tuple[int, int, int, int]]: New rectangle of each moved node
+    """
+    if node_ids is None:
+        node_ids = list(snapshot.nodes)
+    node_ids = sorted((node_id for node_id in node_ids if not snapshot[node_id].is_backdrop),
+                      key=lambda key: (snapshot[key].y, snapshot[key].x, key))
+    snapped = dict(zip(node_ids, _snapped_lefts_tops([snapshot[key].rect for key in node_ids], grid_size)))
+
+    # Nodes which don't move are obstacles from the start, the others once placed
+    grid = SpatialGrid()
+    for node in snapshot:
+        if not node.is_backdrop and node.id not in snapped:
+            grid.insert(node.id, node.rect)
+
+    grid_width, grid_height = grid_size
+    steps = sorted(((step_x, step_y) for step_x in range(-search_radius, search_radius + 1)
+                    for step_y in range(-search_radius, search_radius + 1)),
+                   key=lambda step: (step[0] * grid_width) ** 2 + (step[1] * grid_height) ** 2)
+
+    def collides(node, rect):
+        """ Whether a node placed at rect overlaps a node it didn't overlap before """
+        return any(_overlap(rect, grid.rect(other)) and not _overlap(node.rect, snapshot[other].rect)
+                   for other in grid.query_rect(rect))
+
+    rects = {}
+    for key in node_ids:
+        node = snapshot[key]
+        left, top = snapped[key]
+        rect = (left, top, left + node.width, top + node.height)
+        if collides(node, rect):
+            for step_x, step_y in steps[1:]:
+                x, y = left + step_x * grid_width, top + step_y * grid_height
+                candidate = (x, y, x + node.width, y + node.height)
+                if not collides(node, candidate):
+                    rect = candidate
+                    break
+        grid.insert(key, rect)
+        if rect != node.rect:
+            rects[key] = rect
+    return rects
+
+
+def estimate_label_size(label, font_size=11, wrap=True):
+    """
+    Approximate the size of a label without Qt, like `dag.get_label_size` measures it.
+
+    Characters are assumed to be 0.6 font size wide, lines 1.2 font size high. HTML tags are ignored.
+
+    Args:
+        label (str): Label, may contain HTML
+        font_size (int): note_font_size of the node
+        wrap (bool): Whether the text is allowed to wrap, at 32 font sizes like `dag.get_label_size`
+
+    Returns:
+        tuple[float, float]: width and height
+    """
+    if not label:
+        return 0, 0
+    text = re.sub(r'<br\s*/?>', '\n', label, flags=re.IGNORECASE)
+    text = re.sub(r'<[^>]*>', '', text)
+    document_margin = 4  # On each side, QTextDocument's default
+    max_width = 32 * font_size if wrap else None
+    width = 0
+    line_count = 0
+    for line in text.split('\n'):
+        line_width = len(line) * font_size * 0.6
+        if max_width and line_width > max_width:
+            line_count += int(math.ceil(line_width / max_width))
+            line_width = max_width
+        else:
+            line_count += 1
+        width = max(width, line_width)
+    return width + 2 * document_margin, line_count * font_size * 1.2 + 2 * document_margin
+
+
+def fit_backdrops(snapshot, contents, rects=None, padding=50):
+    """
+    Place backdrops around their contents, like `NodeWrapper.place_around_nodes`.
+
+    Backdrops are fitted front (highest z_order) to back, so backdrops inside others are fitted first and their
+    parents fitted around their new size.
+
+    Args:
+        snapshot (GraphSnapshot): Graph the backdrops are in
+        contents (dict[str, list[str]]): Ids of the nodes to fit each backdrop around, by backdrop id.
+            Backdrops without contents are left alone.
+        rects (dict[str, tuple[int, int, int, int]]): Current rectangle of the nodes which moved since the snapshot
+        padding (int): Space left around the contents, and under the label
+
+    Returns:
+        dict[str, tuple[int, int, int, int]]: New rectangle of each fitted backdrop
+    """
+    rects = dict(rects or {})
+    fitted = {}
+    backdrops = sorted((snapshot[backdrop_id] for backdrop_id in contents if contents[backdrop_id]),
+                       key=lambda bd: (-bd.knobs.get('z_order', 0), bd.width * bd.height))
+    for backdrop in backdrops:
+        left, top, right, bottom = _union([rects.get(node_id, snapshot[node_id].rect)
+                                           for node_id in contents[backdrop.id]])
+        label_width, label_height = estimate_label_size(backdrop.knobs.get('label'),
+                                                        backdrop.knobs.get('note_font_size', 11))
+        left, top, right, bottom = left - padding, top - padding - label_height, right + padding, bottom + padding
+        if right - left < label_width:
+            missing = label_width - (right - left)
+            left, right = left - missing / 2.0, right + missing / 2.0
+        x, y = _round(left), _round(top)
+        rects[backdrop.id] = fitted[backdrop.id] = (x, y, x + int(right - left), y + int(bottom - top))
+    return fitted
@@ -0,0 +1,208 @@
+"""
+Report layout problems in a node graph, without changing it.
+
+    python -m node_graph_utils.lint [options] script.nk [script.nk ...]
+
+Checks:
+- overlap: Nodes overlapping each other
+- outside_backdrop: Nodes partly inside a backdrop, partly outside of it
+- z_order: Backdrops inside other backdrops but behind them, so hidden by them
+- off_grid: Nodes whose center is not on the grid
+- long_edge: Connections much longer than most connections of the graph
+- crossing: Connections crossing each other, see `crossings`
+
+Overlaps are found with a sweep line rather than by testing every pair of nodes, and backdrops are looked up in a
+`membership.BackdropMembership`, so a graph is checked in O(n log n). Issues are plain dicts, which the command line
+prints as JSON, for example to validate scripts before publishing them.
+
+This module does not depend on nuke or Qt.
+"""
+import argparse
+import json
+import math
+import sys
+
+from .crossings import connection_segments, crossing_pairs
+from .membership import BackdropMembership
+from .nk_parser import parse_nk
+from .partition import map_partitions
+from .snapshot import DEFAULT_GRID_SIZE
+from .spatial import overlapping_pairs
+
+CHECKS = ('overlap', 'outside_backdrop', 'z_order', 'off_grid', 'long_edge', 'crossing')
+
+
+def _issue(check, nodes, message, **details):
+    issue = {'check': check, 'nodes': list(nodes), 'message': message}
+    issue.update(details)
+    return issue
+
+
+def _overlaps(snapshot):
+    rects = dict((node.id, node.rect) for node in snapshot if not node.is_backdrop)
+    return [_issue('overlap', pair, '{} overlaps {}'.format(*pair)) for pair in overlapping_pairs(rects)]
+
+
+def _outside_backdrops(snapshot, membership):
+    issues = []
+    for node in snapshot:
+        if node.is_backdrop:
+            continue
+        left, top, right, bottom = node.rect
+        containers = set(membership.backdrops_around(node.id))
+        for backdrop_id in membership.backdrops_intersecting(node.rect):
+            if backdrop_id in containers:
+                continue
+            backdrop_left, backdrop_top, backdrop_right, backdrop_bottom = membership.rect(backdrop_id)
+            # Only touching the border is fine
+            if left < backdrop_right and backdrop_left < right and top < backdrop_bottom and backdrop_top < bottom:
+                issues.append(_issue('outside_backdrop', [node.id, backdrop_id],
+                                     '{} is partly outside {}'.format(node.id, backdrop_id)))
+    return issues
+
+
+def _inverted_z_orders(snapshot, membership):
+    issues = []
+    for backdrop in snapshot.backdrops():
+        z_order = int(backdrop.knobs.get('z_order', 0))
+        for parent_id in membership.backdrops_around(backdrop.id):
+            parent_z_order = int(snapshot[parent_id].knobs.get('z_order', 0))
+            if parent_z_order > z_order:
+                issues.append(_issue('z_order', [backdrop.id, parent_id],
+                                     '{} is inside {} but behind it (z_order {} < {})'.format(
+                                         backdrop.id, parent_id, z_order, parent_z_order)))
+    return issues
+
+
+def _off_grid(snapshot, grid_size, tolerance):
+    grid_width, grid_height = grid_size
+    issues = []
+    for node in snapshot:
+        if node.is_backdrop:
+            continue
+        x, y = node.center
+        offset_x = x - grid_width * math.floor(x / grid_width + 0.5)
+        offset_y = y - grid_height * math.floor(y / grid_height + 0.5)
+        if abs(offset_x) > tolerance or abs(offset_y) > tolerance:
+            issues.append(_issue('off_grid', [node.id], '{} is off the grid by ({:g}, {:g})'.format(
+                node.id, offset_x, offset_y), offset=[offset_x, offset_y]))
+    return issues
+
+
+def _long_edges(snapshot, factor, min_length):
+    edges = []
+    for node in snapshot:
+        x, y = node.center
+        for index, input_id in enumerate(node.inputs):
+            if input_id in snapshot:
+                input_x, input_y = snapshot[input_id].center
+                edges.append((math.hypot(x - input_x, y - input_y), node.id, index, input_id))
+    if not edges:
+        return []
+    lengths = sorted(edge[0] for edge in edges)
+    threshold = max(min_length, factor * lengths[len(lengths) // 2])
+    return [_issue('long_edge', [node_id, input_id], '{} input {} from {} is {:.0f} long'.format(
+                node_id, index, input_id, length), length=length, input=index)
+            for length, node_id, index, input_id in edges if length > threshold]
+
+
+def _crossings(snapshot):
+    issues = []
+    for (node_id, index), (other_id, other_index) in crossing_pairs(connection_segments(snapshot)):
+        issues.append(_issue('crossing', [node_id, other_id], '{} input {} crosses {} input {}'.format(
+            node_id, index, other_id, other_index), inputs=[index, other_index]))
+    return issues
+
+
+def lint_snapshot(snapshot, checks=CHECKS, grid_size=DEFAULT_GRID_SIZE, grid_tolerance=1, long_edge_factor=8,
+                  long_edge_min_length=1000):
+    """
+    Check the layout of a graph.
+
+    Args:
+        snapshot (GraphSnapshot): Graph to check, usually a group of a script
+        checks (tuple[str]): Names of the checks to run, see `CHECKS`
+        grid_size (tuple[int, int]): GridWidth and GridHeight from the preferences
+        grid_tolerance (float): Distance from the grid allowed for node centers
+        long_edge_factor (float): Connections longer than this many times the median length are too long
+        long_edge_min_length (float): Connections shorter than this are never too long
+
+    Returns:
+        list[dict]: Issues, with the name of the `check`, the ids of the `nodes` involved, and a `message`
+    """
+    issues = []
+    membership = None
+    if 'outside_backdrop' in checks or 'z_order' in checks:
+        membership = BackdropMembership.from_snapshot(snapshot)
+    if 'overlap' in checks:
+        issues.extend(_overlaps(snapshot))
+    if 'outside_backdrop' in checks:
+        issues.extend(_outside_backdrops(snapshot, membership))
+    if 'z_order' in checks:
+        issues.extend(_inverted_z_orders(snapshot, membership))
+    if 'off_grid' in checks:
+        issues.extend(_off_grid(snapshot, grid_size, grid_tolerance))
+    if 'long_edge' in checks:
+        issues.extend(_long_edges(snapshot, long_edge_factor, long_edge_min_length))
+    if 'crossing' in checks:
+        issues.extend(_crossings(snapshot))
+    return issues
+
+
+def lint_file(path, **kwargs):
+    """
+    Check the layout of all the groups of a .nk script
+
+    Args:
+        path (str): Path to the script
+        kwargs: see `lint_snapshot`
+
+    Returns:
+        list[dict]: Issues, see `lint_snapshot`. Node ids are full names, like 'Group1.Blur1'.
+    """
+    issues = []
+    for snapshot in parse_nk(path).values():
+        issues.extend(lint_snapshot(snapshot, **kwargs))
+    return issues
+
+
+def _lint_file_task(path, kwargs):
+    """ Worker entry point for `main`, reports errors rather than failing the other scripts """
+    try:
+        return lint_file(path, **kwargs), None
+    except Exception as error:
+        return None, '{}: {}'.format(type(error).__name__, error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m node_graph_utils.lint',
+                                     description='Report layout problems in the node graph of .nk scripts, as JSON. '
+                                                 'Exits with 1 if any issue was found.')
+    parser.add_argument('scripts', nargs='+', metavar='script.nk', help='Scripts to check')
+    parser.add_argument('--checks', nargs='+', choices=CHECKS, default=list(CHECKS),
+                        help='Checks to run, all by default')
+    parser.add_argument('--grid', nargs=2, type=int, default=list(DEFAULT_GRID_SIZE), metavar=('WIDTH', 'HEIGHT'),
+                        help='Grid size, nuke default preferences by default')
+    parser.add_argument('--long-edge-factor', type=float, default=8,
+                        help='Connections longer than this many times the median length are too long')
+    parser.add_argument('--workers', type=int, help='Number of worker processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+
+    kwargs = {'checks': tuple(args.checks), 'grid_size': tuple(args.grid), 'long_edge_factor': args.long_edge_factor}
+    report = {}
+    failed = False
+    tasks = [(path, kwargs) for path in args.scripts]
+    for path, (issues, error) in zip(args.scripts, map_partitions(_lint_file_task, tasks, max_workers=args.workers)):
+        if error:
+            failed = True
+            sys.stderr.write('{}: failed, {}\n'.format(path, error))
+        else:
+            report[path] = issues
+            failed = failed or bool(issues)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
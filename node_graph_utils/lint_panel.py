@@ -0,0 +1,98 @@
+"""
+Panel listing the layout problems of the current DAG, see `lint`.
+
+Clicking an issue selects the nodes involved and centers the DAG on them.
+"""
+import json
+
+import nuke
+from Qt import QtCore, QtWidgets
+
+from .dag import clear_selection, get_current_dag, get_dag_node, get_grid_size, get_nodes_bounds, node_id, select
+from .lint import CHECKS, lint_snapshot
+from .snapshot import GraphSnapshot
+
+CHECK_TITLES = {
+    'overlap': 'Overlapping nodes',
+    'outside_backdrop': 'Nodes partly outside backdrops',
+    'z_order': 'Backdrops behind their parent backdrop',
+    'off_grid': 'Nodes off the grid',
+    'long_edge': 'Long connections',
+    'crossing': 'Crossing connections',
+}
+
+
+class LintPanel(QtWidgets.QDialog):
+    def __init__(self, parent=None):
+        super(LintPanel, self).__init__(parent=parent)
+        self.group = None
+        self.nodes = {}  # Nodes of the group, by id
+        self.issues = []
+
+        self.summary = QtWidgets.QLabel()
+        self.tree = QtWidgets.QTreeWidget()
+        self.tree.setHeaderHidden(True)
+        refresh_button = QtWidgets.QPushButton('Refresh')
+        copy_button = QtWidgets.QPushButton('Copy as JSON')
+
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(refresh_button)
+        buttons.addWidget(copy_button)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.summary)
+        layout.addWidget(self.tree)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+        self.resize(500, 400)
+        self.setWindowTitle('Layout Lint')
+
+        self.tree.itemClicked.connect(self.jump_to)
+        refresh_button.clicked.connect(self.refresh)
+        copy_button.clicked.connect(self.copy_json)
+
+    def refresh(self):
+        """ Check the layout of the group again """
+        with self.group:
+            nodes = nuke.allNodes()
+            self.nodes = dict((node_id(node), node) for node in nodes)
+            self.issues = lint_snapshot(GraphSnapshot.from_nodes(nodes), grid_size=get_grid_size())
+
+        self.tree.clear()
+        by_check = dict((check, []) for check in CHECKS)
+        for index, issue in enumerate(self.issues):
+            by_check[issue['check']].append(index)
+        for check in CHECKS:
+            if not by_check[check]:
+                continue
+            check_item = QtWidgets.QTreeWidgetItem(['{} ({})'.format(CHECK_TITLES[check], len(by_check[check]))])
+            for index in by_check[check]:
+                item = QtWidgets.QTreeWidgetItem([self.issues[index]['message']])
+                item.setData(0, QtCore.Qt.UserRole, index)
+                check_item.addChild(item)
+            self.tree.addTopLevelItem(check_item)
+        self.summary.setText('{}: {} issues'.format(self.group.fullName(), len(self.issues)))
+
+    def jump_to(self, item):
+        """ Select the nodes of an issue, and center the DAG on them """
+        index = item.data(0, QtCore.Qt.UserRole)
+        if index is None:
+            return
+        nodes = [self.nodes[key] for key in self.issues[index]['nodes']]
+        try:
+            with self.group:
+                clear_selection()
+                select(nodes)
+                center = get_nodes_bounds(nodes).center()
+                nuke.zoom(nuke.zoom(), [center.x(), center.y()])
+        except ValueError:
+            # The nodes were deleted since the check
+            self.refresh()
+
+    def copy_json(self):
+        QtWidgets.QApplication.clipboard().setText(json.dumps(self.issues, indent=2))
+
+    def run(self):
+        active_dag = get_current_dag()
+        self.group = get_dag_node(active_dag) if active_dag else nuke.root()
+        self.refresh()
+        self.show()
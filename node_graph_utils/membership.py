@@ -0,0 +1,281 @@
+"""
+Index of which backdrops contain which nodes.
+
+A node is in a backdrop when its rectangle is fully inside the backdrop, like `nuke.BackdropNode.getNodes`. Backdrops
+can be in other backdrops too. Backdrops are ordered front to back: higher z_order first, then smaller ones first.
+
+The x axis is cut into slabs at the left and right edges of the backdrops, and each slab lists the backdrops spanning
+it, front to back. Finding the backdrops at a point is a binary search for the slab, then a scan of the few backdrops
+stacked there. The slabs are built with a single sweep over the backdrop edges, and updated in place when a backdrop
+moves or resizes, so the index stays valid without being rebuilt.
+
+This module does not depend on nuke or Qt.
+Rectangles are plain (left, top, right, bottom) tuples, like in the `spatial` module.
+"""
+import bisect
+from collections import defaultdict
+
+
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+class BackdropMembership(object):
+    """ Backdrops around each node, and nodes in each backdrop """
+
+    def __init__(self):
+        self._rects = {}  # Rectangle of every node, backdrops included, by key
+        self._by_left = []  # (left, key) of every node, sorted, to find the nodes a backdrop may contain
+        self._backdrops = {}  # Sort key (-z_order, area) of each backdrop, front to back
+        self._containers = defaultdict(set)  # Backdrops around each node
+        self._contents = defaultdict(set)  # Nodes in each backdrop
+        self._edges = []  # Sorted x positions of the edges of the backdrops
+        self._edge_counts = defaultdict(int)  # Number of backdrops with an edge at each position
+        self._slabs = []  # Backdrops spanning each range between two edges, as sorted (sort key, key) tuples
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, key):
+        return key in self._rects
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Index all the nodes of a snapshot, with the z_order of the backdrops read from their knobs
+
+        Args:
+            snapshot (GraphSnapshot):
+
+        Returns:
+            BackdropMembership
+        """
+        membership = cls()
+        starts = defaultdict(list)
+        ends = defaultdict(list)
+        for node in snapshot:
+            membership._rects[node.id] = node.rect
+            if node.is_backdrop:
+                sort_key = (-int(node.knobs.get('z_order', 0)), node.width * node.height)
+                membership._backdrops[node.id] = sort_key
+                if node.width > 0:
+                    starts[node.x].append((sort_key, node.id))
+                    ends[node.x + node.width].append((sort_key, node.id))
+        membership._by_left = sorted((rect[0], key) for key, rect in membership._rects.items())
+
+        # Sweep the edges left to right, keeping the backdrops spanning the current slab sorted front to back
+        edges = sorted(set(starts) | set(ends))
+        active = []
+        for x in edges:
+            membership._edge_counts[x] = len(starts.get(x, ())) + len(ends.get(x, ()))
+            for item in ends.get(x, ()):
+                del active[bisect.bisect_left(active, item)]
+            for item in starts.get(x, ()):
+                bisect.insort(active, item)
+            membership._slabs.append(list(active))
+        membership._edges = edges
+        membership._slabs = membership._slabs[:-1]  # Nothing spans past the last edge
+
+        for key, rect in membership._rects.items():
+            for backdrop in membership._containing(key, rect):
+                membership._containers[key].add(backdrop)
+                membership._contents[backdrop].add(key)
+        return membership
+
+    def _slab_indices(self, left, right):
+        """ Range of the indices of the slabs between two edges """
+        return range(bisect.bisect_left(self._edges, left), bisect.bisect_left(self._edges, right))
+
+    def _add_edge(self, x):
+        self._edge_counts[x] += 1
+        if self._edge_counts[x] > 1:
+            return
+        index = bisect.bisect_left(self._edges, x)
+        self._edges.insert(index, x)
+        if len(self._edges) == 1:
+            return
+        if index == 0:
+            self._slabs.insert(0, [])
+        elif index == len(self._edges) - 1:
+            self._slabs.append([])
+        else:
+            # Split the slab, both halves are spanned by the same backdrops
+            self._slabs.insert(index, list(self._slabs[index - 1]))
+
+    def _remove_edge(self, x):
+        self._edge_counts[x] -= 1
+        if self._edge_counts[x]:
+            return
+        del self._edge_counts[x]
+        index = bisect.bisect_left(self._edges, x)
+        del self._edges[index]
+        if not self._slabs:
+            return
+        # Without an edge here, the slabs on both sides are spanned by the same backdrops, keep one
+        del self._slabs[min(index, len(self._slabs) - 1)]
+
+    def _add_backdrop(self, key, rect, z_order):
+        left, top, right, bottom = rect
+        sort_key = (-int(z_order), (right - left) * (bottom - top))
+        self._backdrops[key] = sort_key
+        if right > left:
+            self._add_edge(left)
+            self._add_edge(right)
+            for index in self._slab_indices(left, right):
+                bisect.insort(self._slabs[index], (sort_key, key))
+        for other in self._nodes_starting_between(left, right):
+            if other != key and _contains(rect, self._rects[other]):
+                self._contents[key].add(other)
+                self._containers[other].add(key)
+
+    def _remove_backdrop(self, key):
+        left, top, right, bottom = self._rects[key]
+        sort_key = self._backdrops.pop(key)
+        if right > left:
+            for index in self._slab_indices(left, right):
+                slab = self._slabs[index]
+                del slab[bisect.bisect_left(slab, (sort_key, key))]
+            self._remove_edge(right)
+            self._remove_edge(left)
+        for other in self._contents.pop(key, ()):
+            self._containers[other].discard(key)
+
+    def _nodes_starting_between(self, left, right):
+        """ Keys of the nodes whose left edge is between two positions """
+        keys = []
+        for index in range(bisect.bisect_left(self._by_left, (left,)), len(self._by_left)):
+            node_left, key = self._by_left[index]
+            if node_left > right:
+                break
+            keys.append(key)
+        return keys
+
+    def _containing(self, key, rect):
+        """ Backdrops around a rectangle, front to back, ignoring the backdrop `key` """
+        return [backdrop for backdrop in self.backdrops_at(rect[0], rect[1])
+                if backdrop != key and _contains(self._rects[backdrop], rect)]
+
+    def update(self, key, rect, z_order=None):
+        """
+        Add a node, or update it after it moved, resized or changed z_order
+
+        Args:
+            key (object): Any hashable object identifying the node, usually the node id
+            rect (tuple[int, int, int, int]): left, top, right, bottom
+            z_order (int or None): z_order of backdrops, None for other nodes
+
+        Returns:
+            set: Keys of the nodes whose backdrops changed, including the node itself
+        """
+        old_contents = set(self._contents.get(key, ()))
+        old_containers = set(self._containers.get(key, ()))
+        self.remove(key)
+
+        rect = tuple(rect)
+        self._rects[key] = rect
+        bisect.insort(self._by_left, (rect[0], key))
+        if z_order is not None:
+            self._add_backdrop(key, rect, z_order)
+        for backdrop in self._containing(key, rect):
+            self._containers[key].add(backdrop)
+            self._contents[backdrop].add(key)
+
+        changed = old_contents ^ self._contents.get(key, set())
+        if old_containers != self._containers.get(key, set()):
+            changed.add(key)
+        return changed
+
+    def remove(self, key):
+        """
+        Remove a node. Unknown keys are ignored.
+
+        Returns:
+            set: Keys of the nodes which were in the node, if it was a backdrop
+        """
+        rect = self._rects.pop(key, None)
+        if rect is None:
+            return set()
+        del self._by_left[bisect.bisect_left(self._by_left, (rect[0], key))]
+        contents = set()
+        if key in self._backdrops:
+            self._rects[key] = rect  # Needed to find the slabs
+            contents = set(self._contents.get(key, ()))
+            self._remove_backdrop(key)
+            del self._rects[key]
+        for backdrop in self._containers.pop(key, ()):
+            self._contents[backdrop].discard(key)
+        return contents
+
+    def rect(self, key):
+        """ Return the rectangle stored for the key """
+        return self._rects[key]
+
+    def is_backdrop(self, key):
+        return key in self._backdrops
+
+    def backdrops_at(self, x, y):
+        """
+        Backdrops under a point
+
+        Returns:
+            list: Keys of the backdrops, front to back
+        """
+        index = bisect.bisect_right(self._edges, x) - 1
+        candidates = []
+        # A point on an edge is also in the slab ending there, rectangles include their right edge
+        for slab_index in [index - 1, index] if index > 0 and self._edges[index] == x else [index]:
+            if 0 <= slab_index < len(self._slabs):
+                candidates.extend(self._slabs[slab_index])
+        found = []
+        for item in sorted(set(candidates)):
+            left, top, right, bottom = self._rects[item[1]]
+            if left <= x <= right and top <= y <= bottom:
+                found.append(item[1])
+        return found
+
+    def innermost_at(self, x, y):
+        """ Front most backdrop under a point, None if there are none """
+        backdrops = self.backdrops_at(x, y)
+        return backdrops[0] if backdrops else None
+
+    def outermost_at(self, x, y):
+        """ Back most backdrop under a point, None if there are none """
+        backdrops = self.backdrops_at(x, y)
+        return backdrops[-1] if backdrops else None
+
+    def backdrops_intersecting(self, rect):
+        """
+        Backdrops overlapping a rectangle
+
+        Returns:
+            list: Keys of the backdrops, front to back
+        """
+        left, top, right, bottom = rect
+        candidates = set()
+        first = max(bisect.bisect_left(self._edges, left) - 1, 0)
+        for index in range(first, min(bisect.bisect_right(self._edges, right), len(self._slabs))):
+            candidates.update(self._slabs[index])
+        found = []
+        for item in sorted(candidates):
+            other = self._rects[item[1]]
+            if other[0] <= right and left <= other[2] and other[1] <= bottom and top <= other[3]:
+                found.append(item[1])
+        return found
+
+    def backdrops_around(self, key):
+        """
+        Backdrops containing a node
+
+        Returns:
+            list: Keys of the backdrops, front to back, so the innermost one first
+        """
+        return sorted(self._containers.get(key, ()), key=lambda backdrop: (self._backdrops[backdrop], backdrop))
+
+    def contents(self, key):
+        """
+        Nodes in a backdrop, including other backdrops and their contents
+
+        Returns:
+            set: Keys of the nodes
+        """
+        return set(self._contents.get(key, ()))
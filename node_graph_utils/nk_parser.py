@@ -0,0 +1,569 @@
+"""
+Streaming parser for .nk scripts, to run the layout tools without nuke.
+
+Only the parts of the script needed to work on the node graph are read: class, name, position, a few knobs, group
+nesting and connections (the nuke stack commands). Other knobs are skipped without being parsed: the file is read
+through a memory map, node blocks are delimited with searches over the raw bytes and the wanted knobs extracted with a
+regex. Only nodes with values spanning several lines are read line by line.
+
+`parse_nk` returns one GraphSnapshot per group, so the algorithms working on snapshots of a nuke DAG can run on the
+script. `iter_nodes` gives lower level access to the parsed nodes, including where they are written in the file, and
+`knob_spans` where their knobs are. `set_knobs` edits scripts in place.
+
+This module does not depend on nuke or Qt.
+"""
+from collections import OrderedDict
+import math
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+from .layout_engine import estimate_label_size
+from .snapshot import GraphSnapshot, SnapshotNode, default_node_size
+
+# Knobs read by default. Other knobs are skipped.
+DEFAULT_KNOBS = ('name', 'xpos', 'ypos', 'label', 'tile_color', 'z_order', 'bdwidth', 'bdheight', 'note_font_size',
+                 'postage_stamp')
+# Knobs converted to integers
+INTEGER_KNOBS = ('xpos', 'ypos', 'tile_color', 'z_order', 'bdwidth', 'bdheight', 'note_font_size')
+# Node classes showing a thumbnail unless their postage_stamp knob is turned off, and the size of nodes showing one
+POSTAGE_STAMP_CLASSES = ('Read', 'DeepRead', 'PostageStamp')
+POSTAGE_STAMP_SIZE = (80, 78)
+# Node classes whose content is written after them, up to an `end_group` command
+GROUP_CLASSES = ('Group', 'LiveGroup')
+
+# Copy unchanged parts of the scripts in blocks of this size when editing them, to keep memory bounded
+_COPY_BLOCK_SIZE = 16 * 1024 * 1024
+_replace = getattr(os, 'replace', os.rename)  # Python 2 has no os.replace
+
+_ESCAPES = {'n': '\n', 't': '\t'}
+_ESCAPED = re.compile(br'\\.')
+_SYNTAX = re.compile(br'[{}"]')
+# Bytes which don't matter to find where values start and end
+_NOT_SYNTAX = bytes(bytearray(byte for byte in range(256) if byte not in bytearray(b'{}"\n')))
+# Whether node blocks only have single line knobs, by skeleton of the block (see `_single_line_knobs`)
+_SKELETONS = {}
+_SKELETONS_MAX = 10000
+
+
+class NkNode(object):
+    """ A node read from a .nk script """
+
+    __slots__ = ('group', 'node_class', 'name', 'knobs', 'inputs', 'span')
+
+    def __init__(self, group, node_class):
+        self.group = group  # Full name of the parent group, '' for root
+        self.node_class = node_class
+        self.name = None
+        self.knobs = {}  # Raw value of the knobs read
+        self.inputs = []  # NkNode or None, input 0 first
+        self.span = None  # (start, end) byte offsets of the node in the file, from its class to its closing brace
+
+    def __repr__(self):
+        return '<NkNode {} ({})>'.format(self.full_name, self.node_class)
+
+    @property
+    def full_name(self):
+        """ Same as nuke.Node.fullName """
+        return '{}.{}'.format(self.group, self.name) if self.group else self.name
+
+    def knob_value(self, name, default=None):
+        """ Value of a knob read from the script, unquoted, converted to int for `INTEGER_KNOBS` """
+        raw = self.knobs.get(name)
+        if raw is None:
+            return default
+        if name not in INTEGER_KNOBS:
+            return unquote(raw)
+        try:
+            return int(raw, 0)
+        except ValueError:
+            value = unquote(raw)
+        try:
+            return int(value, 0)
+        except ValueError:
+            try:
+                return int(float(value))
+            except ValueError:
+                return default
+
+
+def unquote(raw):
+    """ Turn a knob value as written in the script into the string it represents """
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] == '{' and raw[-1] == '}':
+        return raw[1:-1]
+    if len(raw) >= 2 and raw[0] == '"' and raw[-1] == '"':
+        raw = raw[1:-1]
+    if '\\' not in raw:
+        return raw
+    chars = []
+    index = 0
+    while index < len(raw):
+        char = raw[index]
+        if char == '\\' and index + 1 < len(raw):
+            index += 1
+            char = _ESCAPES.get(raw[index], raw[index])
+        chars.append(char)
+        index += 1
+    return ''.join(chars)
+
+
+def _decode(raw):
+    return raw.decode('utf-8', 'replace')
+
+
+def _scan(line, depth, in_quotes):
+    """
+    Follow the braces and quotes of a line.
+
+    Quotes only delimit strings outside of braced values, and escaped characters never count.
+
+    Returns:
+        tuple[int, bool]: depth and quoting state at the end of the line
+    """
+    if b'\\' in line:
+        line = _ESCAPED.sub(b'', line)
+    if not in_quotes and b'"' not in line:
+        return depth + line.count(b'{') - line.count(b'}'), False
+    for match in _SYNTAX.finditer(line):
+        char = match.group()
+        if in_quotes:
+            if char == b'"':
+                in_quotes = False
+        elif char == b'{':
+            depth += 1
+        elif char == b'}':
+            depth -= 1
+        elif depth <= 1:
+            in_quotes = True
+    return depth, in_quotes
+
+
+def _knob_pattern(knobs):
+    """ Regex matching the lines of the given knobs, in a node block where every knob is on its own line """
+    names = b'|'.join(re.escape(name.encode('utf-8')) for name in sorted(knobs, key=len, reverse=True))
+    return re.compile(br'\n[ \t]*((' + names + br')(?:[ \t]+([^\r\n]*))?)(?=[\r\n])')
+
+
+def _single_line_knobs(body):
+    """
+    Whether every knob of a node block is written on a single line.
+
+    Only braces, quotes and line breaks matter. Nodes of the same class are usually written the same way, so the
+    result is cached for each skeleton of these characters.
+    """
+    if b'\\' in body:
+        body = _ESCAPED.sub(b'', body)
+    skeleton = body.translate(None, _NOT_SYNTAX)
+    single_line = _SKELETONS.get(skeleton)
+    if single_line is None:
+        single_line = True
+        for line in skeleton.split(b'\n'):
+            if b'"' in line:
+                # A value like "{" is fine, but is not worth telling apart from a quote inside braces
+                single_line = (line == b'""' * (len(line) // 2))
+            elif line:
+                depth = 0
+                for char in bytearray(line):
+                    depth += 1 if char == 123 else -1  # {
+                    if depth < 0:
+                        break
+                single_line = depth == 0
+            if not single_line:
+                break
+        if len(_SKELETONS) < _SKELETONS_MAX:
+            _SKELETONS[skeleton] = single_line
+    return single_line
+
+
+def _read_block(data, start, indent, knob_pattern, knob_names, spans=None):
+    """
+    Read the knobs of a node block, the fast way.
+
+    Nuke closes node blocks with a brace on its own line, indented like the node. When all the knobs before such a
+    line are on a single line, it's the end of the block and the knobs are found with a regex, without going through
+    the lines in python.
+
+    Args:
+        data (mmap.mmap): The script
+        start (int): Offset of the first line after the node declaration
+        indent (bytes): Indentation of the node declaration
+        knob_pattern: Regex made by `_knob_pattern`
+        knob_names (dict[bytes, str]): Decoded names of the knobs matched by the pattern
+        spans (dict or None): If given, filled with the (start, end) offsets of the knob lines
+
+    Returns:
+        tuple[dict, int] or None: knob values and offset of the end of the closing line.
+            None if the block can't be read the fast way.
+    """
+    closing = b'\n' + indent + b'}'
+    candidate = data.find(closing, start - 1)
+    while candidate != -1:
+        end = candidate + len(closing)
+        if data[end:end + 1] in (b'\n', b'\r', b''):
+            break
+        candidate = data.find(closing, end)
+    else:
+        return None
+    # From the line break ending the declaration, to the one before the closing brace
+    body = data[start - 1:candidate + 1]
+    if not _single_line_knobs(body):
+        return None
+    knobs = {}
+    for _line, name, value in knob_pattern.findall(body):
+        knobs[knob_names[name]] = value.rstrip().decode('utf-8', 'replace')
+    if spans is not None:
+        for match in knob_pattern.finditer(body):
+            spans[knob_names[match.group(2)]] = (start - 1 + match.start(1), start - 1 + match.end(1))
+    return knobs, end
+
+
+def _read_block_slowly(data, start, wanted, spans=None):
+    """
+    Read the knobs of a node block line by line, following quotes and braces. Handles any block.
+
+    Args:
+        data (mmap.mmap): The script
+        start (int): Offset of the first line after the node declaration
+        wanted (set[str]): Knobs to read
+        spans (dict or None): If given, filled with the (start, end) offsets of the knob lines
+
+    Returns:
+        tuple[dict, int]: knob values and offset of the end of the closing line
+    """
+    knobs = {}
+    if spans is None:
+        spans = {}
+    depth, in_quotes = 1, False
+    knob_name = None  # Knob whose value is being read
+    knob_start = None
+    position = start
+    size = len(data)
+    while position < size:
+        line_end = data.find(b'\n', position)
+        if line_end == -1:
+            line_end = size
+        line = data[position:line_end].rstrip(b'\r')
+        if knob_name is None:
+            stripped = line.lstrip()
+            words = stripped.split(None, 1)
+            name = _decode(words[0]) if words else ''
+            if depth == 1 and not in_quotes:
+                if name == '}':
+                    return knobs, line_end
+                if name in wanted:
+                    knob_name = name
+                    knob_start = position + len(line) - len(stripped)
+        depth, in_quotes = _scan(line, depth, in_quotes)
+
+        if knob_name is not None and (depth <= 1 and not in_quotes or line_end == size):
+            value = data[knob_start:position + len(line)]
+            if depth == 0:  # Block closed on the same line as the value
+                value = value.rstrip().rstrip(b'}')
+            knobs[knob_name] = _decode(value[len(knob_name):].strip())
+            spans[knob_name] = (knob_start, knob_start + len(value))
+            knob_name = None
+        if depth <= 0:
+            return knobs, line_end
+        position = line_end + 1
+    return knobs, size
+
+
+def iter_nodes(path, knobs=DEFAULT_KNOBS):
+    """
+    Parse the nodes of a .nk script, in the order they are written.
+
+    A node's inputs are resolved when the node is read, so they are only written before the node itself.
+
+    Args:
+        path (str): Path to the .nk script
+        knobs (tuple[str]): Knobs to read, others are skipped
+
+    Yields:
+        NkNode
+    """
+    wanted = frozenset(knobs) | {'name', 'inputs'}
+    knob_pattern = _knob_pattern(wanted)
+    knob_names = dict((name.encode('utf-8'), name) for name in wanted)
+    stack = []
+    parent_stacks = []  # Stacks of the parent groups, restored at `end_group`
+    groups = ['']  # Full name of the current group, and its parents
+    variables = {}
+    auto_names = {}  # Names in use, and last number used to name each class, by group
+
+    with open(path, 'rb') as script:
+        try:
+            data = mmap.mmap(script.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            return
+        try:
+            size = len(data)
+            position = 0
+            while position < size:
+                line_end = data.find(b'\n', position)
+                if line_end == -1:
+                    line_end = size
+                line = data[position:line_end]
+                line_start = position
+                position = line_end + 1
+
+                stripped = line.strip()
+                if not stripped or stripped.startswith(b'#'):
+                    continue
+                words = stripped.split()
+                command = words[0]
+                if command == b'push' and len(words) > 1:
+                    variable = _decode(words[1])
+                    stack.append(variables.get(variable[1:]) if variable.startswith('$') else None)
+                    continue
+                if command == b'set' and len(words) > 1:
+                    variables[_decode(words[1])] = stack[-1] if stack else None
+                    continue
+                if command == b'end_group':
+                    stack = parent_stacks.pop() if parent_stacks else []
+                    if len(groups) > 1:
+                        groups.pop()
+                    continue
+                if not command[:1].isalpha():
+                    continue
+
+                if stripped.endswith(b'{'):
+                    # Node declaration: `Class {`, `clone $variable {` or `clone id Class {` for the first clone
+                    node_class = _decode(command)
+                    if command == b'clone' and len(words) > 2:
+                        if words[1].startswith(b'$'):
+                            original = variables.get(_decode(words[1][1:]))
+                            node_class = original.node_class if original is not None else node_class
+                        else:
+                            node_class = _decode(words[-2])
+                    indent = line[:len(line) - len(line.lstrip())]
+                    block = _read_block(data, position, indent, knob_pattern, knob_names)
+                    if block is None:
+                        block = _read_block_slowly(data, position, wanted)
+                    node = NkNode(groups[-1], node_class)
+                    node.knobs, block_end = block
+                    position = block_end + 1
+                elif len(words) == 2 and words[1] == b'{}':
+                    # Node without any knob, `Class {}`
+                    node = NkNode(groups[-1], _decode(command))
+                    block_end = line_end
+                else:
+                    continue
+
+                node.span = (line_start + len(line) - len(line.lstrip()), block_end)
+                node = _finish_node(node, stack, auto_names)
+                if node is None:
+                    continue  # Root
+                yield node
+                if node.node_class in GROUP_CLASSES:
+                    parent_stacks.append(stack)
+                    stack = []
+                    groups.append(node.full_name)
+        finally:
+            data.close()
+
+
+def knob_spans(data, node):
+    """
+    Find where the knobs of a parsed node are written, to edit them in place.
+
+    Args:
+        data (bytes or mmap.mmap): Content of the script the node was read from
+        node (NkNode): Node from `iter_nodes`
+
+    Returns:
+        dict[str, tuple[int, int]]: (start, end) byte offsets of the lines of the knobs read for the node, without
+            their indentation and line break. The line of a value written on several lines ends with the value.
+    """
+    spans = {}
+    if not node.knobs:
+        return spans
+    declaration = node.span[0]
+    indent = data[data.rfind(b'\n', 0, declaration) + 1:declaration]
+    start = data.find(b'\n', declaration) + 1
+    wanted = frozenset(node.knobs)
+    knob_names = dict((name.encode('utf-8'), name) for name in wanted)
+    if _read_block(data, start, indent, _knob_pattern(wanted), knob_names, spans) is None:
+        _read_block_slowly(data, start, wanted, spans)
+    return spans
+
+
+def _node_edits(data, node, values):
+    """
+    Edits to the script setting knobs of a node
+
+    Args:
+        data (mmap.mmap): The script
+        node (nk_parser.NkNode): Node to edit
+        values (dict[str, str]): New raw knob values, as written in scripts
+
+    Returns:
+        list[tuple[int, int, bytes]]: (start, end, text) replacements of the script bytes
+    """
+    spans = knob_spans(data, node)
+    start, end = node.span
+    node_indent = data[data.rfind(b'\n', 0, start) + 1:start]
+    edits = []
+    new_lines = []
+    for name in sorted(values):
+        line = '{} {}'.format(name, values[name]).encode('utf-8')
+        if name in spans:
+            edits.append((spans[name][0], spans[name][1], line))
+        else:
+            # Knobs at their default value are not written, add them at the end of the node
+            new_lines.append(node_indent + b' ' + line + b'\n')
+    if new_lines:
+        closing_line = data.rfind(b'\n', start, end) + 1
+        if closing_line:
+            edits.append((closing_line, closing_line, b''.join(new_lines)))
+        else:
+            # Node without knobs written on a single line, `Class {}`
+            declaration = data[start:end].rstrip()[:-2].rstrip()
+            edits.append((start, end, declaration + b' {\n' + b''.join(new_lines) + node_indent + b'}'))
+    return edits
+
+
+def _copy(output, data, start, end):
+    for block_start in range(start, end, _COPY_BLOCK_SIZE):
+        output.write(data[block_start:min(end, block_start + _COPY_BLOCK_SIZE)])
+
+
+def _write_edits(path, data, edits):
+    """ Write a copy of the script with the edits applied next to it, return its path """
+    descriptor, temp_path = tempfile.mkstemp(suffix='.nk', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            position = 0
+            for start, end, text in sorted(edits):
+                _copy(output, data, position, start)
+                output.write(text)
+                position = end
+            _copy(output, data, position, len(data))
+        shutil.copymode(path, temp_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def set_knobs(path, changes):
+    """
+    Change knob values of a script in place.
+
+    Only the lines of the changed knobs are rewritten, knobs which were not written are added at the end of their
+    node. The edited script is written next to the original, then replaces it.
+
+    Args:
+        path (str): Path to the script
+        changes (dict[NkNode, dict[str, str]]): New raw knob values, as written in scripts, by node. The nodes must
+            have been parsed from the script with `iter_nodes`, and the script not modified since.
+    """
+    if not changes:
+        return
+    with open(path, 'rb') as script:
+        data = mmap.mmap(script.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            edits = []
+            for node, values in changes.items():
+                edits.extend(_node_edits(data, node, values))
+            temp_path = _write_edits(path, data, edits)
+        finally:
+            data.close()
+    _replace(temp_path, path)
+
+
+def _finish_node(node, stack, auto_names):
+    """ Pop the node's inputs from the stack and push the node, return None for blocks which are not nodes """
+    if node.node_class == 'Root':
+        return None
+
+    inputs_value = node.knobs.get('inputs')
+    if inputs_value is None:
+        input_count = 1
+    else:
+        try:
+            # Mask inputs are written as `inputs 2+1`
+            input_count = sum(int(part) for part in unquote(inputs_value).split('+'))
+        except ValueError:
+            input_count = 1
+    for _index in range(input_count):
+        node.inputs.append(stack.pop() if stack else None)
+    stack.append(node)
+
+    name = node.knobs.get('name')
+    if name and (name[0] in '{"' or '\\' in name):
+        name = unquote(name)
+    if not name:
+        # Nuke names nodes itself when the name isn't written
+        count = auto_names.get((node.group, node.node_class), 0)
+        while not name or (node.group, name) in auto_names:
+            count += 1
+            name = '{}{}'.format(node.node_class, count)
+        auto_names[(node.group, node.node_class)] = count
+    node.name = name
+    auto_names[(node.group, name)] = True  # Name in use
+    return node
+
+
+def snapshot_node(node):
+    """
+    Convert a parsed node to a snapshot node, with the same id as `GraphSnapshot.from_nodes` would give.
+
+    Sizes are estimated, as only nuke can draw the nodes: backdrops use their bdwidth and bdheight, nodes showing a
+    thumbnail `POSTAGE_STAMP_SIZE`, and the label of other nodes is added under their name with
+    `layout_engine.estimate_label_size`. Labels with TCL expressions are measured as written.
+
+    Args:
+        node (NkNode):
+
+    Returns:
+        SnapshotNode
+    """
+    if node.node_class == 'BackdropNode':
+        width = node.knob_value('bdwidth', 0)
+        height = node.knob_value('bdheight', 0)
+    else:
+        width, height = default_node_size(node.node_class)
+        postage_stamp = node.knob_value('postage_stamp')
+        if postage_stamp is None:
+            postage_stamp = node.node_class in POSTAGE_STAMP_CLASSES
+        else:
+            postage_stamp = postage_stamp.lower() not in ('false', '0')
+        if postage_stamp:
+            width, height = POSTAGE_STAMP_SIZE
+        if node.node_class != 'Dot':  # Dots draw their label next to them
+            label_width, label_height = estimate_label_size(node.knob_value('label'),
+                                                            node.knob_value('note_font_size') or 11)
+            width = max(width, int(math.ceil(label_width)))
+            height += int(math.ceil(label_height))
+    inputs = [input_node.full_name if input_node is not None else None for input_node in node.inputs]
+    # Trailing disconnected inputs are not reported by nuke.Node.inputs()
+    while inputs and inputs[-1] is None:
+        inputs.pop()
+    knobs = {}
+    for name in node.knobs:
+        if name not in ('name', 'inputs', 'xpos', 'ypos', 'bdwidth', 'bdheight'):
+            knobs[name] = node.knob_value(name)
+    return SnapshotNode(node.full_name, node.node_class, node.knob_value('xpos', 0), node.knob_value('ypos', 0),
+                        width, height, inputs, knobs)
+
+
+def parse_nk(path, knobs=DEFAULT_KNOBS):
+    """
+    Parse a .nk script into snapshots
+
+    Args:
+        path (str): Path to the .nk script
+        knobs (tuple[str]): Knobs to read, see `iter_nodes`
+
+    Returns:
+        OrderedDict[str, GraphSnapshot]: One snapshot per group, keyed by the full name of the group ('' for root)
+    """
+    snapshots = OrderedDict([('', GraphSnapshot())])
+    for node in iter_nodes(path, knobs):
+        if node.group not in snapshots:
+            snapshots[node.group] = GraphSnapshot()
+        snapshots[node.group].add(snapshot_node(node))
+    return snapshots
@@ -0,0 +1,239 @@
+"""
+Base classes for the transparent widgets drawn on top of the DAG (Snappy, Snippy and the Scale widget)
+"""
+from Qt import QtCore, QtGui, QtWidgets
+
+from .dag import get_dag_node, get_dag_widgets
+from .viewport import get_viewport, DagWidgetClass
+
+
+class DagOverlay(QtWidgets.QWidget):
+    """
+    Transparent, frameless widget covering a DAG widget exactly.
+
+    Takes care of the group context, of the transform between DAG and widget coordinates, and of installing itself
+    as an application wide event filter while shown. Subclasses implement `eventFilter` and `paint_overlay`.
+
+    The transform comes from the DAG's cached viewport, which notifies the overlay through `on_viewport_changed`
+    when the user zooms or pans. Anything cached in widget coordinates must be updated there.
+
+    Repaints are done by dirty rectangles: call `mark_dirty` with the area that changed rather than `update()`.
+    Parts of the overlay that do not change on every paint should be drawn once into a layer (see `new_layer`),
+    so that painting only copies the dirty area of each layer.
+    """
+    border_color = None
+    border_width = 3
+
+    def __init__(self, dag_widget):
+        super(DagOverlay, self).__init__(parent=dag_widget)
+
+        # Group context
+        self.dag_node = get_dag_node(self.parent())  # 'dag_widget', but it's garbage collected..
+
+        # Make Widget transparent
+        self.setWindowFlags(QtCore.Qt.Window | QtCore.Qt.FramelessWindowHint)
+        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
+        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        self.setFocusPolicy(QtCore.Qt.NoFocus)
+
+        # Overlay it with the DAG exactly
+        dag_rect = dag_widget.geometry()
+        dag_rect.moveTopLeft(dag_widget.parentWidget().mapToGlobal(dag_rect.topLeft()))
+        self.setGeometry(dag_rect)
+
+        # DAG to widget coordinates
+        self.viewport = get_viewport(dag_widget)
+        self.viewport.changed.connect(self.on_viewport_changed)
+
+    @property
+    def scale(self):
+        return self.viewport.zoom
+
+    @property
+    def transform(self):
+        """ QtGui.QTransform: DAG to widget coordinates """
+        return self.viewport.transform
+
+    def map_to_dag(self, point):
+        """ Map a point from widget coordinates to DAG coordinates """
+        return self.viewport.map_to_dag(point)
+
+    def on_viewport_changed(self):
+        """ The DAG was zoomed or panned, everything drawn has moved so repaint it all """
+        self.update()
+
+    def forward_wheel_event(self, widget, event):
+        """
+        Due to a QT bug, our transparent widget is swallowing wheel events, pass them back to DAG
+        See https://bugreports.qt.io/browse/QTBUG-53418
+
+        Returns:
+            bool: True if the event was forwarded, and should be filtered out.
+        """
+        if widget is self:
+            dag = get_dag_widgets()[0]
+            gl_widget = dag.findChild(DagWidgetClass)
+            if gl_widget:
+                QtWidgets.QApplication.sendEvent(gl_widget, event)
+                return True
+        # In Nuke 16+, PySide6 is used, so the bug above is fixed, the viewport sees the event by itself.
+        return False
+
+    def new_layer(self):
+        """ Make a transparent pixmap the size of the overlay, to cache static drawings into """
+        layer = QtGui.QPixmap(self.size())
+        layer.fill(QtCore.Qt.transparent)
+        return layer
+
+    def mark_dirty(self, rect, margin=2):
+        """
+        Schedule a repaint of part of the widget. Qt merges the dirty areas until the next paint event.
+
+        Args:
+            rect (QtCore.QRect or QtCore.QRectF): Area to repaint, in widget coordinates
+            margin (int): Extra pixels to repaint around the area, to account for pen width and antialiasing
+        """
+        if isinstance(rect, QtCore.QRectF):
+            rect = rect.toAlignedRect()
+        self.update(rect.adjusted(-margin, -margin, margin, margin))
+
+    def paintEvent(self, event):
+        """ Draw The widget """
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        if self.border_color:
+            pen = QtGui.QPen()
+            pen.setColor(QtGui.QColor(self.border_color))
+            pen.setWidth(self.border_width)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawRect(self.rect())
+        self.paint_overlay(painter, event.rect())
+
+    def paint_overlay(self, painter, rect):
+        """
+        Draw the content of the overlay. Qt clips the painter to the dirty region.
+
+        Args:
+            painter (QtGui.QPainter): Painter, in widget coordinates
+            rect (QtCore.QRect): Bounding rectangle of the area being repainted
+        """
+        raise NotImplementedError()
+
+    def show(self):
+        self.viewport.refresh()
+        super(DagOverlay, self).show()
+        # Install Event filter
+        QtWidgets.QApplication.instance().installEventFilter(self)
+
+    def close(self):
+        QtWidgets.QApplication.instance().removeEventFilter(self)
+        self.viewport.changed.disconnect(self.on_viewport_changed)
+        super(DagOverlay, self).close()
+
+
+class StrokeOverlay(DagOverlay):
+    """
+    Overlay on which the user draws free-hand strokes while holding the left mouse button.
+    Any other click or any key release closes it.
+
+    Subclasses implement `stroke_segment` to react to each new segment of the stroke.
+    """
+    stroke_color = 'white'
+    stroke_width = 2
+
+    def __init__(self, dag_widget):
+        super(StrokeOverlay, self).__init__(dag_widget)
+        self.stroke_layer = self.new_layer()
+        self.stroke_pen = QtGui.QPen(QtGui.QColor(self.stroke_color), self.stroke_width, QtCore.Qt.SolidLine,
+                                     QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin)
+        self.drawing = False
+        self.last_pos = None
+        self.strokes = []  # Lists of points in DAG coordinates, to redraw the strokes when the view changes
+
+    def paint_overlay(self, painter, rect):
+        painter.drawPixmap(rect, self.stroke_layer, rect)
+
+    def on_viewport_changed(self):
+        self.stroke_layer = self.new_layer()
+        painter = QtGui.QPainter(self.stroke_layer)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(self.stroke_pen)
+        for stroke in self.strokes:
+            painter.drawPolyline(QtGui.QPolygonF([self.transform.map(point) for point in stroke]))
+        painter.end()
+        if self.drawing:
+            self.last_pos = self.transform.map(self.strokes[-1][-1])
+        super(StrokeOverlay, self).on_viewport_changed()
+
+    def start_drawing(self, pos):
+        self.drawing = True
+        self.last_pos = pos
+        self.strokes.append([self.map_to_dag(pos)])
+
+    def stop_drawing(self):
+        self.drawing = False
+        self.last_pos = None
+
+    def draw_segment(self, pos):
+        line = QtCore.QLineF(self.last_pos, pos)
+        painter = QtGui.QPainter(self.stroke_layer)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(self.stroke_pen)
+        painter.drawLine(line)
+        painter.end()
+        self.mark_dirty(QtCore.QRectF(line.p1(), line.p2()).normalized(), margin=self.stroke_width + 1)
+        self.strokes[-1].append(self.map_to_dag(pos))
+
+        self.stroke_segment(line)
+        self.last_pos = pos
+
+    def stroke_segment(self, line):
+        """
+        Called for each new segment of the stroke
+
+        Args:
+            line (QtCore.QLineF): The new segment, in widget coordinates
+        """
+        raise NotImplementedError()
+
+    def eventFilter(self, widget, event):
+        """ Filter all the events happening while the overlay is shown """
+        if event.type() in [QtCore.QEvent.MouseButtonPress]:
+            if not self.geometry().contains(event.globalPos()):
+                # Clicked outside the widget
+                self.close()
+                return False
+
+            if event.button() == QtCore.Qt.LeftButton:
+                self.start_drawing(event.pos())
+                return True
+
+            # Any other click we bail
+            self.close()
+            return False
+
+        elif event.type() in [QtCore.QEvent.MouseButtonRelease]:
+            if event.button() == QtCore.Qt.LeftButton:
+                self.stop_drawing()
+                return True
+
+        elif event.type() in [QtCore.QEvent.MouseMove]:
+            if self.drawing:
+                self.draw_segment(event.pos())
+                return True
+
+        elif event.type() == QtCore.QEvent.KeyRelease:
+            if event.isAutoRepeat():
+                return True
+            self.close()
+            return True
+
+        elif event.type() == QtCore.QEvent.KeyPress:
+            if event.isAutoRepeat():
+                return True
+
+        elif event.type() == QtCore.QEvent.Wheel:
+            return self.forward_wheel_event(widget, event)
+
+        return False  # Swallow everything
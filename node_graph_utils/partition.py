@@ -0,0 +1,213 @@
+"""
+Split a graph into independent parts, and process the parts in parallel.
+
+Whole script operations (auto layout, de-intersect) can treat each part of the graph separately: nodes which are not
+connected, not in the same backdrop and far enough from each other can't influence each other. The parts are processed
+by a pool of worker processes, so they use all the cores of the machine, then merged back for a single commit.
+
+Workers receive plain rows (see `GraphSnapshot.to_rows`) rather than nuke nodes, and run pure python functions.
+This module does not depend on nuke or Qt.
+"""
+import glob
+import multiprocessing
+import os
+import sys
+
+from .snapshot import GraphSnapshot
+from .spatial import SpatialGrid
+
+try:
+    from concurrent import futures
+except ImportError:  # Python 2
+    futures = None
+
+# Starting worker processes takes a while, smaller jobs are faster processed serially.
+PARALLEL_MIN_NODES = 5000
+
+
+class UnionFind(object):
+    """ Disjoint sets of hashable keys """
+
+    def __init__(self, keys=()):
+        self._parents = dict((key, key) for key in keys)
+
+    def find(self, key):
+        root = self._parents.setdefault(key, key)
+        while self._parents[root] != root:
+            root = self._parents[root]
+        # Path compression
+        while key != root:
+            self._parents[key], key = root, self._parents[key]
+        return root
+
+    def union(self, key, other):
+        root, other_root = self.find(key), self.find(other)
+        if root != other_root:
+            self._parents[other_root] = root
+
+    def groups(self):
+        """ Return the sets as lists of keys, in the order keys were first seen """
+        groups = {}
+        ordered = []
+        for key in self._parents:
+            root = self.find(key)
+            if root not in groups:
+                groups[root] = []
+                ordered.append(groups[root])
+            groups[root].append(key)
+        return ordered
+
+
+def partition(snapshot, node_ids=None, connected=True, spatial_margin=None):
+    """
+    Split nodes into parts which can be processed independently.
+
+    Nodes in the same backdrop always end up in the same part. Backdrops themselves are not included in the parts,
+    `sub_snapshot` brings them back.
+
+    Args:
+        snapshot (GraphSnapshot): Graph to split
+        node_ids (list[str]): Nodes to split, all the nodes of the snapshot if None.
+        connected (bool): Keep connected nodes in the same part
+        spatial_margin (int or None): If set, nodes closer to each other than this margin are kept in the same part
+
+    Returns:
+        list[list[str]]: Node ids of each part
+    """
+    if node_ids is None:
+        node_ids = list(snapshot.nodes)
+    node_ids = [node_id for node_id in node_ids if not snapshot[node_id].is_backdrop]
+    selected = set(node_ids)
+    sets = UnionFind(node_ids)
+
+    if connected:
+        for node_id in node_ids:
+            for input_id in snapshot[node_id].inputs:
+                if input_id in selected:
+                    sets.union(node_id, input_id)
+
+    grid = SpatialGrid()
+    margin = spatial_margin or 0
+    for node_id in node_ids:
+        left, top, right, bottom = snapshot[node_id].rect
+        grid.insert(node_id, (left - margin, top - margin, right + margin, bottom + margin))
+
+    if spatial_margin is not None:
+        for node_id in node_ids:
+            for other_id in grid.query_rect(grid.rect(node_id)):
+                sets.union(node_id, other_id)
+
+    for backdrop in snapshot.backdrops():
+        left, top, right, bottom = backdrop.rect
+        contents = [node_id for node_id in grid.query_rect(backdrop.rect)
+                    if left <= snapshot[node_id].x and top <= snapshot[node_id].y
+                    and snapshot[node_id].rect[2] <= right and snapshot[node_id].rect[3] <= bottom]
+        for node_id in contents[1:]:
+            sets.union(contents[0], node_id)
+
+    return sets.groups()
+
+
+def sub_snapshot(snapshot, node_ids):
+    """
+    Make a snapshot with only some of the nodes, and the backdrops containing any of them
+
+    Args:
+        snapshot (GraphSnapshot):
+        node_ids (list[str]):
+
+    Returns:
+        GraphSnapshot
+    """
+    part = GraphSnapshot(snapshot[node_id] for node_id in node_ids)
+    for backdrop in snapshot.backdrops():
+        left, top, right, bottom = backdrop.rect
+        for node_id in node_ids:
+            node_left, node_top, node_right, node_bottom = snapshot[node_id].rect
+            if left <= node_left and top <= node_top and node_right <= right and node_bottom <= bottom:
+                part.add(backdrop)
+                break
+    return part
+
+
+def _python_executable():
+    """
+    Find a python interpreter to start workers with.
+
+    Inside nuke, `sys.executable` is nuke itself, which can't run the workers, but nuke ships its python interpreter
+    next to it.
+
+    Returns:
+        str or None: Path to the interpreter, None if none was found
+    """
+    executable = sys.executable
+    if not executable:
+        return None
+    if os.path.basename(executable).lower().startswith('python'):
+        return executable
+    folder = os.path.dirname(executable)
+    candidates = [os.path.join(folder, name) for name in ('python3', 'python', 'python3.exe', 'python.exe')]
+    candidates += sorted(glob.glob(os.path.join(folder, 'python3.*')))
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def map_partitions(function, tasks, node_count=None, max_workers=None, progress=None):
+    """
+    Call a function for each task, in a pool of worker processes when possible.
+
+    Falls back to calling the function in this process when there is only one task, when the pool can't be started
+    (python 2, no python interpreter found, already in a worker process) or if it breaks.
+
+    Args:
+        function (callable): Module level function, so it can be sent to the workers
+        tasks (list[tuple]): Arguments for each call. They should only contain plain python data.
+        node_count (int or None): Total number of nodes in the tasks. Below `PARALLEL_MIN_NODES`, starting the
+            workers would take longer than the work itself, so tasks are processed in this process.
+        max_workers (int or None): Number of worker processes, defaults to the number of cores
+        progress (callable or None): Called with the number of tasks done and the number of tasks each time a task
+            is done. If it returns True, the remaining tasks are cancelled.
+
+    Returns:
+        list: Result of each call, in the order of the tasks. Only the results of the first tasks if cancelled.
+    """
+    tasks = list(tasks)
+    parallel = node_count is None or node_count >= PARALLEL_MIN_NODES
+    # Workers processing a task don't start pools of their own, all the cores are already busy
+    parent_process = getattr(multiprocessing, 'parent_process', None)  # Python 3.8+
+    if parent_process is not None and parent_process() is not None:
+        parallel = False
+    if parallel and futures is not None and len(tasks) > 1:
+        executable = _python_executable()
+        if executable:
+            from multiprocessing import spawn
+            previous_executable = spawn.get_executable()
+            context = multiprocessing.get_context('spawn')
+            context.set_executable(executable)
+            try:
+                workers = min(len(tasks), max_workers or multiprocessing.cpu_count())
+                # Send small tasks in chunks, there can be hundreds of tiny parts in a script
+                chunk_size = max(1, len(tasks) // (workers * 4))
+                results = []
+                with futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                    for result in executor.map(function, *zip(*tasks), chunksize=chunk_size):
+                        results.append(result)
+                        if progress is not None and progress(len(results), len(tasks)):
+                            try:
+                                executor.shutdown(wait=False, cancel_futures=True)
+                            except TypeError:  # Python < 3.9 can't cancel, the tasks already sent still run
+                                pass
+                            break
+                return results
+            except Exception as error:  # Broken pool, unpicklable task, missing module in the workers...
+                sys.stderr.write('Could not process in parallel, processing serially instead: {}\n'.format(error))
+            finally:
+                spawn.set_executable(previous_executable)
+    results = []
+    for task in tasks:
+        results.append(function(*task))
+        if progress is not None and progress(len(results), len(tasks)):
+            break
+    return results
@@ -1,150 +1,213 @@
 import nuke
 from Qt import QtCore, QtGui, QtWidgets
 
-from .dag import (get_nodes_bounds, get_dag_widgets,
-                  NodeWrapper, get_dag_node, calculate_bounds_adjustment)
-
-try:
-    # PySide2
-    from PySide2.QtOpenGL import QGLWidget as DagWidgetClass
-except ImportError:
-    # PySide6
-    from PySide6.QtOpenGLWidgets import QOpenGLWidget as DagWidgetClass
-
-
-class ScaleWidget(QtWidgets.QWidget):
-    class _VectorWrapper(object):
-        def __init__(self, node, bounds, corner=None):
+from .dag import (get_nodes_bounds, node_id,
+                  NodeWrapper, calculate_bounds_adjustment)
+from .overlay import DagOverlay
+from .viewport import DagWidgetClass
+
+
+class ScaleWidget(DagOverlay):
+    class _PointArrays(object):
+        """
+        Flat arrays of the points used to scale a set of nodes: the center of regular nodes and the 4 corners of
+        backdrops. Points are stored relative to a bounding rectangle, so they can be moved by stretching it.
+        """
+        def __init__(self, wrappers, bounds):
             """
-            Store a NodeWrapper and its relative position to the bounds for simplified manipulation.
-
-            :param dag_utils.dag.NodeWrapper node:
-            :param QtCore.QRectF bounds: bounds to calculating relative position to
-            :param int corner: (Optional)
+            Args:
+                wrappers (list[NodeWrapper]): Nodes to scale
+                bounds (QtCore.QRectF): Bounds to calculate the relative positions to
             """
-            def _clamp(v):
-                """ Clamp vector between 0 and 1 """
-                return QtGui.QVector2D(0 if v.x() < 0 else 1 if v.x() > 1 else v.x(),
-                                       0 if v.y() < 0 else 1 if v.y() > 1 else v.y())
-            self.node_wrapper = node
-            self.corner = corner
-            self.original_point = self.get_point()
-            # Store the corner coordinates relative to the bounds, saves us from calculating it in event loop
-            bs = QtGui.QVector2D(bounds.size().width(), bounds.size().height())  # bounds size
-            vector = (QtGui.QVector2D(self.get_point()) - QtGui.QVector2D(bounds.topLeft())) / bs
-            self.vector = _clamp(vector)
-            self.offset = (vector - self.vector) * bs
-
-        def get_point(self):
-            """ Return QPoint corresponding to one of the 4 corners or the center of the node """
-            if self.corner is None:
-                return self.node_wrapper.center()
-            elif self.corner == 0:
-                return self.node_wrapper.topLeft()
-            elif self.corner == 1:
-                return self.node_wrapper.topRight()
-            elif self.corner == 2:
-                return self.node_wrapper.bottomRight()
-            return self.node_wrapper.bottomLeft()
-
-        def move(self, new_point, grid_size=None):
-            """ Apply the transformation to the node """
+            self.wrappers = wrappers
+            self.owners = []  # Index of the wrapper each point belongs to
+            self.corners = []  # None for a center, else 0 to 3 for topLeft, topRight, bottomRight, bottomLeft
+            self.xs = []
+            self.ys = []
+            self.committed_xs = []  # Positions last pushed to Nuke
+            self.committed_ys = []
+            for index, wrapper in enumerate(wrappers):
+                rect = wrapper.bounds
+                if wrapper.is_backdrop:
+                    corners = ((rect.left(), rect.top()), (rect.right(), rect.top()),
+                               (rect.right(), rect.bottom()), (rect.left(), rect.bottom()))
+                    for corner, (x, y) in enumerate(corners):
+                        self._add_point(index, corner, x, y)
+                else:
+                    center = rect.center()
+                    self._add_point(index, None, center.x(), center.y())
+            self.committed_xs = list(self.xs)
+            self.committed_ys = list(self.ys)
+            self.rebase(bounds)
+
+        def __len__(self):
+            return len(self.xs)
+
+        def _add_point(self, owner, corner, x, y):
+            self.owners.append(owner)
+            self.corners.append(corner)
+            self.xs.append(x)
+            self.ys.append(y)
+
+        @staticmethod
+        def _relative(values, start, size):
+            """ Positions relative to a segment, clamped between 0 and 1, and the offsets to the clamped position """
+            relative = []
+            offsets = []
+            for value in values:
+                ratio = (value - start) / size if size else 0.0
+                clamped = 0.0 if ratio < 0 else 1.0 if ratio > 1 else ratio
+                relative.append(clamped)
+                offsets.append(value - start - clamped * size)
+            return relative, offsets
+
+        def rebase(self, bounds):
+            """ Store the current positions relative to new bounds, saves us from calculating it in event loop """
+            self.origin_xs = list(self.xs)
+            self.origin_ys = list(self.ys)
+            self.relative_xs, self.offset_xs = self._relative(self.xs, bounds.left(), bounds.width())
+            self.relative_ys, self.offset_ys = self._relative(self.ys, bounds.top(), bounds.height())
+
+        def move_to(self, bounds, grid_size=None):
+            """ Calculate the points positions for new bounds, use `commit` to apply them to the nodes """
+            left, top = bounds.left(), bounds.top()
+            width, height = bounds.width(), bounds.height()
+            xs = [left + r * width + o for r, o in zip(self.relative_xs, self.offset_xs)]
+            ys = [top + r * height + o for r, o in zip(self.relative_ys, self.offset_ys)]
             if grid_size:
-                new_point = self._snap_to_grid(new_point, grid_size)
-            if self.corner is None:
-                self.node_wrapper.moveCenter(new_point)
-            elif self.corner == 0:
-                self.node_wrapper.setTopLeft(new_point)
-            elif self.corner == 1:
-                self.node_wrapper.setTopRight(new_point)
-            elif self.corner == 2:
-                self.node_wrapper.setBottomRight(new_point)
-            else:
-                self.node_wrapper.setBottomLeft(new_point)
-                self.node_wrapper.normalize()  # We've moved all corners, normalize the backdrop
-
-        def _snap_to_grid(self, new_point, grid_size):
-            old = QtGui.QVector2D(self.original_point)
-            new = QtGui.QVector2D(new_point)
-            offset = (new - old) / grid_size
-            return (old + QtGui.QVector2D(offset.toPoint()) * grid_size).toPoint()
+                # Snap the distance travelled rather than the position, so nodes keep their offset to the grid
+                step_x, step_y = grid_size.x(), grid_size.y()
+                xs = [o + round((x - o) / step_x) * step_x for x, o in zip(xs, self.origin_xs)]
+                ys = [o + round((y - o) / step_y) * step_y for y, o in zip(ys, self.origin_ys)]
+            self.xs, self.ys = xs, ys
+
+        def commit(self):
+            """ Apply the current points positions to the nodes which have moved since the last commit """
+            i = 0
+            while i < len(self.xs):
+                step = 1 if self.corners[i] is None else 4  # Backdrops have their 4 corners in a row
+                if self.xs[i:i + step] != self.committed_xs[i:i + step] or \
+                        self.ys[i:i + step] != self.committed_ys[i:i + step]:
+                    rect = self._rect_at(i)
+                    wrapper = self.wrappers[self.owners[i]]
+                    if step == 1:
+                        wrapper.moveCenter(rect.center())
+                    else:
+                        wrapper.setCoords(*rect.getCoords())
+                i += step
+            self.committed_xs = list(self.xs)
+            self.committed_ys = list(self.ys)
+
+        def _rect_at(self, i):
+            """ Rectangle of the node owning the point at index i, at the current points positions """
+            if self.corners[i] is None:
+                rect = QtCore.QRectF(self.wrappers[self.owners[i]].bounds)
+                rect.moveCenter(QtCore.QPointF(self.xs[i], self.ys[i]))
+                return rect
+            xs = self.xs[i:i + 4]
+            ys = self.ys[i:i + 4]
+            return QtCore.QRectF(QtCore.QPointF(min(xs), min(ys)), QtCore.QPointF(max(xs), max(ys)))
+
+        def ghost_rects(self):
+            """ Rectangles of all the nodes at the current points positions, to preview a scale before committing it """
+            rects = []
+            i = 0
+            while i < len(self.xs):
+                rects.append(self._rect_at(i))
+                i += 1 if self.corners[i] is None else 4
+            return rects
 
     handles_cursors = (QtCore.Qt.SizeFDiagCursor,
                        QtCore.Qt.SizeVerCursor,
                        QtCore.Qt.SizeBDiagCursor,
                        QtCore.Qt.SizeHorCursor)
+    handle_size = 16  # In pixels
 
     def __init__(self, dag_widget):
-        super(ScaleWidget, self).__init__(parent=dag_widget)
-
-        # Group context
-        self.dag_node = get_dag_node(self.parent())  # 'dag_widget', but it's garbage collected..
-
-        # Make Widget transparent
-        self.setWindowFlags(QtCore.Qt.Window | QtCore.Qt.FramelessWindowHint)
-        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
-        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
-        self.setFocusPolicy(QtCore.Qt.NoFocus)
+        super(ScaleWidget, self).__init__(dag_widget)
 
         # Enable mouse tracking so we can get move move events
         self.setMouseTracking(True)
 
-        # Overlay it with the DAG exactly
-        dag_rect = dag_widget.geometry()
-        dag_rect.moveTopLeft(dag_widget.parentWidget().mapToGlobal(dag_rect.topLeft()))
-        self.setGeometry(dag_rect)
-
         # Attributes
-        self.transform = None
         self.grabbed_handle = None
         with self.dag_node:
             self.nodes = nuke.selectedNodes()
-        self.bounds = get_nodes_bounds(self.nodes, center_only=True)
-        visual_bounds = get_nodes_bounds(self.nodes) + (QtCore.QMargins() + 10)
-        adjustment = calculate_bounds_adjustment(self.bounds, visual_bounds)
-        self.margins = QtCore.QMargins(adjustment[0] * -1, adjustment[1] * -1, adjustment[2], adjustment[3])
-        self.coordinates = self.store_coordinates()
+        self.bounds = None
+        self.margins = None
+        # Only the selection is captured on open, other nodes are only needed when affecting all nodes (ctrl+drag)
+        self.selected_points = self.store_selected_coordinates()
+        self.other_points = None
         self.undo = None
 
         self.translate_mode = False
         self.move_all = False
+        # In preview mode, the nodes are drawn as ghosts while dragging, and only moved on release
+        self.preview_mode = False
+        self.ghost_rects = []
         prefs = nuke.toNode('preferences')
 
         self.snap_to_grid = prefs['SnapToGrid'].value()
         self.grid_size = QtGui.QVector2D(max(prefs['GridWidth'].value(), 1),
                                          max(prefs['GridHeight'].value(), 1))
 
-    def store_coordinates(self):
-        """ Get the coordinates of all nodes and store them in a VectorWrapper """
-        all_coords = []
+        # Mouse moves are coalesced, and the drag is only processed once per display frame
+        self.pending_pos = None
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(self.frame_interval())
+        self.frame_timer.timeout.connect(self.process_pending_drag)
+
+    @staticmethod
+    def frame_interval():
+        """ Duration of a display frame, in milliseconds """
+        screen = QtGui.QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen else 0
+        return int(1000 / refresh_rate) if refresh_rate > 0 else 16
+
+    def store_selected_coordinates(self):
+        """ Capture the coordinates of the selected nodes, and fit the bounds around them """
+        wrappers = [NodeWrapper(node) for node in self.nodes]
+        self.bounds = get_nodes_bounds(wrappers, center_only=True)
+        visual_bounds = get_nodes_bounds(wrappers) + (QtCore.QMargins() + 10)
+        adjustment = calculate_bounds_adjustment(self.bounds, visual_bounds)
+        self.margins = QtCore.QMargins(adjustment[0] * -1, adjustment[1] * -1, adjustment[2], adjustment[3])
+        return self._PointArrays(wrappers, self.bounds)
+
+    def store_other_coordinates(self):
+        """ Capture the coordinates of all the nodes which are not selected """
+        selected = set(node_id(node) for node in self.nodes)
         with self.dag_node:
-            for node in nuke.allNodes():
-                node_wrapper = NodeWrapper(node)
-                if node_wrapper.is_backdrop:
-                    all_coords += [self._VectorWrapper(node_wrapper, self.bounds, corner) for corner in range(4)]
-                else:
-                    all_coords.append(self._VectorWrapper(node_wrapper, self.bounds))
-        return all_coords
+            wrappers = [NodeWrapper(node) for node in nuke.allNodes() if node_id(node) not in selected]
+        return self._PointArrays(wrappers, self.bounds)
+
+    def active_points(self, all_nodes=False):
+        """ Return the point arrays affected by a drag """
+        if all_nodes:
+            return [self.selected_points, self.other_points]
+        return [self.selected_points]
 
     def reset_state(self):
-        """ Re-grab the coordinates of all the nodes """
+        """ Store the coordinates of the nodes relative to the new bounds """
+        # Process the last mouse position, and apply a previewed drag
+        self.frame_timer.stop()
+        self.process_pending_drag()
+        if self.grabbed_handle is not None and self.preview_mode:
+            for points in self.active_points(self.move_all):
+                points.commit()
+            self.set_ghost_rects([])
         self.grabbed_handle = None
-        self.coordinates = self.store_coordinates()
-
-    def paintEvent(self, event):
-        """ Draw The widget """
-        painter = QtGui.QPainter(self)
-        painter.save()
-
+        # Read the positions back from nuke, as they may have been changed by an undo or other edits since the drag.
+        # Other nodes are captured again on the next drag affecting them.
+        self.mark_dirty(self.bounds_widget_rect())
+        self.selected_points = self.store_selected_coordinates()
+        self.other_points = None
+        self.mark_dirty(self.bounds_widget_rect())
+
+    def paint_overlay(self, painter, rect):
         # Calculate the proper place to draw the stuff
-        local_rect = self.geometry()
-        local_rect.moveTopLeft(QtCore.QPoint(0, 0))
-        with self.dag_node:
-            scale = nuke.zoom()
-            offset = local_rect.center()/scale - QtCore.QPoint(*nuke.center())
-        painter.scale(scale, scale)
-        painter.translate(offset)
-        self.transform = painter.combinedTransform()
+        painter.save()
+        painter.setTransform(self.transform)
 
         # Draw the bounds rectangle
         black_pen = QtGui.QPen()
@@ -160,26 +223,58 @@ class ScaleWidget(QtWidgets.QWidget):
         yellow_brush.setColor(QtGui.QColor('yellow'))
         yellow_brush.setStyle(QtCore.Qt.SolidPattern)
 
-        handle_size = int(16/scale)
+        handle_size = int(self.handle_size / self.scale)
         handle = QtCore.QRectF(0, 0, handle_size, handle_size)
         painter.setBrush(yellow_brush)
         for point in self.get_handles_points():
             handle.moveCenter(point)
             painter.drawRect(handle)
 
+        # Draw the previewed nodes positions
+        if self.ghost_rects:
+            ghost_pen = QtGui.QPen(QtGui.QColor('white'))
+            ghost_pen.setStyle(QtCore.Qt.DashLine)
+            ghost_pen.setCosmetic(True)
+            painter.setPen(ghost_pen)
+            painter.setBrush(QtCore.Qt.NoBrush)
+            painter.drawRects(self.ghost_rects)
+
         # Add a text hint for usage
         painter.restore()
-        local_rect.setTop(local_rect.bottom() - 70)
         text = 'Resize Mode enabled'
         if self.snap_to_grid:
             text += ' (Snap to Grid: ON)'
+        if self.preview_mode:
+            text += ' (Preview: ON)'
         text += "\nDrag any handle to affect the spacing between your nodes."
-        text += "\nCtrl+Drag: affect all nodes, Shift+Drag: Translate, 'S': Toggle Snap to grid, 'Esc': Cancel, "
-        text += "Any other key: Confirm and close"
+        text += "\nCtrl+Drag: affect all nodes, Shift+Drag: Translate, 'S': Toggle Snap to grid, 'P': Toggle Preview, "
+        text += "'Esc': Cancel, Any other key: Confirm and close"
         painter.setPen(black_pen)
-        painter.drawText(local_rect,  QtCore.Qt.AlignCenter, text)
+        painter.drawText(self.text_rect(),  QtCore.Qt.AlignCenter, text)
         painter.setPen(QtGui.QPen(QtGui.QColor('white')))
-        painter.drawText(local_rect.translated(1, -1), QtCore.Qt.AlignCenter, text)
+        painter.drawText(self.text_rect().translated(1, -1), QtCore.Qt.AlignCenter, text)
+
+    def text_rect(self):
+        """ Area of the widget in which the usage hint is drawn """
+        local_rect = self.rect()
+        local_rect.setTop(local_rect.bottom() - 70)
+        return local_rect
+
+    def bounds_widget_rect(self):
+        """ Area of the widget covered by the bounding box controller and its handles """
+        rect = self.transform.mapRect(self.bounds.marginsAdded(self.margins)).toAlignedRect()
+        margin = self.handle_size // 2 + 2
+        return rect.adjusted(-margin, -margin, margin, margin)
+
+    def set_ghost_rects(self, rects):
+        """ Replace the previewed nodes rectangles, and repaint the area covered by the old and new ones """
+        for ghost_rects in (self.ghost_rects, rects):
+            if ghost_rects:
+                area = QtCore.QRectF(ghost_rects[0])
+                for rect in ghost_rects[1:]:
+                    area |= rect
+                self.mark_dirty(self.transform.mapRect(area))
+        self.ghost_rects = rects
 
     def get_handles_points(self):
         """ Return a list of 8 QPoints representing the 8 handles we want to draw """
@@ -213,8 +308,7 @@ class ScaleWidget(QtWidgets.QWidget):
             return
         # As the user interacts with the visual bounds rather than the computed ones, we need to take this into account
         bounds = self.bounds.marginsAdded(self.margins)
-        invert_matrix, _invert_success = self.transform.inverted()
-        pos = invert_matrix.map(pos)
+        pos = self.map_to_dag(pos)
         attr_prefix = 'move' if self.translate_mode else 'set'
         if handle == 0:
             getattr(bounds, '{}TopLeft'.format(attr_prefix))(pos)
@@ -232,8 +326,10 @@ class ScaleWidget(QtWidgets.QWidget):
             getattr(bounds, '{}BottomLeft'.format(attr_prefix))(pos)
         elif handle == 7:
             getattr(bounds, '{}Left'.format(attr_prefix))(pos.x())
+        # Only repaint the area covered by the controller before and after the change
+        self.mark_dirty(self.bounds_widget_rect())
         self.bounds = bounds.marginsRemoved(self.margins)
-        self.repaint()
+        self.mark_dirty(self.bounds_widget_rect())
 
     def scale_nodes(self, handle, pos, all_nodes=False):
         """ Moves either the selected nodes or all the nodes to their relative space to the bounding box controller """
@@ -243,15 +339,23 @@ class ScaleWidget(QtWidgets.QWidget):
             self.undo.begin('Scale Nodes')
 
         self.resize_bounds(handle, pos)
-        new_size = QtGui.QVector2D(self.bounds.size().width(), self.bounds.size().height())
-        new_top_left = QtGui.QVector2D(self.bounds.topLeft())
+        grid_size = self.grid_size if self.snap_to_grid else None
+        ghost_rects = []
+        for points in self.active_points(all_nodes):
+            points.move_to(self.bounds, grid_size)
+            if self.preview_mode:
+                ghost_rects += points.ghost_rects()
+            else:
+                points.commit()
+        if self.preview_mode:
+            self.set_ghost_rects(ghost_rects)
 
-        for coord in self.coordinates:
-            if not all_nodes and coord.node_wrapper.node not in self.nodes:
-                continue
-            new_relative_pos = coord.vector * new_size
-            new_pos = new_top_left + new_relative_pos + coord.offset
-            coord.move(new_pos.toPoint(), self.grid_size if self.snap_to_grid else None)
+    def process_pending_drag(self):
+        """ Scale the nodes to the last mouse position received, if not processed yet """
+        if self.pending_pos is None or self.grabbed_handle is None:
+            return
+        pos, self.pending_pos = self.pending_pos, None
+        self.scale_nodes(self.grabbed_handle, pos, all_nodes=self.move_all)
 
     def mouseMoveEvent(self, event):
         """ Check which handle is nearest the mouse and set the appropriate cursor """
@@ -274,6 +378,8 @@ class ScaleWidget(QtWidgets.QWidget):
                     # Clicked on one of the opaque areas of the widget
                     self.grabbed_handle = self.get_handle_at_pos(event.pos())
                     self.move_all = bool(QtWidgets.QApplication.keyboardModifiers() & QtCore.Qt.ControlModifier)
+                    if self.move_all and self.other_points is None:
+                        self.other_points = self.store_other_coordinates()
                     self.translate_mode = bool(QtWidgets.QApplication.keyboardModifiers() & QtCore.Qt.ShiftModifier)
                     return True
 
@@ -295,12 +401,14 @@ class ScaleWidget(QtWidgets.QWidget):
         elif event.type() in [QtCore.QEvent.MouseMove]:
             # Mouse moved, if we had a handle grabbed, resize nodes.
             if self.grabbed_handle is not None:
-                self.scale_nodes(self.grabbed_handle, event.pos(), all_nodes=self.move_all)
+                self.pending_pos = event.pos()
+                if not self.frame_timer.isActive():
+                    self.frame_timer.start()
                 return True
 
-            # Otherwise, if a button is pressed, we might be moving the dag, so repaint.
+            # Otherwise, if a button is pressed, we might be moving the dag.
             if event.buttons():
-                self.repaint()
+                self.viewport.invalidate()
 
         elif event.type() == QtCore.QEvent.KeyPress:
             if event.key() == QtCore.Qt.Key_Escape:
@@ -308,7 +416,12 @@ class ScaleWidget(QtWidgets.QWidget):
             elif event.key() == QtCore.Qt.Key_S:
                 # toggle snap to grid
                 self.snap_to_grid = not self.snap_to_grid
-                self.repaint()
+                self.mark_dirty(self.text_rect())
+            elif event.key() == QtCore.Qt.Key_P:
+                # toggle preview, not while dragging as the nodes would be left half moved.
+                if self.grabbed_handle is None:
+                    self.preview_mode = not self.preview_mode
+                    self.mark_dirty(self.text_rect())
             # close and accept on any non modifier key
             elif event.key() not in [QtCore.Qt.Key_Control, QtCore.Qt.Key_Alt, QtCore.Qt.Key_Shift]:
                 self.close()
@@ -316,19 +429,7 @@ class ScaleWidget(QtWidgets.QWidget):
             return True
 
         elif event.type() == QtCore.QEvent.Wheel:
-            # Due to a QT bug, out transparent widget is swallowing wheel events, pass them back to DAG
-            # See https://bugreports.qt.io/browse/QTBUG-53418
-            if widget is self:
-                dag = get_dag_widgets()[0]
-                gl_widget = dag.findChild(DagWidgetClass)
-                if gl_widget:
-                    QtWidgets.QApplication.sendEvent(gl_widget, event)
-                    self.repaint()
-                    return True
-            # In Nuke 16+, PySide6 is used, so the bug above is fixed.
-            # We still need to first let it handle the event then repaint.
-            elif widget.objectName() == 'DAG':
-                QtCore.QTimer.singleShot(0, self.repaint)
+            return self.forward_wheel_event(widget, event)
 
         return False
 
@@ -338,10 +439,12 @@ class ScaleWidget(QtWidgets.QWidget):
             return
         # self.dag_node.begin()
         super(ScaleWidget, self).show()
-        # Install Event filter
-        QtWidgets.QApplication.instance().installEventFilter(self)
 
     def cancel(self):
+        # Drop any drag in progress, it must not be applied when closing
+        self.frame_timer.stop()
+        self.pending_pos = None
+        self.grabbed_handle = None
         if self.undo:
             self.undo.cancel()
             self.undo = None
@@ -353,8 +456,10 @@ class ScaleWidget(QtWidgets.QWidget):
     #     # self.original_context.begin()
 
     def close(self):
+        if self.grabbed_handle is not None:
+            # Closed while dragging, apply the drag
+            self.reset_state()
         if self.undo:
             self.undo.end()
         # self.restore_context()
-        QtWidgets.QApplication.instance().removeEventFilter(self)
         super(ScaleWidget, self).close()
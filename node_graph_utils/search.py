@@ -0,0 +1,307 @@
+"""
+Find nodes by name, class, label, backdrop label or colour, and summon them.
+
+The nodes of the script are read once, on the first search, into a `search_index.SearchIndex`. After that, nuke
+callbacks only record which nodes were created, deleted or changed, and these nodes are re-read right before the next
+search. Typing in the search popup never walks the whole script.
+"""
+import nuke
+from Qt import QtCore, QtGui, QtWidgets
+
+from .dag import get_current_dag, get_dag_node, get_node_bounds, node_id, summon_nodes
+from .membership import BackdropMembership
+from .search_index import SearchIndex
+from .snapshot import GraphSnapshot, SnapshotNode
+
+# Knobs whose changes affect what a node is indexed with, or what the nodes around it are indexed with
+INDEXED_KNOBS = frozenset(['name', 'label', 'tile_color', 'xpos', 'ypos', 'bdwidth', 'bdheight'])
+
+
+def _group_name(key):
+    """ Full name of the group a node is in, from the node id """
+    return key.rpartition('.')[0] or 'root'
+
+
+def _to_node(key):
+    """ Node from its id, from any group context. None if the node doesn't exist anymore """
+    node = nuke.toNode('root.' + key)
+    if node is None or node_id(node) != key:
+        return None
+    return node
+
+
+class NodeSearch(object):
+    """ Search index of all the nodes of the script, kept up to date with callbacks. Use `get_search` """
+
+    def __init__(self):
+        self.index = SearchIndex()
+        self._built = False
+        self._dirty = set()  # Ids of the nodes to read again before the next search
+        self._memberships = {}  # Backdrops around the nodes, by group name
+        self._backdrop_labels = {}  # Label of each backdrop, by backdrop id
+        self._callbacks_installed = False
+        self._watched_classes = set()  # Node classes the knobChanged callback is registered for
+
+    def install_callbacks(self):
+        """ Keep the index up to date with the script """
+        if self._callbacks_installed:
+            return
+        nuke.addOnCreate(self._node_changed_callback)
+        nuke.addOnDestroy(self._node_changed_callback)
+        nuke.addOnScriptLoad(self.invalidate)
+        nuke.addOnScriptClose(self.invalidate)
+        self._callbacks_installed = True
+
+    def remove_callbacks(self):
+        if not self._callbacks_installed:
+            return
+        nuke.removeOnCreate(self._node_changed_callback)
+        nuke.removeOnDestroy(self._node_changed_callback)
+        nuke.removeOnScriptLoad(self.invalidate)
+        nuke.removeOnScriptClose(self.invalidate)
+        self._unwatch_knobs()
+        self._callbacks_installed = False
+
+    def _watch_knobs(self, node_class):
+        """
+        Register the knobChanged callback for the nodes of a class.
+
+        Knob changes are only watched for the classes of the indexed nodes, so changes to other nodes, like the frame
+        of the root during playback, don't run python at all.
+        """
+        if node_class not in self._watched_classes:
+            nuke.addKnobChanged(self._knob_changed_callback, nodeClass=node_class)
+            self._watched_classes.add(node_class)
+
+    def _unwatch_knobs(self):
+        for node_class in self._watched_classes:
+            nuke.removeKnobChanged(self._knob_changed_callback, nodeClass=node_class)
+        self._watched_classes = set()
+
+    def invalidate(self):
+        """ Forget everything, the index is built again on the next search """
+        self.index.clear()
+        self._built = False
+        self._dirty = set()
+        self._memberships = {}
+        self._backdrop_labels = {}
+
+    def _node_changed_callback(self):
+        # Callbacks run for every node created while loading or pasting, they only take note of the node.
+        if self._built:
+            node = nuke.thisNode()
+            self._dirty.add(node_id(node))
+            self._watch_knobs(node.Class())
+
+    def _knob_changed_callback(self):
+        if not self._built or nuke.thisKnob().name() not in INDEXED_KNOBS:
+            return
+        node = nuke.thisNode()
+        if nuke.thisKnob().name() == 'name' and isinstance(node, nuke.Group):
+            # The id of every node inside the group changed
+            self.invalidate()
+            return
+        self._dirty.add(node_id(node))
+
+    def _read_node(self, key, node):
+        """
+        Read what a node is indexed with
+
+        Returns:
+            tuple[SnapshotNode, dict]: The node rectangle, and its fields except for the labels of the backdrops
+                around it
+        """
+        bounds = get_node_bounds(node)
+        knobs = node.knobs()
+        label = knobs['label'].value() if 'label' in knobs else ''
+        color = int(knobs['tile_color'].value()) if 'tile_color' in knobs else 0
+        fields = {'name': node.name(), 'class': node.Class(), 'label': label,
+                  # tile_color 0 is the default colour of the class, which nuke doesn't expose
+                  'color': '{:08x}'.format(color & 0xffffffff) if color else ''}
+        z_order = {}
+        if node.Class() == 'BackdropNode':
+            self._backdrop_labels[key] = label
+            z_order['z_order'] = int(knobs['z_order'].value())
+        snapshot_node = SnapshotNode(key, node.Class(), int(bounds.x()), int(bounds.y()), int(bounds.width()),
+                                     int(bounds.height()), knobs=z_order)
+        return snapshot_node, fields
+
+    def _backdrops_label(self, key):
+        """ Labels of the backdrops around a node, the innermost first """
+        membership = self._memberships.get(_group_name(key))
+        if membership is None:
+            return ''
+        return ' '.join(self._backdrop_labels[backdrop] for backdrop in membership.backdrops_around(key))
+
+    def build(self):
+        """ Index all the nodes of the script """
+        self.invalidate()
+        self.install_callbacks()
+        with nuke.root():
+            nodes = nuke.allNodes(recurseGroups=True)
+        graphs = {}
+        fields = {}
+        for node in nodes:
+            key = node_id(node)
+            snapshot_node, fields[key] = self._read_node(key, node)
+            self._watch_knobs(snapshot_node.node_class)
+            graphs.setdefault(_group_name(key), GraphSnapshot()).add(snapshot_node)
+        for group, graph in graphs.items():
+            self._memberships[group] = BackdropMembership.from_snapshot(graph)
+        for key, node_fields in fields.items():
+            node_fields['backdrop'] = self._backdrops_label(key)
+            self.index.update(key, node_fields)
+        self._built = True
+
+    def _forget(self, key):
+        """ Remove a node from the index """
+        self.index.remove(key)
+        self._backdrop_labels.pop(key, None)
+        membership = self._memberships.get(_group_name(key))
+        return membership.remove(key) if membership is not None else set()
+
+    def flush(self):
+        """ Read the nodes which changed since the last search again """
+        if not self._built:
+            self.build()
+            return
+        while self._dirty:
+            keys, self._dirty = self._dirty, set()
+            for key in keys:
+                old_label = self._backdrop_labels.get(key)
+                node = _to_node(key)
+                if node is None:
+                    # The backdrop label of the nodes it contained changed
+                    self._dirty.update(self._forget(key))
+                    continue
+                self.index.remove(key)
+                snapshot_node, fields = self._read_node(key, node)
+                membership = self._memberships.setdefault(_group_name(key), BackdropMembership())
+                changed = membership.update(key, snapshot_node.rect, snapshot_node.knobs.get('z_order'))
+                if old_label != self._backdrop_labels.get(key):
+                    changed.update(membership.contents(key))
+                fields['backdrop'] = self._backdrops_label(key)
+                self.index.update(key, fields)
+                changed.discard(key)
+                self._dirty.update(changed)
+
+    def search(self, query, group=None, limit=50):
+        """
+        Find nodes
+
+        Args:
+            query (str): Words to search for, in the name, class, label, backdrop label or tile_color (hex) of nodes
+            group (nuke.Node): Only search in this group, defaults to all the groups
+            limit (int or None): Maximum number of nodes to return
+
+        Returns:
+            list[nuke.Node]: Best matches first
+        """
+        self.flush()
+        accept = None
+        if group is not None:
+            group_name = node_id(group)
+            accept = lambda key: _group_name(key) == group_name  # noqa: E731
+        nodes = []
+        for key in self.index.search(query, limit=None, accept=accept):
+            node = _to_node(key)
+            if node is None:
+                # Renamed, the new name was indexed when the node changed
+                self._forget(key)
+                continue
+            nodes.append(node)
+            if limit and len(nodes) >= limit:
+                break
+        return nodes
+
+
+_search = None
+
+
+def get_search():
+    """ The search index of the script, created on first use """
+    global _search
+    if _search is None:
+        _search = NodeSearch()
+    return _search
+
+
+class SearchPopup(QtWidgets.QDialog):
+    """ Type to find nodes in the current DAG, Enter to summon the selected ones """
+
+    max_results = 50
+
+    def __init__(self):
+        super(SearchPopup, self).__init__()
+        self.group = None
+
+        self.line_edit = QtWidgets.QLineEdit()
+        self.line_edit.setPlaceholderText('Name, class, label, backdrop or colour')
+        self.results = QtWidgets.QListWidget()
+        self.results.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        help_label = QtWidgets.QLabel('<span style=" font-size:7pt; color:green;">'
+                                      'Enter to summon, Shift+Up/Down to select more'
+                                      '</span>')
+        help_label.setAlignment(QtCore.Qt.AlignRight)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.line_edit)
+        layout.addWidget(self.results)
+        layout.addWidget(help_label)
+        self.setLayout(layout)
+        self.resize(300, 300)
+        self.setWindowTitle('Find and Summon Nodes')
+        self.setWindowFlags(QtCore.Qt.FramelessWindowHint | QtCore.Qt.WindowStaysOnTopHint | QtCore.Qt.Popup)
+
+        self.line_edit.textChanged.connect(self.refresh)
+        self.results.itemDoubleClicked.connect(self.summon)
+        self.line_edit.installEventFilter(self)
+
+    def eventFilter(self, widget, event):
+        if isinstance(event, QtGui.QKeyEvent) and event.type() == QtCore.QEvent.KeyPress:
+            if event.key() in [QtCore.Qt.Key_Return, QtCore.Qt.Key_Enter]:
+                self.summon()
+                return True
+            if event.key() in [QtCore.Qt.Key_Up, QtCore.Qt.Key_Down]:
+                # Browse the results without leaving the line edit
+                QtWidgets.QApplication.sendEvent(self.results, event)
+                return True
+        return False
+
+    def refresh(self):
+        self.results.clear()
+        for node in get_search().search(self.line_edit.text(), self.group, self.max_results):
+            label = node['label'].value().strip() if 'label' in node.knobs() else ''
+            text = '{} ({})'.format(node.name(), node.Class())
+            if label:
+                text += ' - ' + label.splitlines()[0]
+            item = QtWidgets.QListWidgetItem(text)
+            item.setData(QtCore.Qt.UserRole, node_id(node))
+            self.results.addItem(item)
+        if self.results.count():
+            self.results.setCurrentRow(0)
+
+    def summon(self):
+        items = self.results.selectedItems()
+        if not items and self.results.count():
+            items = [self.results.item(0)]
+        nodes = [_to_node(item.data(QtCore.Qt.UserRole)) for item in items]
+        self.close()
+        nodes = [node for node in nodes if node is not None]
+        if nodes:
+            with self.group:
+                summon_nodes(nodes)
+
+    def run(self):
+        active_dag = get_current_dag()
+        self.group = get_dag_node(active_dag) if active_dag else nuke.root()
+        cursor = QtGui.QCursor.pos()
+        avail_space = QtWidgets.QApplication.instance().screenAt(cursor).availableGeometry()
+        posx = min(max(cursor.x() - 150, avail_space.left()), avail_space.right() - 300)
+        posy = min(max(cursor.y() - 12, avail_space.top()), avail_space.bottom() - 300)
+        self.move(QtCore.QPoint(posx, posy))
+        self.line_edit.clear()
+        self.results.clear()
+        self.raise_()
+        self.show()
+        self.line_edit.setFocus()
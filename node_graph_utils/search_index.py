@@ -0,0 +1,175 @@
+"""
+Inverted index to search nodes by text.
+
+Nodes are indexed by the words of a few text fields (name, class, label...). Query words match indexed words by
+prefix, or fuzzily when typed with letters missing (`grd` finds `Grade`), and results are ranked by relevance.
+The index is updated one node at a time, so it can be kept in sync with a script without rebuilding it.
+
+This module does not depend on nuke or Qt.
+"""
+import bisect
+from collections import defaultdict
+import heapq
+import re
+
+_WORDS = re.compile(r'[^\W_]+', re.UNICODE)
+_TAGS = re.compile(r'<[^>]*>')
+
+# Score of a query word matching an indexed word
+EXACT_SCORE = 3
+PREFIX_SCORE = 2
+FUZZY_SCORE = 1
+# Added when the word is part of the node name
+NAME_BONUS = 1
+
+
+def tokenize(text):
+    """
+    Split a text into lower case words to index or search. HTML tags are ignored.
+    Text with separators (`Grade_Despill1`) is kept whole too, so it can be found as typed.
+
+    Args:
+        text (str):
+
+    Returns:
+        list[str]
+    """
+    text = _TAGS.sub(' ', text or '').lower()
+    words = _WORDS.findall(text)
+    for chunk in text.split():
+        if len(_WORDS.findall(chunk)) > 1:
+            words.append(chunk)
+    return words
+
+
+class SearchIndex(object):
+    """ Words of the text fields of nodes, to find the nodes from a few typed letters """
+
+    def __init__(self):
+        self._fields = {}  # Indexed fields of each node, by node id
+        self._words = {}  # Words of each node
+        self._postings = defaultdict(set)  # Node ids, by word
+        self._name_postings = defaultdict(set)  # Node ids, by word of their name, which ranks higher
+        self._sorted_words = []  # All the words, for prefix lookups
+        self._fuzzy_text = None  # All the words, one per line, for fuzzy lookups. Built on demand.
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def fields(self, key):
+        """ The fields a node was indexed with """
+        return self._fields[key]
+
+    def update(self, key, fields):
+        """
+        Index a node, replacing what was indexed for it before
+
+        Args:
+            key (str): Node id
+            fields (dict[str, str]): Text to index, by field name. The 'name' field ranks higher.
+        """
+        self.remove(key)
+        words = set()
+        for text in fields.values():
+            words.update(tokenize(text))
+        self._fields[key] = dict(fields)
+        self._words[key] = words
+        for word in words:
+            postings = self._postings[word]
+            if not postings:
+                bisect.insort(self._sorted_words, word)
+                self._fuzzy_text = None
+            postings.add(key)
+        for word in tokenize(fields.get('name')):
+            self._name_postings[word].add(key)
+
+    def remove(self, key):
+        """ Remove a node from the index, if it was indexed """
+        if key not in self._fields:
+            return
+        del self._fields[key]
+        for word in self._words.pop(key):
+            postings = self._postings[word]
+            postings.discard(key)
+            if key in self._name_postings.get(word, ()):
+                self._name_postings[word].discard(key)
+                if not self._name_postings[word]:
+                    del self._name_postings[word]
+            if not postings:
+                del self._postings[word]
+                del self._sorted_words[bisect.bisect_left(self._sorted_words, word)]
+                self._fuzzy_text = None
+
+    def clear(self):
+        self.__init__()
+
+    def prefix_words(self, prefix):
+        """ Indexed words starting with a prefix """
+        words = []
+        for index in range(bisect.bisect_left(self._sorted_words, prefix), len(self._sorted_words)):
+            word = self._sorted_words[index]
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words
+
+    def fuzzy_words(self, letters):
+        """ Indexed words containing the letters in the same order, with anything in between """
+        if self._fuzzy_text is None:
+            self._fuzzy_text = '\n'.join(self._sorted_words)
+        pattern = '^[^\n]*?' + '[^\n]*?'.join(re.escape(letter) for letter in letters) + '[^\n]*$'
+        return re.findall(pattern, self._fuzzy_text, re.MULTILINE)
+
+    def _word_scores(self, query_word):
+        """ Best score of each node for a query word """
+        scores = {}
+        for word in self.fuzzy_words(query_word):
+            for key in self._postings[word]:
+                scores[key] = FUZZY_SCORE
+        for word in self.prefix_words(query_word):
+            score = EXACT_SCORE if word == query_word else PREFIX_SCORE
+            name_postings = self._name_postings.get(word, ())
+            for key in self._postings[word]:
+                key_score = score + NAME_BONUS if key in name_postings else score
+                if scores.get(key, 0) < key_score:
+                    scores[key] = key_score
+        return scores
+
+    def search(self, query, limit=50, accept=None):
+        """
+        Find the nodes matching all the words of a query, best matches first.
+
+        Args:
+            query (str): Words to search for
+            limit (int or None): Maximum number of results
+            accept (callable): Only return the nodes for which this returns True, called with the node id
+
+        Returns:
+            list[str]: Node ids
+        """
+        query_words = tokenize(query)
+        if not query_words:
+            return []
+        scores = None
+        for query_word in sorted(set(query_words), key=len, reverse=True):
+            word_scores = self._word_scores(query_word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict((key, score + word_scores[key]) for key, score in scores.items() if key in word_scores)
+            if not scores:
+                return []
+        if accept is not None:
+            scores = dict((key, score) for key, score in scores.items() if accept(key))
+
+        def rank(key):
+            # Short names match the query more closely
+            name = self._fields[key].get('name') or ''
+            return -scores[key], len(name), name
+
+        if limit:
+            return heapq.nsmallest(limit, scores, key=rank)
+        return sorted(scores, key=rank)
@@ -0,0 +1,178 @@
+"""
+Plain data copy of a node graph.
+
+Reading positions, sizes and connections from nuke is slow, so tools working on many nodes read everything once into
+a GraphSnapshot, work on the snapshot in pure python, and only write the result back to nuke at the end.
+
+This module does not depend on nuke or Qt, so snapshots can also be built from parsed .nk files by offline tools.
+Rectangles are plain (left, top, right, bottom) tuples, like in the `spatial` module.
+"""
+from collections import OrderedDict
+
+BACKDROP_CLASS = 'BackdropNode'
+
+# Size of nodes in the DAG when nuke can't tell us, for example for nodes read from a file
+NODE_SIZES = {
+    'Dot': (12, 12),
+    'Camera': (60, 60),
+    'Axis': (60, 60),
+}
+DEFAULT_NODE_SIZE = (80, 18)
+# GridWidth and GridHeight of nuke's default preferences
+DEFAULT_GRID_SIZE = (110, 24)
+
+
+def default_node_size(node_class):
+    """ Return the (width, height) a node of this class usually has in the DAG """
+    return NODE_SIZES.get(node_class, DEFAULT_NODE_SIZE)
+
+
+class SnapshotNode(object):
+    """ Position, size, connections and a few knob values of a node """
+
+    __slots__ = ('id', 'node_class', 'x', 'y', 'width', 'height', 'inputs', 'knobs')
+
+    def __init__(self, node_id, node_class, x, y, width, height, inputs=None, knobs=None):
+        """
+        Args:
+            node_id (str): Unique identifier of the node, its full name for nuke nodes
+            node_class (str): Node class
+            x (int): xpos
+            y (int): ypos
+            width (int): Width of the node in the DAG (bdwidth for backdrops)
+            height (int): Height of the node in the DAG (bdheight for backdrops)
+            inputs (list[str or None]): Ids of the input nodes, None for disconnected inputs
+            knobs (dict): Other knob values, by knob name
+        """
+        self.id = node_id
+        self.node_class = node_class
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.inputs = list(inputs or [])
+        self.knobs = dict(knobs or {})
+
+    def __repr__(self):
+        return '<SnapshotNode {} ({}) at {}, {}>'.format(self.id, self.node_class, self.x, self.y)
+
+    @property
+    def is_backdrop(self):
+        return self.node_class == BACKDROP_CLASS
+
+    @property
+    def rect(self):
+        return self.x, self.y, self.x + self.width, self.y + self.height
+
+    @property
+    def center(self):
+        return self.x + self.width / 2.0, self.y + self.height / 2.0
+
+
+class GraphSnapshot(object):
+    """ Nodes of a graph by id, in the order they were added """
+
+    def __init__(self, nodes=None):
+        """
+        Args:
+            nodes (list[SnapshotNode]): Nodes to start the snapshot with
+        """
+        self.nodes = OrderedDict()
+        for node in nodes or []:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.nodes
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def __getitem__(self, node_id):
+        return self.nodes[node_id]
+
+    def add(self, node):
+        self.nodes[node.id] = node
+        return node
+
+    @classmethod
+    def from_nodes(cls, nodes, knobs=('label', 'note_font_size', 'tile_color', 'z_order')):
+        """
+        Read nuke nodes into a snapshot
+
+        Args:
+            nodes (list[nuke.Node]): Nodes to read
+            knobs (tuple[str]): Names of other knobs to read, if the nodes have them
+
+        Returns:
+            GraphSnapshot
+        """
+        from .dag import get_node_bounds, node_id  # Only when working with nuke nodes, this module stays pure.
+
+        snapshot = cls()
+        for node in nodes:
+            bounds = get_node_bounds(node)
+            inputs = []
+            for i in range(node.inputs()):
+                input_node = node.input(i)
+                inputs.append(node_id(input_node) if input_node is not None else None)
+            knob_values = {}
+            all_knobs = node.knobs()
+            for name in knobs:
+                if name in all_knobs:
+                    knob_values[name] = all_knobs[name].value()
+            snapshot.add(SnapshotNode(node_id(node), node.Class(), int(bounds.x()), int(bounds.y()),
+                                      int(bounds.width()), int(bounds.height()), inputs, knob_values))
+        return snapshot
+
+    def to_rows(self):
+        """
+        Plain tuples describing the nodes, to send the snapshot to other processes or write it to disk
+
+        Returns:
+            list[tuple]: One (id, class, x, y, width, height, inputs, knobs) tuple per node
+        """
+        return [(node.id, node.node_class, node.x, node.y, node.width, node.height, list(node.inputs),
+                 dict(node.knobs)) for node in self.nodes.values()]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Make a snapshot from rows made with `to_rows` """
+        return cls(SnapshotNode(*row) for row in rows)
+
+    def backdrops(self):
+        return [node for node in self.nodes.values() if node.is_backdrop]
+
+    def outputs(self):
+        """
+        Returns:
+            dict[str, list[str]]: Ids of the nodes connected to each node, only for nodes in the snapshot
+        """
+        outputs = dict((key, []) for key in self.nodes)
+        for node in self.nodes.values():
+            for input_id in node.inputs:
+                if input_id in outputs:
+                    outputs[input_id].append(node.id)
+        return outputs
+
+    def backdrop_contents(self, backdrop):
+        """
+        Nodes fully inside a backdrop, like `nuke.BackdropNode.getNodes`, including other backdrops
+
+        Args:
+            backdrop (SnapshotNode): The backdrop
+
+        Returns:
+            list[SnapshotNode]
+        """
+        left, top, right, bottom = backdrop.rect
+        contents = []
+        for node in self.nodes.values():
+            if node is backdrop:
+                continue
+            node_left, node_top, node_right, node_bottom = node.rect
+            if left <= node_left and top <= node_top and node_right <= right and node_bottom <= bottom:
+                contents.append(node)
+        return contents
@@ -1,8 +1,8 @@
 import nuke
-from Qt import QtCore, QtGui, QtWidgets
+from Qt import QtCore, QtGui
 
-from .dag import (get_current_dag, get_node_bounds,
-                  get_dag_node, node_center)
+from .dag import get_current_dag, get_node_bounds, node_center
+from .overlay import StrokeOverlay
 
 
 class Connection(object):
@@ -21,164 +21,91 @@ class Connection(object):
         self.node.setInput(self.input, None)
 
 
-class SnippingWidget(QtWidgets.QWidget):
+class SnippingWidget(StrokeOverlay):
+    border_color = 'red'
 
     def __init__(self, dag_widget):
-        super(SnippingWidget, self).__init__(parent=dag_widget)
-
-        # Group context
-        self.dag_node = get_dag_node(self.parent())  # 'dag_widget', but it's garbage collected..
-
-        # Make Widget transparent
-        self.setWindowFlags(QtCore.Qt.Window | QtCore.Qt.FramelessWindowHint)
-        self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
-        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
-        self.setFocusPolicy(QtCore.Qt.NoFocus)
-
-        # Enable mouse tracking so we can get move move events
-        # self.setMouseTracking(True)
-
-        # Overlay it with the DAG exactly
-        dag_rect = dag_widget.geometry()
-        dag_rect.moveTopLeft(dag_widget.parentWidget().mapToGlobal(dag_rect.topLeft()))
-        self.setGeometry(dag_rect)
-
-        # Attributes
-        self.image = QtGui.QImage(dag_rect.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
-        self.nodes_image = QtGui.QImage(dag_rect.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
-        self.drawing = False
-        self.last_pos = None
-
-        local_rect = self.geometry()
-        local_rect.moveTopLeft(QtCore.QPoint(0, 0))
-        with self.dag_node:
-            scale = nuke.zoom()
-            offset = QtCore.QPoint(self.width()/2, self.height()/2) / scale - QtCore.QPoint(*nuke.center())
-        self.transform = QtGui.QTransform()
-        self.transform.scale(scale, scale)
-        self.transform.translate(offset.x(), offset.y())
-
+        super(SnippingWidget, self).__init__(dag_widget)
+
+        # Static layers: the nodes are used as a mask so cut lines are not drawn over them,
+        # and cut lines are drawn once, when cut, rather than on every paint.
+        self.nodes_mask = self.new_layer()
+        self.cut_layer = self.new_layer()
+        self.cut_pen = QtGui.QPen(QtGui.QColor(self.border_color))
+        self.cut_pen.setWidth(self.border_width)
+        self.cut_pen.setCosmetic(True)
+
+        # Nodes and connections are stored in DAG coordinates, so they stay valid when the view changes
+        self.node_rects = []
         self.connections = self.get_all_connections()
         self.cut_connections = []
+        self.draw_nodes_mask()
 
-    def paintEvent(self, event):
-        """ Draw The widget """
-        painter = QtGui.QPainter(self)
-        painter.setRenderHint(QtGui.QPainter.Antialiasing)
-
-        rect = event.rect()
-
-        # Draw the bounds rectangle
-        black_pen = QtGui.QPen()
-        black_pen.setColor(QtGui.QColor('red'))
-        black_pen.setWidth(3)
-        black_pen.setCosmetic(True)
-        painter.setPen(black_pen)
-
-        painter.drawRect(rect)
+    def paint_overlay(self, painter, rect):
+        painter.drawPixmap(rect, self.cut_layer, rect)
+        super(SnippingWidget, self).paint_overlay(painter, rect)
 
+    def on_viewport_changed(self):
+        self.draw_nodes_mask()
+        self.cut_layer = self.new_layer()
         for connection in self.cut_connections:
-            painter.drawLine(connection.line)
-
-        painter.setCompositionMode(painter.CompositionMode_DestinationOut)
-        painter.drawImage(rect, self.nodes_image, rect)
-
-        painter.setCompositionMode(painter.CompositionMode_SourceOver)
-        painter.drawImage(rect, self.image, rect)
+            self.draw_cut(connection)
+        super(SnippingWidget, self).on_viewport_changed()
 
     def get_all_connections(self):
-        """ Get all connections and draw the nodes"""
-        painter = QtGui.QPainter(self.nodes_image)
-        my_pen_color = QtGui.QColor('black')
-        painter.setBrush(
-            QtGui.QBrush(my_pen_color, QtCore.Qt.SolidPattern))
-
+        """ Get all connections and the nodes rectangles """
         all_connections = []
         for node in nuke.allNodes():
             if node.Class() in ['BackdropNode']:
                 continue
             dependencies = node.dependencies(nuke.INPUTS)
             rect = get_node_bounds(node)
-            painter.drawRect(self.transform.mapRect(rect))
+            self.node_rects.append(rect)
             for i in range(node.inputs()):
                 input_node = node.input(i)
                 if input_node and input_node in dependencies:
                     line = QtCore.QLineF(rect.center(),
                                          QtCore.QPoint(*node_center(input_node)))
-                    c = Connection(self.transform.map(line), node, i)
+                    c = Connection(line, node, i)
                     all_connections.append(c)
         return all_connections
 
-    def start_drawing(self, pos):
-        self.drawing = True
-        self.last_pos = pos
-
-    def stop_drawing(self):
-        self.drawing = False
-        self.last_pos = None
-
-    def draw_segment(self, pos):
-        painter = QtGui.QPainter(self.image)
-        painter.setRenderHint(QtGui.QPainter.Antialiasing)
-        my_pen_color = QtGui.QColor('white')
-        my_pen_width = 2
-        painter.setPen(QtGui.QPen(my_pen_color, my_pen_width, QtCore.Qt.SolidLine, QtCore.Qt.RoundCap, QtCore.Qt.RoundJoin))
-        line = QtCore.QLine(self.last_pos, pos)
-        painter.drawLine(line)
+    def draw_nodes_mask(self):
+        """ Draw the nodes into the mask layer, at their current position in the widget """
+        self.nodes_mask = self.new_layer()
+        painter = QtGui.QPainter(self.nodes_mask)
+        my_pen_color = QtGui.QColor('black')
+        painter.setBrush(
+            QtGui.QBrush(my_pen_color, QtCore.Qt.SolidPattern))
+        painter.setTransform(self.transform)
+        for rect in self.node_rects:
+            painter.drawRect(rect)
+        painter.end()
 
+    def stroke_segment(self, line):
+        line = QtCore.QLineF(self.map_to_dag(line.p1()), self.map_to_dag(line.p2()))
         about_to_cut = []
         for connection in self.connections:
             if connection.intersects(line):
                 about_to_cut.append(connection)
         for connection in about_to_cut:
             self.connections.remove(connection)
+            self.draw_cut(connection)
         self.cut_connections.extend(about_to_cut)
 
-        self.last_pos = pos
-        self.update()
-
-    def eventFilter(self, widget, event):
-        """ Filter all the events happening while the bounding box controller is shown """
-        if event.type() in [QtCore.QEvent.MouseButtonPress]:
-            if not self.geometry().contains(event.globalPos()):
-                # Clicked outside the widget
-                self.close()
-                return False
-
-            if event.button() == QtCore.Qt.LeftButton:
-                self.start_drawing(event.pos())
-                return True
-
-            # Any other click we bail
-            self.close()
-            return False
-
-        elif event.type() in [QtCore.QEvent.MouseButtonRelease]:
-            if event.button() == QtCore.Qt.LeftButton:
-                self.stop_drawing()
-                return True
-
-        elif event.type() in [QtCore.QEvent.MouseMove]:
-            if self.drawing:
-                self.draw_segment(event.pos())
-                return True
-
-        elif event.type() == QtCore.QEvent.KeyRelease:
-            if event.isAutoRepeat():
-                return True
-            self.close()
-            return True
-
-        elif event.type() == QtCore.QEvent.KeyPress:
-            if event.isAutoRepeat():
-                return True
-
-        return False  # Swallow everything
-
-    def show(self):
-        super(SnippingWidget, self).show()
-        # Install Event filter
-        QtWidgets.QApplication.instance().installEventFilter(self)
+    def draw_cut(self, connection):
+        """ Draw a cut connection into the cut layer, and punch the nodes out of it """
+        line = self.transform.map(connection.line)
+        dirty_rect = QtCore.QRectF(line.p1(), line.p2()).normalized().toAlignedRect()
+        dirty_rect.adjust(-self.border_width, -self.border_width, self.border_width, self.border_width)
+        painter = QtGui.QPainter(self.cut_layer)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.setPen(self.cut_pen)
+        painter.drawLine(line)
+        painter.setCompositionMode(painter.CompositionMode_DestinationOut)
+        painter.drawPixmap(dirty_rect, self.nodes_mask, dirty_rect)
+        painter.end()
+        self.mark_dirty(dirty_rect)
 
     def close(self):
         if self.cut_connections:
@@ -189,7 +116,6 @@ class SnippingWidget(QtWidgets.QWidget):
                     connection.cut()
             finally:
                 undo.end()
-        QtWidgets.QApplication.instance().removeEventFilter(self)
         super(SnippingWidget, self).close()
 
 
@@ -0,0 +1,350 @@
+"""
+Spatial acceleration structures for node graph geometry.
+
+This module is pure python and does not depend on nuke or Qt, so it can also be used by offline tools.
+Rectangles are plain (left, top, right, bottom) tuples, as returned by `QtCore.QRectF.getCoords()`.
+"""
+import bisect
+from collections import defaultdict
+import heapq
+import math
+
+
+def segment_intersects_rect(x1, y1, x2, y2, rect):
+    """
+    Clip a segment against a rectangle (Liang-Barsky).
+
+    Args:
+        x1 (float): Segment start x
+        y1 (float): Segment start y
+        x2 (float): Segment end x
+        y2 (float): Segment end y
+        rect (tuple[float, float, float, float]): left, top, right, bottom
+
+    Returns:
+        float or None: Parametric position (0 to 1) at which the segment enters the rectangle, None if it misses it.
+    """
+    left, top, right, bottom = rect
+    dx = x2 - x1
+    dy = y2 - y1
+    t_enter = 0.0
+    t_exit = 1.0
+    for p, q in ((-dx, x1 - left), (dx, right - x1), (-dy, y1 - top), (dy, bottom - y1)):
+        if p == 0:
+            if q < 0:
+                return None  # Parallel to this edge and outside of it
+            continue
+        t = float(q) / p
+        if p < 0:
+            if t > t_exit:
+                return None
+            t_enter = max(t_enter, t)
+        else:
+            if t < t_enter:
+                return None
+            t_exit = min(t_exit, t)
+    return t_enter
+
+
+def overlapping_pairs(rects, touching=False):
+    """
+    Find the pairs of overlapping rectangles with a sweep line, in O(n log n) for rectangles of similar heights.
+
+    The rectangles are swept left to right. The ones crossed by the sweep line are kept sorted by top, so each
+    rectangle is only tested against the crossed rectangles close enough vertically to overlap it. Rectangles are
+    bucketed by power of two height classes, each with its own sorted list, so a few tall rectangles only widen the
+    search in their own class.
+
+    Args:
+        rects (dict[object, tuple[float, float, float, float]]): (left, top, right, bottom) rectangles, by sortable key
+        touching (bool): Whether rectangles which only touch overlap. Needed for flat rectangles, like the bounding
+            boxes of horizontal or vertical segments. Otherwise flat rectangles never overlap anything.
+
+    Returns:
+        list[tuple]: Keys of the overlapping rectangles, the left most one first
+    """
+    if not touching:
+        rects = dict((key, rect) for key, rect in rects.items() if rect[0] < rect[2] and rect[1] < rect[3])
+    crossed = defaultdict(list)  # (top, key) of the rectangles crossed by the sweep line, sorted, by height class
+    max_heights = defaultdict(float)  # Tallest rectangle of each height class
+    ends = []  # (right, top, key, height class) heap of the crossed rectangles, to drop them once passed
+    pairs = []
+    for key, (left, top, right, bottom) in sorted(rects.items(), key=lambda item: (item[1][0], item[0])):
+        while ends and (ends[0][0] < left if touching else ends[0][0] <= left):
+            _right, other_top, other_key, other_class = heapq.heappop(ends)
+            class_crossed = crossed[other_class]
+            del class_crossed[bisect.bisect_left(class_crossed, (other_top, other_key))]
+        found = []
+        for height_class, class_crossed in crossed.items():
+            # Rectangles starting higher than this are too short to reach down to this one
+            for index in range(bisect.bisect_left(class_crossed, (top - max_heights[height_class],)),
+                               len(class_crossed)):
+                other_top, other_key = class_crossed[index]
+                if other_top > bottom or (other_top == bottom and not touching):
+                    break
+                other_bottom = rects[other_key][3]
+                if other_bottom > top or (other_bottom == top and touching):
+                    found.append((other_top, other_key))
+        found.sort()
+        pairs.extend((other_key, key) for _other_top, other_key in found)
+        height_class = math.frexp(bottom - top)[1]
+        bisect.insort(crossed[height_class], (top, key))
+        max_heights[height_class] = max(max_heights[height_class], bottom - top)
+        heapq.heappush(ends, (right, top, key, height_class))
+    return pairs
+
+
+class _CoveredIntervals(object):
+    """
+    Union of a changing set of intervals, over coordinates known in advance (segment tree with cover counts).
+
+    Adding or removing an interval costs O(log n), listing the union O((k + 1) log n) for k disjoint intervals.
+    """
+
+    def __init__(self, coordinates):
+        self._coordinates = sorted(set(coordinates))
+        size = 4 * max(len(self._coordinates) - 1, 1)
+        self._counts = [0] * size  # Intervals covering the whole range of a tree node, and not its parent
+        self._full = [False] * size
+        self._any = [False] * size
+
+    def add(self, start, end, delta=1):
+        """ Add an interval, or remove it with a delta of -1. Both ends must be in the coordinates """
+        first = bisect.bisect_left(self._coordinates, start)
+        last = bisect.bisect_left(self._coordinates, end)
+        if first < last:
+            self._update(1, 0, len(self._coordinates) - 1, first, last, delta)
+
+    def _update(self, index, low, high, first, last, delta):
+        if first <= low and high <= last:
+            self._counts[index] += delta
+        else:
+            middle = (low + high) // 2
+            if first < middle:
+                self._update(2 * index, low, middle, first, last, delta)
+            if middle < last:
+                self._update(2 * index + 1, middle, high, first, last, delta)
+        covered = self._counts[index] > 0
+        leaf = high - low == 1
+        self._full[index] = covered or (not leaf and self._full[2 * index] and self._full[2 * index + 1])
+        self._any[index] = covered or (not leaf and (self._any[2 * index] or self._any[2 * index + 1]))
+
+    def union(self):
+        """ Disjoint intervals covered by the intervals added, as sorted (start, end) pairs """
+        runs = []
+        if len(self._coordinates) > 1:
+            self._collect(1, 0, len(self._coordinates) - 1, runs)
+        return runs
+
+    def _collect(self, index, low, high, runs):
+        if not self._any[index]:
+            return
+        if self._full[index]:
+            start, end = self._coordinates[low], self._coordinates[high]
+            if runs and runs[-1][1] == start:
+                runs[-1] = (runs[-1][0], end)
+            else:
+                runs.append((start, end))
+            return
+        middle = (low + high) // 2
+        self._collect(2 * index, low, middle, runs)
+        self._collect(2 * index + 1, middle, high, runs)
+
+
+def non_colliding_shift(movable_rects, fixed_rects, step, direction):
+    """
+    Find the smallest number of steps to shift some rectangles horizontally by, so they don't overlap other rectangles.
+
+    Each movable rectangle overlapping a fixed one vertically forbids a range of shifts, worked out directly from their
+    x extents. The rectangles are swept by their top edge. At each one, the x extents of the rectangles of the other
+    side crossed by the sweep line are merged, so a column of rectangles overlapping each other only forbids one range,
+    rather than one per pair. Rectangles which only touch don't overlap, and rectangles without width never do.
+
+    Args:
+        movable_rects (list[tuple[float, float, float, float]]): (left, top, right, bottom) rectangles to shift
+        fixed_rects (list[tuple[float, float, float, float]]): (left, top, right, bottom) rectangles staying in place
+        step (float): Width of a step
+        direction (int): 1 to shift to the right, -1 to shift to the left
+
+    Returns:
+        int: Number of steps to shift by, signed with the direction
+    """
+    movable_rects = [rect for rect in movable_rects if rect[0] < rect[2]]
+    fixed_rects = [rect for rect in fixed_rects if rect[0] < rect[2]]
+    if not movable_rects or not fixed_rects:
+        return 0
+    sides = (movable_rects, fixed_rects)
+    covers = [_CoveredIntervals([x for rect in rects for x in (rect[0], rect[2])]) for rects in sides]
+    ends = []  # (bottom, side, index) heap of the rectangles crossed by the sweep line
+    blocked = []  # Ranges of step counts (first, last) which would overlap
+    # Fixed rectangles first among the ones with the same top, so a flat movable rectangle overlaps them
+    events = sorted((rect[1], 1 - side, index) for side, rects in enumerate(sides) for index, rect in enumerate(rects))
+    for top, order, index in events:
+        side = 1 - order
+        while ends and ends[0][0] <= top:
+            _bottom, ended_side, ended_index = heapq.heappop(ends)
+            ended = sides[ended_side][ended_index]
+            covers[ended_side].add(ended[0], ended[2], -1)
+        left, _top, right, bottom = sides[side][index]
+        for start, end in covers[1 - side].union():
+            # Merged extents forbid the union of the ranges of the rectangles they merge, as these ranges overlap
+            if side == 0:
+                movable_left, movable_right, fixed_left, fixed_right = left, right, start, end
+            else:
+                movable_left, movable_right, fixed_left, fixed_right = start, end, left, right
+            # Shifts (in direction, in DAG units) for which the x extents overlap, bounds excluded.
+            if direction > 0:
+                low, high = fixed_left - movable_right, fixed_right - movable_left
+            else:
+                low, high = movable_left - fixed_right, movable_right - fixed_left
+            first = int(math.floor(low / step)) + 1
+            last = int(math.ceil(high / step)) - 1
+            if last >= max(first, 0):
+                blocked.append((first, last))
+        covers[side].add(left, right)
+        heapq.heappush(ends, (bottom, side, index))
+
+    steps = 0
+    for first, last in sorted(blocked):
+        if first > steps:
+            break  # Found a gap
+        steps = max(steps, last + 1)
+    return steps * direction
+
+
+class SpatialGrid(object):
+    """
+    Uniform grid bucketing rectangles by the cells they overlap.
+
+    Any hashable object can be used as a key. Queries only test the rectangles stored in the visited cells,
+    so their cost depends on the local density of the graph rather than its total size.
+    """
+
+    def __init__(self, cell_size=128):
+        """
+        Args:
+            cell_size (int or float): Size of a grid cell, in DAG units.
+                Best results are achieved with a size close to that of a regular node.
+        """
+        self.cell_size = float(cell_size)
+        self._cells = defaultdict(set)
+        self._rects = {}
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, key):
+        return key in self._rects
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _cells_in_rect(self, rect):
+        left, top = self._cell(rect[0], rect[1])
+        right, bottom = self._cell(rect[2], rect[3])
+        for cell_x in range(left, right + 1):
+            for cell_y in range(top, bottom + 1):
+                yield cell_x, cell_y
+
+    def _cells_on_segment(self, x1, y1, x2, y2):
+        """ Walk the cells crossed by a segment, in order (Amanatides & Woo) """
+        cell_x, cell_y = self._cell(x1, y1)
+        end_x, end_y = self._cell(x2, y2)
+        dx = x2 - x1
+        dy = y2 - y1
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        if dx:
+            t_max_x = ((cell_x + (step_x > 0)) * self.cell_size - x1) / dx
+            t_delta_x = self.cell_size / abs(dx)
+        else:
+            t_max_x = t_delta_x = float('inf')
+        if dy:
+            t_max_y = ((cell_y + (step_y > 0)) * self.cell_size - y1) / dy
+            t_delta_y = self.cell_size / abs(dy)
+        else:
+            t_max_y = t_delta_y = float('inf')
+
+        yield cell_x, cell_y
+        # Iterate a fixed number of steps rather than until reaching the end cell, so float errors can't loop forever
+        for _step in range(abs(end_x - cell_x) + abs(end_y - cell_y)):
+            if t_max_x < t_max_y:
+                cell_x += step_x
+                t_max_x += t_delta_x
+            else:
+                cell_y += step_y
+                t_max_y += t_delta_y
+            yield cell_x, cell_y
+
+    def insert(self, key, rect):
+        """
+        Add or update a rectangle in the grid
+
+        Args:
+            key (object): Any hashable object identifying the rectangle
+            rect (tuple[float, float, float, float]): left, top, right, bottom
+        """
+        if key in self._rects:
+            self.remove(key)
+        rect = tuple(rect)
+        self._rects[key] = rect
+        for cell in self._cells_in_rect(rect):
+            self._cells[cell].add(key)
+
+    def remove(self, key):
+        """ Remove a rectangle from the grid. Unknown keys are ignored. """
+        rect = self._rects.pop(key, None)
+        if rect is None:
+            return
+        for cell in self._cells_in_rect(rect):
+            bucket = self._cells.get(cell)
+            if bucket is None:
+                continue
+            bucket.discard(key)
+            if not bucket:
+                del self._cells[cell]
+
+    def rect(self, key):
+        """ Return the rectangle stored for the key """
+        return self._rects[key]
+
+    def query_point(self, x, y):
+        """ Return the set of keys whose rectangle contains the point """
+        found = set()
+        for key in self._cells.get(self._cell(x, y), ()):
+            left, top, right, bottom = self._rects[key]
+            if left <= x <= right and top <= y <= bottom:
+                found.add(key)
+        return found
+
+    def query_rect(self, rect):
+        """ Return the set of keys whose rectangle intersects the provided one """
+        left, top, right, bottom = rect
+        found = set()
+        for cell in self._cells_in_rect(rect):
+            for key in self._cells.get(cell, ()):
+                if key in found:
+                    continue
+                other = self._rects[key]
+                if other[0] <= right and left <= other[2] and other[1] <= bottom and top <= other[3]:
+                    found.add(key)
+        return found
+
+    def query_segment(self, x1, y1, x2, y2):
+        """
+        Find all the rectangles crossed by a segment.
+
+        Returns:
+            list: keys of the crossed rectangles, in the order in which the segment enters them.
+        """
+        hits = {}
+        tested = set()
+        for cell in self._cells_on_segment(x1, y1, x2, y2):
+            for key in self._cells.get(cell, ()):
+                if key in tested:
+                    continue
+                tested.add(key)
+                t = segment_intersects_rect(x1, y1, x2, y2, self._rects[key])
+                if t is not None:
+                    hits[key] = t
+        return sorted(hits, key=hits.get)
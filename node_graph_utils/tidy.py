@@ -0,0 +1,212 @@
+"""
+Tidy .nk scripts without nuke.
+
+    python -m node_graph_utils.tidy [options] script.nk [script.nk ...]
+
+Applies the clean ups available as commands in nuke to the text of the scripts:
+- De-intersect: push overlapping nodes away from each other, like `dag.de_intersect`
+- Snap backdrops to their contents, like `backdrops.snap_backdrops_to_contents`
+- Layer backdrops, smaller ones in front, like `backdrops.auto_layer_backdrops`
+- Colour dots like the node they are connected to, like the auto dot color callbacks
+
+Scripts are parsed with `nk_parser`, and only the lines of the knobs which changed are rewritten, the rest of the
+script is copied byte for byte. Scripts are processed in parallel, one per worker process.
+
+This module does not depend on nuke or Qt.
+"""
+import argparse
+import sys
+
+from . import layout_engine
+from .nk_parser import DEFAULT_KNOBS, iter_nodes, set_knobs, snapshot_node
+from .partition import map_partitions
+from .snapshot import GraphSnapshot
+
+
+def layer_backdrops(snapshot, rects=None):
+    """
+    Give larger backdrops lower z_orders, so smaller backdrops are in front, like `backdrops.auto_layer_backdrops`.
+
+    Args:
+        snapshot (GraphSnapshot): Graph the backdrops are in
+        rects (dict[str, tuple[int, int, int, int]]): Current rectangle of the nodes which moved since the snapshot
+
+    Returns:
+        dict[str, int]: New z_order of each backdrop
+    """
+    rects = rects or {}
+
+    def area(backdrop):
+        left, top, right, bottom = rects.get(backdrop.id, backdrop.rect)
+        return (right - left) * (bottom - top)
+
+    z_orders = {}
+    current_index = 0
+    for backdrop in sorted(snapshot.backdrops(), key=area, reverse=True):
+        # Keep the odd/even z_order of each backdrop, auto_backdrop makes light or dark backdrops based on it
+        increment = 2 - (int(backdrop.knobs.get('z_order', 0)) - current_index) % 2
+        current_index += increment
+        z_orders[backdrop.id] = current_index
+    return z_orders
+
+
+def dot_colors(snapshot):
+    """
+    Colour dots like the first node above them which isn't a dot, like `colors.auto_dot_color_callback`.
+
+    Nodes using their class default colour (tile_color 0) are skipped, as only nuke knows the defaults.
+
+    Args:
+        snapshot (GraphSnapshot): Graph the dots are in
+
+    Returns:
+        dict[str, int]: New tile_color of each dot
+    """
+    colors = {}
+    for node in snapshot:
+        if node.node_class != 'Dot':
+            continue
+        parent = node
+        visited = set()
+        while parent is not None and parent.node_class == 'Dot' and parent.id not in visited:
+            visited.add(parent.id)
+            input_id = parent.inputs[0] if parent.inputs else None
+            parent = snapshot[input_id] if input_id in snapshot else None
+        if parent is None:
+            colors[node.id] = 0
+        elif parent.node_class != 'Dot' and parent.knobs.get('tile_color'):
+            colors[node.id] = parent.knobs['tile_color']
+    return colors
+
+
+def tidy_snapshot(snapshot, de_intersect=True, snap_backdrops=True, layer=True, color_dots=True):
+    """
+    Compute the clean ups of a graph.
+
+    Backdrops are snapped around the nodes they contained before de-intersecting, even if the nodes got pushed out.
+
+    Args:
+        snapshot (GraphSnapshot): Graph to tidy, usually a group of a script
+        de_intersect (bool): Push overlapping nodes away from each other
+        snap_backdrops (bool): Fit backdrops around their contents
+        layer (bool): Set the z_order of backdrops so smaller ones are in front
+        color_dots (bool): Colour dots like their input
+
+    Returns:
+        dict[str, dict[str, int]]: Knob values which changed, by node id
+    """
+    contents = {}
+    for backdrop in snapshot.backdrops():
+        contents[backdrop.id] = [node.id for node in snapshot.backdrop_contents(backdrop)]
+
+    rects = {}
+    if de_intersect:
+        rects.update(layout_engine.de_intersect_partitioned(snapshot))
+    if snap_backdrops:
+        rects.update(layout_engine.fit_backdrops(snapshot, contents, rects))
+
+    values = {}
+    for node_id, (left, top, right, bottom) in rects.items():
+        node = snapshot[node_id]
+        values[node_id] = {'xpos': left, 'ypos': top}
+        if node.is_backdrop:
+            values[node_id].update(bdwidth=right - left, bdheight=bottom - top)
+    if layer:
+        for node_id, z_order in layer_backdrops(snapshot, rects).items():
+            values.setdefault(node_id, {})['z_order'] = z_order
+    if color_dots:
+        for node_id, color in dot_colors(snapshot).items():
+            values.setdefault(node_id, {})['tile_color'] = color
+
+    changes = {}
+    for node_id, knobs in values.items():
+        node = snapshot[node_id]
+        current = {'xpos': node.x, 'ypos': node.y, 'bdwidth': node.width, 'bdheight': node.height,
+                   'z_order': node.knobs.get('z_order', 0), 'tile_color': node.knobs.get('tile_color', 0)}
+        changed = dict((name, value) for name, value in knobs.items() if value != current[name])
+        if changed:
+            changes[node_id] = changed
+    return changes
+
+
+def _format_knob(name, value):
+    """ Write a knob value like nuke does """
+    if name == 'tile_color':
+        return '0x{:08x}'.format(int(value) & 0xffffffff)
+    return '{}'.format(int(value))
+
+
+def tidy_file(path, de_intersect=True, snap_backdrops=True, layer=True, color_dots=True, dry_run=False):
+    """
+    Tidy a .nk script in place, see `tidy_snapshot` for the clean ups.
+
+    Args:
+        path (str): Path to the script
+        de_intersect (bool): see `tidy_snapshot`
+        snap_backdrops (bool): see `tidy_snapshot`
+        layer (bool): see `tidy_snapshot`
+        color_dots (bool): see `tidy_snapshot`
+        dry_run (bool): Only count the changes, leave the script as is
+
+    Returns:
+        int: Number of nodes changed
+    """
+    nodes = {}
+    snapshots = {}
+    for node in iter_nodes(path, DEFAULT_KNOBS):
+        nodes[node.full_name] = node
+        if node.group not in snapshots:
+            snapshots[node.group] = GraphSnapshot()
+        snapshots[node.group].add(snapshot_node(node))
+
+    changes = {}
+    for snapshot in snapshots.values():
+        changes.update(tidy_snapshot(snapshot, de_intersect, snap_backdrops, layer, color_dots))
+    if not changes or dry_run:
+        return len(changes)
+
+    set_knobs(path, dict((nodes[node_id], dict((name, _format_knob(name, value)) for name, value in values.items()))
+                         for node_id, values in changes.items()))
+    return len(changes)
+
+
+def _tidy_file_task(path, de_intersect, snap_backdrops, layer, color_dots, dry_run):
+    """ Worker entry point for `main`, reports errors rather than failing the other scripts """
+    try:
+        return tidy_file(path, de_intersect, snap_backdrops, layer, color_dots, dry_run), None
+    except Exception as error:
+        return None, '{}: {}'.format(type(error).__name__, error)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m node_graph_utils.tidy',
+                                     description='Tidy the node graph of .nk scripts, in place.')
+    parser.add_argument('scripts', nargs='+', metavar='script.nk', help='Scripts to tidy')
+    parser.add_argument('--no-de-intersect', dest='de_intersect', action='store_false',
+                        help="Don't push overlapping nodes away from each other")
+    parser.add_argument('--no-snap-backdrops', dest='snap_backdrops', action='store_false',
+                        help="Don't fit backdrops around their contents")
+    parser.add_argument('--no-layer-backdrops', dest='layer', action='store_false',
+                        help="Don't change the z_order of backdrops")
+    parser.add_argument('--no-dot-colors', dest='color_dots', action='store_false',
+                        help="Don't colour dots like their input")
+    parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing the scripts')
+    parser.add_argument('--workers', type=int, help='Number of worker processes, defaults to the number of cores')
+    args = parser.parse_args(argv)
+
+    tasks = [(path, args.de_intersect, args.snap_backdrops, args.layer, args.color_dots, args.dry_run)
+             for path in args.scripts]
+    failed = False
+    for path, (changed, error) in zip(args.scripts, map_partitions(_tidy_file_task, tasks,
+                                                                    max_workers=args.workers)):
+        if error:
+            failed = True
+            sys.stderr.write('{}: failed, {}\n'.format(path, error))
+        else:
+            action = 'to change' if args.dry_run else 'changed'
+            sys.stdout.write('{}: {} nodes {}\n'.format(path, changed, action))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
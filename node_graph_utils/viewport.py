@@ -0,0 +1,132 @@
+"""
+Cached DAG viewport transforms
+
+Reading the zoom and center of a DAG requires entering its group context and querying Nuke. Overlays need them on
+every paint and mouse move, so they are cached here per DAG widget, and only re-read after events which may have
+changed the view (wheel, pan, keyboard shortcuts, resize), on clicks, and when an overlay gets the viewport. Overlays
+subscribe to the `changed` signal.
+
+The viewport also records where the DAG was last clicked, see `dag.last_clicked_position`.
+"""
+import nuke
+from Qt import QtCore, QtGui
+
+from .dag import get_dag_node
+
+try:
+    # PySide2
+    from PySide2.QtOpenGL import QGLWidget as DagWidgetClass
+except ImportError:
+    # PySide6
+    from PySide6.QtOpenGLWidgets import QOpenGLWidget as DagWidgetClass
+
+
+class DagViewport(QtCore.QObject):
+    """ Zoom and center of a DAG widget, and the transform between DAG and widget coordinates. """
+
+    object_name = 'node_graph_utils_viewport'
+    changed = QtCore.Signal()
+
+    def __init__(self, dag_widget):
+        """
+        Use `get_viewport` rather than creating a viewport directly, so that all overlays share the same one.
+
+        Args:
+            dag_widget (QtWidgets.QWidget): The DAG widget. The viewport is parented to it and deleted with it.
+        """
+        super(DagViewport, self).__init__(dag_widget)
+        self.setObjectName(self.object_name)
+        self.dag_widget = dag_widget
+        self.dag_node = get_dag_node(dag_widget)
+
+        self.zoom = None
+        self.center = None
+        self.size = None
+        self.transform = QtGui.QTransform()
+        self.inverted_transform = QtGui.QTransform()
+        self._refresh_scheduled = False
+        self.last_click = None  # DAG coordinates of the last left click in the DAG, QPointF
+        self.refresh()
+
+        # Before Nuke 16 the events are received by a QGLWidget inside the DAG widget.
+        for widget in [dag_widget] + dag_widget.findChildren(DagWidgetClass):
+            widget.installEventFilter(self)
+
+    def refresh(self):
+        """
+        Read the zoom and center of the DAG, and update the transforms if they changed.
+
+        Returns:
+            bool: True if the view had changed, in which case the `changed` signal was emitted.
+        """
+        self._refresh_scheduled = False
+        with self.dag_node:
+            zoom = nuke.zoom()
+            center = QtCore.QPointF(*nuke.center())
+        size = self.dag_widget.size()
+        if zoom == self.zoom and center == self.center and size == self.size:
+            return False
+
+        self.zoom = zoom
+        self.center = center
+        self.size = size
+        offset = QtCore.QPointF(size.width() / 2.0, size.height() / 2.0) / zoom - center
+        transform = QtGui.QTransform()
+        transform.scale(zoom, zoom)
+        transform.translate(offset.x(), offset.y())
+        self.transform = transform
+        self.inverted_transform, _successful = transform.inverted()
+        self.changed.emit()
+        return True
+
+    def invalidate(self):
+        """ Schedule a refresh, once the DAG has processed the events currently in the queue """
+        if not self._refresh_scheduled:
+            self._refresh_scheduled = True
+            QtCore.QTimer.singleShot(0, self.refresh)
+
+    def map_to_dag(self, point):
+        """ Map a point from widget coordinates to DAG coordinates """
+        return self.inverted_transform.map(QtCore.QPointF(point))
+
+    def map_from_dag(self, point):
+        """ Map a point from DAG coordinates to widget coordinates """
+        return self.transform.map(QtCore.QPointF(point))
+
+    def eventFilter(self, widget, event):
+        """ Watch the events which may change the view, and clicks. Never filters them out """
+        event_type = event.type()
+        if event_type == QtCore.QEvent.MouseButtonPress and event.button() == QtCore.Qt.LeftButton:
+            # The view may have changed without an event, like when a script zooms or centers the DAG
+            self.refresh()
+            position = event.pos()
+            if widget is not self.dag_widget:
+                position = widget.mapTo(self.dag_widget, position)
+            self.last_click = self.map_to_dag(position)
+        elif event_type in [QtCore.QEvent.Wheel, QtCore.QEvent.Resize, QtCore.QEvent.KeyPress,
+                          QtCore.QEvent.MouseButtonRelease]:
+            self.invalidate()
+        elif event_type == QtCore.QEvent.MouseMove and event.buttons():
+            # Panning
+            self.invalidate()
+        return False
+
+
+def get_viewport(dag_widget):
+    """
+    Get the viewport of a DAG widget, creating it on first use.
+
+    An existing viewport is refreshed, as the view may have been changed by a script since its last event.
+
+    Args:
+        dag_widget (QtWidgets.QWidget): The DAG widget
+
+    Returns:
+        DagViewport
+    """
+    viewport = dag_widget.findChild(QtCore.QObject, DagViewport.object_name)
+    if viewport is None:
+        viewport = DagViewport(dag_widget)
+    else:
+        viewport.refresh()
+    return viewport
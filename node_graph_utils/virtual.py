@@ -0,0 +1,320 @@
+"""
+Virtual nodes, lightweight stand-ins for nuke nodes.
+
+Virtual nodes expose the small part of the nuke.Node API used to build and lay out node trees (class, knobs, inputs,
+position), but only live in python. Tools creating lots of nodes can build and move them freely, then create all the
+real nodes at once with `materialize_nodes`, which writes them as a .nk snippet and pastes it in a single call.
+
+Create them with `nodes`, which works like `nuke.nodes`:
+
+    grade = virtual.nodes.Grade(white=2, label='Brighter')
+    grade.setInput(0, virtual.nodes.Dot())
+"""
+import itertools
+import os
+import tempfile
+import weakref
+
+import nuke
+
+from .dag import SelectionSnapshot, clear_selection
+from .snapshot import default_node_size
+
+# Values returned for knobs which were not set, for the knobs read by the layout tools
+_KNOB_DEFAULTS = {
+    'label': '',
+    'note_font': 'Verdana',
+    'note_font_size': 11,
+    'tile_color': 0,
+    'z_order': 0,
+    'bdwidth': 100,
+    'bdheight': 100,
+}
+
+# Node classes which can't be connected to anything
+_NO_INPUTS = ('BackdropNode', 'StickyNote', 'Read')
+
+
+class VirtualKnob(object):
+    """ Minimal knob, only holds a value. Knobs which were only read are not stored on their node. """
+
+    def __init__(self, node, name, value=None):
+        self._node = node
+        self._name = name
+        self._value = value
+
+    def name(self):
+        return self._name
+
+    def fullyQualifiedName(self):
+        return '{}.{}'.format(self._node.fullName(), self._name)
+
+    def value(self):
+        return self._value
+
+    def getValue(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = value
+        self._node._knobs[self._name] = self
+        return True
+
+
+class VirtualNode(object):
+    """ Stand-in for a nuke node, see module docstring """
+
+    _counter = itertools.count(1)
+    _nodes_by_name = weakref.WeakValueDictionary()  # Living virtual nodes, so their names stay unique
+
+    def __init__(self, node_class, **knobs):
+        """
+        Args:
+            node_class (str): Class of the nuke node to create eventually, for example 'Grade'
+            **knobs: Knob values, like when calling `nuke.nodes.Grade(white=2)`
+        """
+        self._class = node_class
+        self._name = None
+        self.setName(knobs.pop('name', None))
+        self._xpos = int(knobs.pop('xpos', 0))
+        self._ypos = int(knobs.pop('ypos', 0))
+        self._inputs = []
+        self._selected = False
+        self._knobs = {}
+        for name, value in knobs.items():
+            self[name].setValue(value)
+
+    def __repr__(self):
+        return '<VirtualNode {} ({})>'.format(self._name, self._class)
+
+    def __getitem__(self, name):
+        knob = self._knobs.get(name)
+        if knob is None:
+            # Stored by setValue, only knobs which were set get written by `to_nk`
+            knob = VirtualKnob(self, name, _KNOB_DEFAULTS.get(name))
+        return knob
+
+    def knob(self, name):
+        return self[name]
+
+    def knobs(self):
+        return dict(self._knobs)
+
+    def Class(self):
+        return self._class
+
+    def name(self):
+        return self._name
+
+    def setName(self, name):
+        """ Rename the node. Without a name, or if another virtual node has it, a unique suffix is added. """
+        unique_name = name
+        while not unique_name or self._nodes_by_name.get(unique_name, self) is not self:
+            unique_name = '{}_virtual{}'.format(name or self._class, next(self._counter))
+        if self._nodes_by_name.get(self._name) is self:
+            del self._nodes_by_name[self._name]
+        self._name = unique_name
+        self._nodes_by_name[unique_name] = self
+
+    def fullName(self):
+        return self._name
+
+    # Position
+    def xpos(self):
+        return self._xpos
+
+    def ypos(self):
+        return self._ypos
+
+    def setXpos(self, x):
+        self._xpos = int(x)
+
+    def setYpos(self, y):
+        self._ypos = int(y)
+
+    def setXYpos(self, x, y):
+        self._xpos = int(x)
+        self._ypos = int(y)
+
+    def screenWidth(self):
+        if self._class == 'BackdropNode':
+            return int(self['bdwidth'].value())
+        return default_node_size(self._class)[0]
+
+    def screenHeight(self):
+        if self._class == 'BackdropNode':
+            return int(self['bdheight'].value())
+        return default_node_size(self._class)[1]
+
+    # Connections
+    def input(self, index):
+        if index < len(self._inputs):
+            return self._inputs[index]
+        return None
+
+    def inputs(self):
+        return len(self._inputs)
+
+    def maxInputs(self):
+        return 0 if self._class in _NO_INPUTS else 1 if self._class == 'Dot' else 99
+
+    def setInput(self, index, node):
+        if self._class in _NO_INPUTS:
+            return False
+        while len(self._inputs) <= index:
+            self._inputs.append(None)
+        self._inputs[index] = node
+        # Drop the trailing empty inputs, like nuke does
+        while self._inputs and self._inputs[-1] is None:
+            self._inputs.pop()
+        return True
+
+    def dependencies(self):
+        return [node for node in self._inputs if node is not None]
+
+    # Selection
+    def isSelected(self):
+        return self._selected
+
+    def setSelected(self, selected):
+        self._selected = bool(selected)
+
+
+class VirtualNodes(object):
+    """ Virtual node constructors, accessed by class name like `nuke.nodes` """
+
+    def __getattr__(self, node_class):
+        if node_class.startswith('_'):
+            raise AttributeError(node_class)
+
+        def create_node(**knobs):
+            return VirtualNode(node_class, **knobs)
+        return create_node
+
+
+nodes = VirtualNodes()
+
+
+def is_virtual(node):
+    return isinstance(node, VirtualNode)
+
+
+def _format_value(value):
+    """ Format a knob value the way it would be written in a .nk file """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return '{' + ' '.join(_format_value(v) for v in value) + '}'
+    value = '{}'.format(value)
+    for char, escaped in (('\\', '\\\\'), ('"', '\\"'), ('[', '\\['), (']', '\\]'), ('$', '\\$'), ('\n', '\\n')):
+        value = value.replace(char, escaped)
+    return '"{}"'.format(value)
+
+
+def _sorted_upstream_first(virtual_nodes):
+    """ Order the nodes so that each node comes after the virtual nodes it's connected to """
+    ordered = []
+    visited = set()
+    for start in virtual_nodes:
+        if id(start) in visited:
+            continue
+        visited.add(id(start))
+        stack = [(start, iter(start.dependencies()))]
+        while stack:
+            node, dependencies = stack[-1]
+            for dependency in dependencies:
+                if is_virtual(dependency) and id(dependency) not in visited:
+                    visited.add(id(dependency))
+                    stack.append((dependency, iter(dependency.dependencies())))
+                    break
+            else:
+                stack.pop()
+                ordered.append(node)
+    return ordered
+
+
+def to_nk(virtual_nodes):
+    """
+    Write virtual nodes as a .nk snippet, as would be found in a script or the clipboard.
+
+    Inputs are written with the nuke stack commands. Inputs which are not part of the snippet can't be written,
+    they are left disconnected.
+
+    Args:
+        virtual_nodes (list[VirtualNode]): Nodes to write. Virtual nodes they're connected to are written too.
+
+    Returns:
+        str: The .nk snippet
+    """
+    ordered = _sorted_upstream_first(virtual_nodes)
+    variables = {}
+    lines = []
+    for index, node in enumerate(ordered):
+        inputs = [variables.get(id(input_node)) for input_node in node._inputs]
+        while inputs and inputs[-1] is None:
+            inputs.pop()
+        # Nodes pop their inputs from the stack, input 0 being on top.
+        for variable in reversed(inputs):
+            lines.append('push ${}'.format(variable) if variable else 'push 0')
+        lines.append('{} {{'.format(node.Class()))
+        lines.append(' inputs {}'.format(len(inputs)))
+        for name, knob in sorted(node._knobs.items()):
+            if knob.value() is not None:
+                lines.append(' {} {}'.format(name, _format_value(knob.value())))
+        lines.append(' name {}'.format(_format_value(node.name())))
+        lines.append(' xpos {}'.format(node.xpos()))
+        lines.append(' ypos {}'.format(node.ypos()))
+        lines.append('}')
+        variables[id(node)] = 'ngu_virtual{}'.format(index)
+        lines.append('set {} [stack 0]'.format(variables[id(node)]))
+    return '\n'.join(lines) + '\n'
+
+
+def materialize_nodes(virtual_nodes):
+    """
+    Create real nuke nodes for virtual nodes, with a single paste.
+
+    Positions, knobs and connections are kept, including connections to nodes which already existed.
+    Nodes are renamed if their name is already in use.
+
+    Args:
+        virtual_nodes (list[VirtualNode]): Nodes to create. Virtual nodes they're connected to are created too.
+
+    Returns:
+        dict: Created nuke.Node, keyed by the virtual node they were made from
+    """
+    virtual_nodes = _sorted_upstream_first([node for node in virtual_nodes if is_virtual(node)])
+    if not virtual_nodes:
+        return {}
+
+    # Pasted nodes get renamed by nuke when their name is taken, ensure names are unique so we can find them back.
+    used_names = set()
+    for node in virtual_nodes:
+        name = base_name = node.name()
+        suffix = 1
+        while name in used_names or nuke.toNode(name) is not None:
+            name = '{}_{}'.format(base_name, suffix)
+            suffix += 1
+        node.setName(name)
+        used_names.add(node.name())
+
+    file_descriptor, path = tempfile.mkstemp(suffix='.nk')
+    try:
+        with SelectionSnapshot():
+            clear_selection()
+            with os.fdopen(file_descriptor, 'w') as snippet:
+                snippet.write(to_nk(virtual_nodes))
+            nuke.nodePaste(path)
+            pasted = dict((node.name(), node) for node in nuke.selectedNodes())
+            created = dict((node, pasted[node.name()]) for node in virtual_nodes)
+
+            # Connections to nodes which are not part of the paste
+            for node, real_node in created.items():
+                for index, input_node in enumerate(node._inputs):
+                    if input_node is not None and not is_virtual(input_node):
+                        real_node.setInput(index, input_node)
+            return created
+    finally:
+        os.remove(path)
@@ -0,0 +1,27 @@
+from node_graph_utils import crossings
+from node_graph_utils.snapshot import GraphSnapshot, SnapshotNode
+from node_graph_utils.spatial import overlapping_pairs
+
+
+def _node(node_id, x, y, inputs=(), width=80, height=18):
+    return SnapshotNode(node_id, 'Grade', x, y, width, height, list(inputs))
+
+
+def _crossing_graph(*extra_nodes):
+    # a and b are connected to the input above the other one, so their connections cross
+    return GraphSnapshot([_node('p', 0, 0), _node('q', 400, 0),
+                          _node('a', 0, 100, ['q']), _node('b', 400, 100, ['p'], width=300)] + list(extra_nodes))
+
+
+def test_reduce_crossings_swaps_neighbours():
+    snapshot = _crossing_graph()
+    rects = crossings.reduce_crossings(snapshot, ['a', 'b'])
+    assert crossings.count_crossings(snapshot, rects) == 0
+    assert overlapping_pairs(dict((node.id, rects.get(node.id, node.rect)) for node in snapshot)) == []
+
+
+def test_reduce_crossings_keeps_nodes_in_between():
+    # An unconnected node between the crossing nodes would be covered by the wide node once swapped
+    snapshot = _crossing_graph(_node('unconnected', 200, 100))
+    rects = crossings.reduce_crossings(snapshot, ['a', 'b', 'unconnected'])
+    assert overlapping_pairs(dict((node.id, rects.get(node.id, node.rect)) for node in snapshot)) == []
@@ -0,0 +1,63 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+import node_graph_utils  # noqa: F401, imported before faking nuke, so the package doesn't install its commands
+
+
+class _Knob(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class _Node(object):
+    def __init__(self, node_class, knob_names):
+        self._class = node_class
+        self._knobs = [_Knob(name) for name in knob_names]
+
+    def Class(self):
+        return self._class
+
+    def allKnobs(self):
+        return self._knobs
+
+
+@pytest.fixture
+def dag(monkeypatch):
+    """ dag module imported with a fake nuke which only knows about knob defaults and script load callbacks """
+    defaults = {}
+    script_load_callbacks = []
+    fake_nuke = types.ModuleType('nuke')
+    fake_nuke.knobDefault = defaults.get
+    fake_nuke.addOnScriptLoad = lambda callback: script_load_callbacks.append(callback)
+    fake_nuke.defaults = defaults
+    fake_nuke.script_load_callbacks = script_load_callbacks
+    fake_qt = types.ModuleType('Qt')
+    fake_qt.QtCore = fake_qt.QtWidgets = fake_qt.QtGui = None
+    monkeypatch.setitem(sys.modules, 'nuke', fake_nuke)
+    monkeypatch.setitem(sys.modules, 'Qt', fake_qt)
+    monkeypatch.delitem(sys.modules, 'node_graph_utils.dag', raising=False)
+    module = importlib.import_module('node_graph_utils.dag')
+    yield module
+    sys.modules.pop('node_graph_utils.dag', None)
+
+
+def test_class_knob_defaults_follow_changes(dag):
+    node = _Node('Blur', ['size', 'channels', 'mix'])
+    dag.nuke.defaults['Blur.size'] = '10'
+    assert dag.class_knob_defaults(node) == [('size', '10')]
+
+    # Changed defaults are used right away
+    dag.nuke.defaults['Blur.size'] = '20'
+    assert dag.class_knob_defaults(node) == [('size', '20')]
+
+    # New defaults are used once a script is loaded
+    dag.nuke.defaults['Blur.mix'] = '0.5'
+    for callback in dag.nuke.script_load_callbacks:
+        callback()
+    assert dag.class_knob_defaults(node) == [('size', '20'), ('mix', '0.5')]
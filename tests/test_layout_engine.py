@@ -0,0 +1,84 @@
+from node_graph_utils import layout_engine
+from node_graph_utils.snapshot import GraphSnapshot, SnapshotNode
+from node_graph_utils.spatial import overlapping_pairs
+
+
+def _node(node_id, x, y, inputs=(), width=80, height=18):
+    return SnapshotNode(node_id, 'Grade', x, y, width, height, list(inputs))
+
+
+def test_de_intersect_partitioned_resolves_pushes_into_other_parts():
+    # Pushing a away from b carries it onto c, which starts in another part
+    snapshot = GraphSnapshot([_node('a', 0, 0), _node('b', 0, 1), _node('c', 0, -220)])
+    rects = layout_engine.de_intersect_partitioned(snapshot)
+    assert overlapping_pairs(rects) == []
+
+
+def _backdrop(node_id, nodes, padding, z_order=0):
+    left, top, right, bottom = layout_engine._union([node.rect for node in nodes])
+    return SnapshotNode(node_id, 'BackdropNode', left - padding, top - 2 * padding, right - left + 2 * padding,
+                        bottom - top + 3 * padding, knobs={'z_order': z_order})
+
+
+def _contents(rects, backdrop_ids):
+    def inside(outer, inner):
+        return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+    return dict((backdrop_id, set(key for key, rect in rects.items()
+                                  if key != backdrop_id and inside(rects[backdrop_id], rect)))
+                for backdrop_id in backdrop_ids)
+
+
+def _check_backdrops(snapshot, rects):
+    """ Backdrops keep their contents, and don't overlap anything but their contents """
+    new_rects = dict((node.id, rects.get(node.id, node.rect)) for node in snapshot)
+    backdrop_ids = [backdrop.id for backdrop in snapshot.backdrops()]
+    contents = _contents(new_rects, backdrop_ids)
+    assert contents == _contents(dict((node.id, node.rect) for node in snapshot), backdrop_ids)
+    for key, other in overlapping_pairs(new_rects):
+        assert other in contents.get(key, ()) or key in contents.get(other, ())
+
+
+def test_layered_layout_keeps_backdrops_apart():
+    # Two backdrops of 5 nodes each, linked to each other and to nodes outside of them
+    snapshot = GraphSnapshot()
+    for name, offset, first_input in [('a', 0, []), ('b', 400, ['a2'])]:
+        nodes = []
+        for index in range(5):
+            inputs = ['{}{}'.format(name, index - 1)] if index else first_input
+            nodes.append(_node('{}{}'.format(name, index), offset + index * 30, index * 60, inputs))
+            snapshot.add(nodes[-1])
+        snapshot.add(_backdrop('backdrop_' + name, nodes, 20))
+    snapshot.add(_node('c0', 200, 400, ['a4', 'b4']))
+    snapshot.add(_node('c1', 900, 0, ['a1']))
+    rects = layout_engine.layered_layout(snapshot)
+    _check_backdrops(snapshot, rects)
+
+
+def test_layered_layout_nested_backdrops():
+    snapshot = GraphSnapshot()
+    previous = []
+    for index in range(8):
+        snapshot.add(_node('n{}'.format(index), (index % 3) * 120, index * 50, previous))
+        previous = ['n{}'.format(index)]
+    snapshot.add(_backdrop('inner', [snapshot['n3'], snapshot['n4']], 10, z_order=1))
+    snapshot.add(_backdrop('outer', [snapshot['inner'], snapshot['n2'], snapshot['n5']], 30))
+    rects = layout_engine.layered_layout(snapshot)
+    assert set(rects) == set(snapshot.nodes)
+    _check_backdrops(snapshot, rects)
+
+
+def test_layered_layout_partitioned_keeps_rows():
+    # Two unconnected parts, one above the other, stay one above the other
+    snapshot = GraphSnapshot([_node('a', 0, 0), _node('b', 0, 60, ['a']),
+                              _node('c', 0, 2000), _node('d', 0, 2060, ['c'])])
+    rects = layout_engine.layered_layout_partitioned(snapshot)
+    assert rects['c'][1] >= 2000 - 48
+    assert rects['c'][0] == rects['a'][0]
+    assert overlapping_pairs(rects) == []
+
+
+def test_layers_break_cycles_without_upward_edges():
+    # b is entered from a, and fed back by c once the cycle b -> d -> c is broken at b
+    inputs = {'a': [], 'b': ['a', 'c'], 'd': ['b'], 'c': ['d']}
+    layers = layout_engine._layers(['b', 'a', 'd', 'c'], inputs)
+    assert layers['a'] < layers['b'] < layers['d'] < layers['c']
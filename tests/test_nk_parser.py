@@ -0,0 +1,33 @@
+from node_graph_utils.nk_parser import iter_nodes, snapshot_node
+
+SCRIPT = '''Read {
+ inputs 0
+ file foo.exr
+ name Read1
+}
+Read {
+ inputs 0
+ postage_stamp false
+ name Read2
+}
+Grade {
+ label "one\\ntwo\\nthree"
+ name Grade1
+}
+Blur {
+ name Blur1
+}
+'''
+
+
+def test_snapshot_node_sizes(tmp_path):
+    path = tmp_path / 'script.nk'
+    path.write_text(SCRIPT)
+    sizes = {}
+    for node in iter_nodes(str(path)):
+        snapshot = snapshot_node(node)
+        sizes[snapshot.id] = (snapshot.width, snapshot.height)
+    assert sizes['Blur1'] == (80, 18)
+    assert sizes['Read2'] == (80, 18)
+    assert sizes['Read1'][1] > 18
+    assert sizes['Grade1'][1] > 18
@@ -0,0 +1,61 @@
+import itertools
+import math
+import random
+
+from node_graph_utils.spatial import non_colliding_shift, overlapping_pairs
+
+
+def _overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def test_overlapping_pairs_mixed_heights():
+    # One tall rectangle among regular nodes goes in its own height class
+    rng = random.Random(0)
+    rects = {}
+    for i in range(300):
+        x, y = rng.randint(0, 1000), rng.randint(0, 1000)
+        rects[i] = (x, y, x + 80, y + rng.choice((12, 18, 78)))
+    rects[300] = (500, -5000, 580, 5000)
+    expected = set((a, b) for a, b in itertools.combinations(rects, 2) if _overlap(rects[a], rects[b]))
+    pairs = overlapping_pairs(rects)
+    assert len(pairs) == len(expected)
+    assert set(tuple(sorted(pair)) for pair in pairs) == expected
+
+
+def _pairwise_shift(movable_rects, fixed_rects, step, direction):
+    """ Reference for `non_colliding_shift`, testing every pair of rectangles """
+    blocked = []
+    for movable in movable_rects:
+        for fixed in fixed_rects:
+            if not (movable[1] < fixed[3] and fixed[1] < movable[3]):
+                continue
+            if direction > 0:
+                low, high = fixed[0] - movable[2], fixed[2] - movable[0]
+            else:
+                low, high = movable[0] - fixed[2], movable[2] - fixed[0]
+            first = int(math.floor(low / step)) + 1
+            last = int(math.ceil(high / step)) - 1
+            if last >= max(first, 0):
+                blocked.append((first, last))
+    steps = 0
+    for first, last in sorted(blocked):
+        if first > steps:
+            break
+        steps = max(steps, last + 1)
+    return steps * direction
+
+
+def test_non_colliding_shift_tall_overlapping_columns():
+    rng = random.Random(1)
+    for _trial in range(20):
+        rects = []
+        for _index in range(200):
+            # A few columns of rectangles all overlapping each other vertically
+            x = rng.choice((0, 110, 220, 330)) + rng.randint(-20, 20)
+            y = rng.randint(0, 500)
+            rects.append((x, y, x + rng.choice((12, 80, 150)), y + rng.randint(18, 2000)))
+        movable_rects, fixed_rects = rects[:100], rects[100:]
+        for direction in (1, -1):
+            assert non_colliding_shift(movable_rects, fixed_rects, 110, direction) == \
+                _pairwise_shift(movable_rects, fixed_rects, 110, direction)